@@ -5,9 +5,11 @@ from task_queue.logger import logger
 from .config.config import get_task_queue_settings
 from .config import config
 
+__version__ = "1.16.0"
 
 __all__ = [
     "get_task_queue_settings",
     "config",
     "logger",
+    "__version__",
 ]
@@ -1,13 +1,13 @@
 """Wherein is contained the ApiClient class.
 """
-from typing import Dict, Any, Union, List, Tuple
+from typing import Dict, Any, Union, List, Tuple, Optional
 import warnings
 
-from pydantic import validate_call, PositiveInt
+from pydantic import validate_call, PositiveInt, PositiveFloat
 import requests
 
 from task_queue.queue_pydantic_models import QueueGetSizesModel, \
-    LookupQueueItemModel, QueueItemBodyType
+    LookupQueueItemModel, QueueItemBodyType, LookupStatePageModel
 from ..queues.queue_base import QueueBase, QueueItemStage
 
 warnings.filterwarnings(
@@ -27,13 +27,20 @@ class ApiClient(QueueBase):
     """
     api_base_url: str
     timeout: float = 5
+    # Priorities are checked by the queue behind the API, which answers with
+    # a 400 error if it does not support them.
+    supports_priorities = True
 
     def __init__(self, api_base_url: str, timeout: float = 5):
         self.api_base_url = api_base_url + "/api/v1/queue/"
         self.timeout = timeout
 
     @validate_call
-    def put(self, items: Dict[str, QueueItemBodyType]) -> None:
+    def put(
+        self,
+        items: Dict[str, QueueItemBodyType],
+        priorities: Optional[Dict[str, int]] = None
+    ) -> None:
         """Adds a new Item to the Queue in the WAITING stage.
 
         Parameters:
@@ -43,9 +50,18 @@ class ApiClient(QueueBase):
             pair, where key is the item ID and value is the queue item body.
             The item ID must be a string and the item body must be
             serializable.
+        priorities: dict (default=None)
+            Optional dictionary of item ID to integer priority. The request
+            fails if the queue behind the API does not support priorities.
         """
-        response = requests.post(f"{self.api_base_url}put", json=items, \
-                                 timeout=self.timeout)
+        if priorities is None:
+            response = requests.post(f"{self.api_base_url}put", json=items, \
+                                     timeout=self.timeout)
+        else:
+            response = requests.post(
+                f"{self.api_base_url}put/priorities",
+                json={"items": items, "priorities": priorities},
+                timeout=self.timeout)
         response.raise_for_status()
         # Notify user if there were any items skipped.
         if response.json():
@@ -53,49 +69,203 @@ class ApiClient(QueueBase):
                 warnings.warn(er)
 
     @validate_call
-    def get(self, n_items:PositiveInt=1) -> List[Tuple[str, Any]]:
+    def get(
+        self,
+        n_items:PositiveInt=1,
+        lease_owner:Optional[str]=None,
+        lease_sec:Optional[PositiveFloat]=None
+    ) -> List[Tuple[str, Any]]:
         """Gets the next n Items from the Queue, moving them to PROCESSING.
 
         Parameters:
         -----------
         n_items: int (default=1)
             Number of items to retrieve from Queue.
+        lease_owner: str (default=None)
+            Name of the consumer the Items are leased to. Required with
+            lease_sec.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the Items are not leased.
 
         Returns:
         ------------
         Returns a list of n_items from the Queue, as
         List[(queue_item_id, queue_item_body)]
         """
+        params = {}
+        if lease_sec is not None:
+            params = {"lease_owner": lease_owner, "lease_sec": lease_sec}
         response = requests.get(f"{self.api_base_url}get/{n_items}",
+                               params=params,
                                timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
+    @validate_call
+    def get_items(
+        self,
+        item_ids:List[str],
+        lease_owner:Optional[str]=None,
+        lease_sec:Optional[PositiveFloat]=None
+    ) -> List[Tuple[str, Any]]:
+        """Moves the given Items from WAITING to PROCESSING. Items that are
+        not WAITING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the Items are leased to. Required with
+            lease_sec.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the Items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        params = {}
+        if lease_sec is not None:
+            params = {"lease_owner": lease_owner, "lease_sec": lease_sec}
+        response = requests.post(f"{self.api_base_url}get_items",
+                                 json=item_ids,
+                                 params=params,
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @validate_call
+    def extend_lease(
+        self,
+        item_ids:List[str],
+        lease_owner:str,
+        lease_sec:PositiveFloat
+    ) -> List[str]:
+        """Extends the lease of PROCESSING Items held by `lease_owner` to
+        `lease_sec` seconds from now.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        response = requests.post(
+            f"{self.api_base_url}lease/extend",
+            json={
+                "item_ids": item_ids,
+                "lease_owner": lease_owner,
+                "lease_sec": lease_sec
+            },
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @validate_call
+    def ack_lease(self, item_ids:List[str], lease_owner:str) -> List[str]:
+        """Moves PROCESSING Items leased to `lease_owner` to SUCCESS.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        response = requests.post(
+            f"{self.api_base_url}lease/ack",
+            json={"item_ids": item_ids, "lease_owner": lease_owner},
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    @validate_call
+    def release_lease(self, item_ids:List[str], lease_owner:str) -> List[str]:
+        """Moves PROCESSING Items leased to `lease_owner` back to WAITING.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        response = requests.post(
+            f"{self.api_base_url}lease/release",
+            json={"item_ids": item_ids, "lease_owner": lease_owner},
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def expire_leases(self) -> List[str]:
+        """Moves the PROCESSING Items whose lease has expired back to
+        WAITING.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        response = requests.post(f"{self.api_base_url}lease/expire",
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
     @validate_call
     def peek(self, n_items:PositiveInt=1) -> List[Tuple[str, Any]]:
         return None
 
     @validate_call
     def success(self, queue_item_id:str) -> None:
-        """Moves a Queue Item from PROCESSING to SUCCESS.
+        """Moves a Queue Item from PROCESSING to SUCCESS. Raises an
+        HTTPError with status 404 if the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
         """
-        return None
+        response = requests.post(
+            f"{self.api_base_url}success/{queue_item_id}",
+            timeout=self.timeout)
+        response.raise_for_status()
 
     @validate_call
-    def fail(self, queue_item_id:str) -> None:
-        """Moves a Queue Item from PROCESSING to FAIL.
+    def fail(self, queue_item_id:str) -> bool:
+        """Moves a Queue Item from PROCESSING to FAIL, or back to WAITING if
+        the retry policy of the queue tries it again. Raises an HTTPError
+        with status 404 if the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
+
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
         """
-        return None
+        response = requests.post(
+            f"{self.api_base_url}fail/{queue_item_id}",
+            timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
 
     @validate_call
     def size(self, queue_item_stage:QueueItemStage) -> int:
@@ -168,6 +338,42 @@ class ApiClient(QueueBase):
         response.raise_for_status()
         return response.json()
 
+    @validate_call
+    def lookup_state_page(
+        self,
+        queue_item_stage:QueueItemStage,
+        page_size:PositiveInt=1000,
+        after:Optional[str]=None
+    ) -> Tuple[List[str], Optional[str]]:
+        """Lookup one page of the item ids in the current Queue stage, in
+        ascending order of item id. `iter_state` uses this to iterate over a
+        whole stage.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage
+            stage of Queue Item
+        page_size: int (default=1000)
+            Maximum number of item ids to return, at most 10000.
+        after: str (default=None)
+            Cursor returned with the previous page.
+
+        Returns:
+        ------------
+        Returns a tuple of the list of item ids in the page and the cursor for
+        the next page, which is None when there are no more pages.
+        """
+        params = {"page_size": page_size}
+        if after is not None:
+            params["after"] = after
+        response = requests.get(
+            f"{self.api_base_url}lookup_state/{queue_item_stage.name}/page",
+            params=params,
+            timeout=self.timeout)
+        response.raise_for_status()
+        page = LookupStatePageModel(**response.json())
+        return page.item_ids, page.next_after
+
     @validate_call
     def lookup_item(self, queue_item_id:str) -> LookupQueueItemModel:
         """Lookup an Item currently in the Queue.
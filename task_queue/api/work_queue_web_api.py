@@ -2,11 +2,12 @@
 API.
 """
 import warnings
+from contextlib import asynccontextmanager
 from dataclasses import dataclass, asdict
-from typing import Dict, Any, Annotated, Union, Tuple, List
+from typing import Dict, Any, Annotated, Union, Tuple, List, Optional
 from annotated_types import Ge, Le
 
-from pydantic import PositiveInt
+from pydantic import PositiveInt, PositiveFloat
 from fastapi import FastAPI, HTTPException
 
 # The imports for the different queue types try-catch blocks
@@ -18,16 +19,35 @@ from task_queue.queues import json_s3_queue
 from task_queue.queues import json_sql_queue
 
 from task_queue.queues.in_memory_queue import in_memory_queue
+from task_queue.queues.retry_policy import retry_policy_from_settings
+from task_queue.queues.lease_sweeper import LeaseSweeper
 from task_queue.logger import set_logger_level
 from task_queue.queues.queue_base import QueueItemStage
 from task_queue import config, logger
 from task_queue.queue_pydantic_models import QueueGetSizesModel, \
-    LookupQueueItemModel, QueueItemBodyType
+    LookupQueueItemModel, QueueItemBodyType, LookupStatePageModel, \
+    LeaseModel, LeaseExtendModel, PutPrioritiesModel
 
 api_settings = config.get_task_queue_settings(config.TaskQueueApiSettings)
 set_logger_level(api_settings.logger_level)
 api_settings.log_settings()
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    """Runs the lease sweeper while the API is up, unless
+    LEASE_SWEEP_SECONDS is 0.
+    """
+    sweeper = None
+    if api_settings.LEASE_SWEEP_SECONDS > 0:
+        sweeper = LeaseSweeper(queue, api_settings.LEASE_SWEEP_SECONDS)
+        sweeper.start()
+    yield
+    if sweeper is not None:
+        sweeper.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 @dataclass
@@ -45,8 +65,13 @@ class QueueSettings():
         """
         return QueueSettings()
 
-    def make_queue(self):
+    def make_queue(self, retry_policy=None):
         """Returns QueueBase object.
+
+        Parameters:
+        -----------
+        retry_policy: RetryPolicy (default=None)
+            Policy deciding which failed items are tried again.
         """
         raise NotImplementedError("make_queue not yet implemented.")
 
@@ -71,18 +96,28 @@ class S3QueueSettings(QueueSettings):
         s3_settings.log_settings()
         return S3QueueSettings(s3_settings.S3_QUEUE_BASE_PATH)
 
-    def make_queue(self):
+    def make_queue(self, retry_policy=None):
         """Creates and returns a JsonS3Queue.
         """
-        return json_s3_queue(self.s3_base_path)
+        return json_s3_queue(self.s3_base_path, retry_policy=retry_policy)
 
 
 @dataclass
+# One field per SQL queue setting, as read from the environment.
+# pylint: disable-next=too-many-instance-attributes
 class SqlQueueSettings(QueueSettings):
     """Class concerning the SQL queue settings.
     """
     connection_string : str
     queue_name : str
+    cache_sizes : bool = False
+    partial_index : bool = False
+    pool_size : int = 5
+    pool_max_overflow : int = 10
+    pool_pre_ping : bool = True
+    statement_timeout_ms : int = 0
+    notify : bool = False
+    migrate : bool = False
 
     @staticmethod
     def from_env():
@@ -110,16 +145,36 @@ class SqlQueueSettings(QueueSettings):
         return SqlQueueSettings(
             conn_str,
             sql_settings.SQL_QUEUE_NAME,
+            sql_settings.SQL_QUEUE_CACHE_SIZES,
+            sql_settings.SQL_QUEUE_PARTIAL_INDEX,
+            sql_settings.SQL_QUEUE_POOL_SIZE,
+            sql_settings.SQL_QUEUE_POOL_MAX_OVERFLOW,
+            sql_settings.SQL_QUEUE_POOL_PRE_PING,
+            sql_settings.SQL_QUEUE_STATEMENT_TIMEOUT_MS,
+            sql_settings.SQL_QUEUE_NOTIFY,
+            sql_settings.SQL_QUEUE_MIGRATE,
         )
 
-    def make_queue(self):
+    def make_queue(self, retry_policy=None):
         """Creates and returns a JSONSQLQueue.
         """
         # pylint: disable=import-outside-toplevel
-        from sqlalchemy import create_engine
+        from task_queue.sql_engine import get_sql_engine
+        engine = get_sql_engine(
+            self.connection_string,
+            pool_size=self.pool_size,
+            max_overflow=self.pool_max_overflow,
+            pool_pre_ping=self.pool_pre_ping,
+            statement_timeout_ms=self.statement_timeout_ms
+        )
         return json_sql_queue(
-            create_engine(self.connection_string),
-            self.queue_name
+            engine,
+            self.queue_name,
+            cache_sizes=self.cache_sizes,
+            partial_index=self.partial_index,
+            notify=self.notify,
+            retry_policy=retry_policy,
+            migrate=self.migrate
         )
 
 
@@ -138,10 +193,10 @@ class InMemoryQueueSettings(QueueSettings):
         """
         return InMemoryQueueSettings()
 
-    def make_queue(self):
+    def make_queue(self, retry_policy=None):
         """Returns QueueBase object.
         """
-        return in_memory_queue()
+        return in_memory_queue(retry_policy=retry_policy)
 
 
 def queue_settings_from_env():
@@ -162,8 +217,10 @@ def queue_settings_from_env():
         return InMemoryQueueSettings.from_env()
     return None
 
+retry_settings = config.get_task_queue_settings(config.TaskQueueRetrySettings)
+retry_settings.log_settings()
 queue_settings = queue_settings_from_env()
-queue = queue_settings.make_queue()
+queue = queue_settings.make_queue(retry_policy_from_settings(retry_settings))
 
 
 @app.get("/api/v1/queue/size/{queue_item_stage}")
@@ -240,6 +297,41 @@ async def lookup_queue_item_state(queue_item_stage: str) -> List[str]:
         raise HTTPException(status_code=400,
               detail=f"{queue_item_stage} not a Queue Item Stage") from exc
 
+@app.get("/api/v1/queue/lookup_state/{queue_item_stage}/page")
+async def lookup_queue_item_state_page(
+    queue_item_stage: str,
+    page_size: Annotated[int, Ge(1), Le(10000)] = 1000,
+    after: Optional[str] = None
+) -> LookupStatePageModel:
+    """API endpoint to look up one page of the item ids from a specific stage,
+    in ascending order of item id.
+
+    Parameters:
+    -----------
+    queue_item_stage: str
+        Desired Queue Item Stage (i.e. WAITING, FAIL)
+    page_size: int (default=1000)
+        Maximum number of item ids to return, at most 10000.
+    after: str (default=None)
+        The `next_after` cursor returned with the previous page.
+
+    Returns:
+    -----------
+    Returns the item ids in the page and the `next_after` cursor for the next
+    page, which is null on the last page.
+    """
+    try:
+        queue_item_stage_enum = QueueItemStage[queue_item_stage]
+    except KeyError as exc:
+        logger.error(exc)
+        raise HTTPException(status_code=400,
+              detail=f"{queue_item_stage} not a Queue Item Stage") from exc
+
+    item_ids, next_after = queue.lookup_state_page(
+        queue_item_stage_enum, page_size=page_size, after=after
+    )
+    return {"item_ids": item_ids, "next_after": next_after}
+
 @app.get("/api/v1/queue/lookup_item/{item_id}")
 async def lookup_queue_item(item_id:str) -> LookupQueueItemModel:
     """API endpoint to lookup an Item currently in the Queue.
@@ -276,21 +368,179 @@ async def describe_queue() -> Dict[str, Union[str, Dict[str,Any]]]:
     }
 
 @app.get("/api/v1/queue/get/{n_items}")
-async def get(n_items:PositiveInt=1) ->  List[Tuple[str, Any]]:
+async def get(
+    n_items:PositiveInt=1,
+    lease_owner: Optional[str] = None,
+    lease_sec: Optional[PositiveFloat] = None
+) ->  List[Tuple[str, Any]]:
     """API endpoint to get the next n Items from the Queue
     and move them to PROCESSING.
 
+    With `lease_sec`, the Items are leased to `lease_owner`, which must then
+    acknowledge them with `/lease/ack`, or they go back to WAITING once the
+    lease expires.
+
     Parameters:
     -----------
     n_items: int (default=1)
         Number of items to retrieve from Queue.
+    lease_owner: str (default=None)
+        Name of the consumer the Items are leased to. Required with
+        lease_sec.
+    lease_sec: float (default=None)
+        Duration of the lease. By default the Items are not leased.
 
     Returns:
     ----------
     Returns a list of n_items from the Queue, as
     List[(queue_item_id, queue_item_body)]
     """
-    return queue.get(n_items)
+    if lease_sec is None:
+        return queue.get(n_items)
+    if lease_owner is None:
+        raise HTTPException(status_code=400,
+                            detail="lease_owner is required with lease_sec")
+    return queue.get(n_items, lease_owner=lease_owner, lease_sec=lease_sec)
+
+@app.post("/api/v1/queue/get_items")
+def get_items(
+    item_ids: List[str],
+    lease_owner: Optional[str] = None,
+    lease_sec: Optional[PositiveFloat] = None
+) -> List[Tuple[str, Any]]:
+    """API endpoint to move the given Items from WAITING to PROCESSING,
+    leasing them as `/get` does when `lease_sec` is set.
+
+    Parameters:
+    -----------
+    item_ids: [str]
+        IDs of Queue Items
+    lease_owner: str (default=None)
+        Name of the consumer the Items are leased to. Required with
+        lease_sec.
+    lease_sec: float (default=None)
+        Duration of the lease. By default the Items are not leased.
+
+    Returns:
+    -----------
+    Returns the Items that were moved, in the order of item_ids, as
+    List[(queue_item_id, queue_item_body)]. Items that are not WAITING are
+    left out.
+    """
+    if lease_sec is None:
+        return queue.get_items(item_ids)
+    if lease_owner is None:
+        raise HTTPException(status_code=400,
+                            detail="lease_owner is required with lease_sec")
+    return queue.get_items(item_ids, lease_owner=lease_owner,
+                           lease_sec=lease_sec)
+
+@app.post("/api/v1/queue/lease/extend")
+def extend_lease(lease: LeaseExtendModel) -> List[str]:
+    """API endpoint to extend the lease of PROCESSING Items held by a
+    consumer to `lease_sec` seconds from now.
+
+    Parameters:
+    -----------
+    lease: LeaseExtendModel
+        IDs of the Items, the consumer holding their lease and the new
+        duration of the lease.
+
+    Returns:
+    -----------
+    Returns the IDs whose lease was extended. Items that are no longer
+    leased to the consumer are left out.
+    """
+    return queue.extend_lease(
+        lease.item_ids, lease.lease_owner, lease.lease_sec
+    )
+
+@app.post("/api/v1/queue/lease/ack")
+def ack_lease(lease: LeaseModel) -> List[str]:
+    """API endpoint to acknowledge leased Items, moving them from
+    PROCESSING to SUCCESS.
+
+    Parameters:
+    -----------
+    lease: LeaseModel
+        IDs of the Items and the consumer holding their lease.
+
+    Returns:
+    -----------
+    Returns the IDs that were moved. Items that are no longer leased to the
+    consumer, for example because their lease expired, are left out.
+    """
+    return queue.ack_lease(lease.item_ids, lease.lease_owner)
+
+@app.post("/api/v1/queue/lease/release")
+def release_lease(lease: LeaseModel) -> List[str]:
+    """API endpoint to give up leased Items, moving them from PROCESSING
+    back to WAITING.
+
+    Parameters:
+    -----------
+    lease: LeaseModel
+        IDs of the Items and the consumer holding their lease.
+
+    Returns:
+    -----------
+    Returns the IDs that were moved. Items that are no longer leased to the
+    consumer are left out.
+    """
+    return queue.release_lease(lease.item_ids, lease.lease_owner)
+
+@app.post("/api/v1/queue/lease/expire")
+def expire_leases() -> List[str]:
+    """API endpoint to move the PROCESSING Items whose lease has expired
+    back to WAITING.
+
+    Returns:
+    -----------
+    Returns the IDs that were moved.
+    """
+    return queue.expire_leases()
+
+@app.post("/api/v1/queue/success/{item_id}")
+def success(item_id:str) -> None:
+    """API endpoint to move an Item from PROCESSING to SUCCESS.
+
+    Parameters:
+    -----------
+    item_id: str
+        ID of Queue Item
+
+    Returns:
+    -----------
+    Returns nothing, or a 404 if the Item is not PROCESSING.
+    """
+    try:
+        queue.success(item_id)
+    except KeyError as exc:
+        logger.error(exc)
+        raise HTTPException(status_code=404,
+                            detail=f"{item_id} not in PROCESSING") from exc
+
+@app.post("/api/v1/queue/fail/{item_id}")
+def fail(item_id:str) -> bool:
+    """API endpoint to move an Item from PROCESSING to FAIL, or back to
+    WAITING if the retry policy of the queue tries it again.
+
+    Parameters:
+    -----------
+    item_id: str
+        ID of Queue Item
+
+    Returns:
+    -----------
+    Returns True if the Item will be retried, or a 404 if the Item is not
+    PROCESSING.
+    """
+    try:
+        return bool(queue.fail(item_id))
+    except KeyError as exc:
+        logger.error(exc)
+        raise HTTPException(status_code=404,
+                            detail=f"{item_id} not in PROCESSING") from exc
 
 @app.post("/api/v1/queue/requeue")
 def requeue(item_ids: str | list[str]) -> None:
@@ -337,8 +587,44 @@ async def put(items:Dict[str,QueueItemBodyType]) -> None:
     -----------
     List of skipped items or nothing.
     """
+    put_items(items)
+
+@app.post("/api/v1/queue/put/priorities")
+async def put_with_priorities(request: PutPrioritiesModel) -> None:
+    """API endpoint to add items to the Queue with a priority each.
+
+    Items with a higher priority are claimed first; items without one have
+    priority 0. Skipped items are reported as for `/put`.
+
+    Parameters:
+    -----------
+    request: PutPrioritiesModel
+        Dictionary of Queue Items, as for `/put`, and dictionary of item ID
+        to integer priority.
+
+    Returns:
+    -----------
+    List of skipped items or nothing.
+    """
+    try:
+        put_items(request.items, request.priorities)
+    except ValueError as exc:
+        logger.error(exc)
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+def put_items(items, priorities=None):
+    """Adds items to the Queue, raising an HTTPException with status code 200
+    that lists the skipped items, if any.
+
+    Parameters:
+    -----------
+    items: dict
+        Dictionary of Queue Items to add Queue.
+    priorities: dict (default=None)
+        Optional dictionary of item ID to integer priority.
+    """
     with warnings.catch_warnings(record=True) as warn:
-        queue.put(items)
+        queue.put(items, priorities=priorities)
         # warn
         if len(warn) > 0:
             warnings_list = [warn[i].message.args[0] for i in range(len(warn))]
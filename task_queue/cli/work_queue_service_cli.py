@@ -8,6 +8,13 @@ from task_queue.workers.work_queue import WorkQueue
 from task_queue.workers.process_queue_worker import ProcessQueueWorker
 from task_queue.workers.argo_workflows_queue_worker import (
                                                     ArgoWorkflowsQueueWorker)
+from task_queue.workers.log_archiver import (
+    LogArchiver,
+    LoggerLogSink,
+    DirectoryLogSink,
+    S3LogSink
+)
+from task_queue.wakeup import WakeupTrigger
 
 # The imports for the different queue types try-catch blocks
 # because we only want to try to include the modules necessary
@@ -21,6 +28,8 @@ from task_queue.events import SqlEventStore
 from task_queue.queues import QueueItemStage
 from task_queue.queues import memory_queue
 from task_queue.queues import event_queue
+from task_queue.queues.retry_policy import retry_policy_from_settings
+from task_queue.queues.lease_sweeper import LeaseSweeper
 from task_queue.job_release_strategy import (
     ProcessingLimit,
     ResourceLimit,
@@ -85,6 +94,19 @@ def validate_args(cli_args):
         errors.append(error)
         validation_success.append(valid)
 
+    log_sink_choice = cli_args.get('log_sink')
+
+    if log_sink_choice in (config.LogSinkChoices.DIRECTORY,
+                           config.LogSinkChoices.S3):
+        valid, error = validate_required_args_groups(
+            cli_args,
+            ['log_path'],
+            'log-sink',
+            config.LogSinkChoices(log_sink_choice).value
+        )
+        errors.append(error)
+        validation_success.append(valid)
+
     queue_implementation_choice = cli_args['queue_implementation']
 
     if queue_implementation_choice \
@@ -133,18 +155,34 @@ def validate_args(cli_args):
             )
             validation_success.append(False)
 
+    lease_seconds = cli_args.get('lease_seconds')
+    periodic_seconds = cli_args.get('periodic_seconds')
+    if lease_seconds is not None and not cli_args.get('lease_owner'):
+        errors.append("lease-owner is required with lease-seconds, and must "
+                      "stay the same across restarts so the service keeps "
+                      "renewing the leases of the jobs it already sent")
+        validation_success.append(False)
+    if lease_seconds is not None and periodic_seconds is not None \
+            and lease_seconds <= periodic_seconds:
+        errors.append(f"lease-seconds ({lease_seconds}) must be greater than "
+                      f"periodic-seconds ({periodic_seconds}), or leases "
+                      "expire before the worker extends them")
+        validation_success.append(False)
+
     all_valid = all(validation_success)
     error = "\n".join([ e for e in errors if e ])
 
     return all_valid, error
 
-def handle_worker_interface_choice(cli_settings):
+def handle_worker_interface_choice(cli_settings, wakeup_trigger=None):
     """Handles the worker interface choice.
 
     Parameters:
     -----------
     cli_settings: TaskQueueCliSettings
         Configuration object for the CLI
+    wakeup_trigger: WakeupTrigger (default=None)
+        Trigger for the process worker to notify when jobs exit.
 
     Returns:
     -----------
@@ -156,13 +194,54 @@ def handle_worker_interface_choice(cli_settings):
         return ArgoWorkflowsQueueWorker(
             cli_settings.worker_interface_id,
             cli_settings.endpoint,
-            cli_settings.namespace
+            cli_settings.namespace,
+            pool_size=cli_settings.argo_pool_size,
+            max_retries=cli_settings.argo_max_retries,
+            retry_backoff=cli_settings.argo_retry_backoff,
+            incremental_poll=cli_settings.argo_incremental_poll,
+            list_page_size=cli_settings.argo_list_page_size,
+            log_archiver=handle_log_sink_choice(cli_settings)
         )
     if cli_settings.worker_interface \
         == config.WorkerInterfaceChoices.PROCESS:
-        return ProcessQueueWorker(cli_settings.path_to_scripts)
+        return ProcessQueueWorker(
+            cli_settings.path_to_scripts,
+            wakeup_trigger=wakeup_trigger,
+            mode=cli_settings.process_mode.value,
+            pool_size=cli_settings.process_pool_size,
+            log_dir=cli_settings.process_log_dir,
+            log_retention=cli_settings.process_log_retention,
+            enforce_resources=cli_settings.process_enforce_resources,
+            cgroup_root=cli_settings.process_cgroup_root
+        )
     return None
 
+def handle_log_sink_choice(cli_settings):
+    """Handles the log sink choice.
+
+    Parameters:
+    -----------
+    cli_settings: TaskQueueCliSettings
+        Configuration object for the CLI
+
+    Returns:
+    -----------
+    Constructs the LogArchiver that saves the logs of finished jobs.
+    """
+    if cli_settings.log_sink == config.LogSinkChoices.DIRECTORY:
+        sink = DirectoryLogSink(cli_settings.log_path)
+    elif cli_settings.log_sink == config.LogSinkChoices.S3:
+        sink = S3LogSink(cli_settings.log_path)
+    else:
+        sink = LoggerLogSink()
+
+    return LogArchiver(
+        sink,
+        n_workers=cli_settings.log_archive_workers,
+        max_pending=cli_settings.log_archive_queue_size,
+        max_log_bytes=cli_settings.log_max_bytes
+    )
+
 def handle_queue_implementation_choice(cli_settings):
     """Handles the queue implementation choice.
 
@@ -175,38 +254,57 @@ def handle_queue_implementation_choice(cli_settings):
     -----------
     Constructs the queue implementation from the arguments.
     """
+    retry_settings = config.get_task_queue_settings(
+        setting_class = config.TaskQueueRetrySettings
+    )
+    retry_settings.log_settings()
+    retry_policy = retry_policy_from_settings(retry_settings)
+
+    # The SQL queue and the SQL event store share one engine, and so one
+    # connection pool.
+    engine = None
     if cli_settings.queue_implementation \
         == config.QueueImplementations.S3_JSON:
         s3_settings = config.get_task_queue_settings(
             setting_class = config.TaskQueueS3Settings
         )
         s3_settings.log_settings()
-        queue = json_s3_queue(cli_settings.s3_base_path)
+        queue = json_s3_queue(
+            cli_settings.s3_base_path, retry_policy=retry_policy
+        )
     elif cli_settings.queue_implementation \
         == config.QueueImplementations.SQL_JSON:
         # pylint: disable=import-outside-toplevel
-        from sqlalchemy import create_engine
+        from task_queue.sql_engine import sql_engine_from_settings
         sql_settings = config.get_task_queue_settings(
             setting_class = config.TaskQueueSqlSettings
         )
         sql_settings.log_settings()
+        engine = sql_engine_from_settings(
+            cli_settings.connection_string, sql_settings
+        )
         queue = json_sql_queue(
-            create_engine(cli_settings.connection_string),
-            cli_settings.queue_name
+            engine,
+            cli_settings.queue_name,
+            cache_sizes=sql_settings.SQL_QUEUE_CACHE_SIZES,
+            partial_index=sql_settings.SQL_QUEUE_PARTIAL_INDEX,
+            notify=sql_settings.SQL_QUEUE_NOTIFY,
+            retry_policy=retry_policy,
+            migrate=sql_settings.SQL_QUEUE_MIGRATE or cli_settings.migrate
         )
     elif cli_settings.queue_implementation \
          == config.QueueImplementations.IN_MEMORY:
-        queue = memory_queue()
+        queue = memory_queue(retry_policy=retry_policy)
 
     if cli_settings.with_queue_events:
         store = None
         if cli_settings.event_store_implementation \
             == config.EventStoreChoices.SQL_JSON:
-            # pylint: disable=import-outside-toplevel
-            from sqlalchemy import create_engine
-            store = SqlEventStore(
-                create_engine(cli_settings.connection_string)
-            )
+            if engine is None:
+                # pylint: disable=import-outside-toplevel
+                from task_queue.sql_engine import get_sql_engine
+                engine = get_sql_engine(cli_settings.connection_string)
+            store = SqlEventStore(engine)
         else:
             raise AttributeError("SQL_JSON is the only implemented event store"
                                   " that works with with_queue_events")
@@ -221,6 +319,93 @@ def handle_queue_implementation_choice(cli_settings):
     return queue
 
 
+def handle_wakeup_trigger_choice(cli_settings):
+    """Creates the trigger that wakes the service when the CLI is
+    event-driven.
+
+    Parameters:
+    -----------
+    cli_settings: TaskQueueCliSettings
+        Configuration object for the CLI
+
+    Returns:
+    -----------
+    Returns a WakeupTrigger, or None when event-driven is not set.
+    """
+    if not cli_settings.event_driven:
+        return None
+    return WakeupTrigger(cli_settings.wakeup_debounce_ms / 1000)
+
+
+def start_wakeup_sources(cli_settings, wakeup_trigger, worker_interface):
+    """Starts the background listeners that notify the wakeup trigger: the
+    SQL queue listener and the Argo Workflows event watch. The process
+    worker notifies the trigger itself.
+
+    Parameters:
+    -----------
+    cli_settings: TaskQueueCliSettings
+        Configuration object for the CLI
+    wakeup_trigger: WakeupTrigger
+        Trigger to notify. Nothing is started when None.
+    worker_interface: QueueWorkerInterface
+        Worker interface used by the service.
+
+    Returns:
+    -----------
+    Returns the list of started SQLQueueListeners.
+    """
+    listeners = []
+    if wakeup_trigger is None:
+        return listeners
+
+    if isinstance(worker_interface, ArgoWorkflowsQueueWorker):
+        worker_interface.start_watch(wakeup_trigger)
+
+    if cli_settings.queue_implementation \
+        == config.QueueImplementations.SQL_JSON:
+        # pylint: disable=import-outside-toplevel
+        from task_queue.sql_engine import sql_engine_from_settings
+        from task_queue.queues.sql_listener import SQLQueueListener
+        sql_settings = config.get_task_queue_settings(
+            setting_class = config.TaskQueueSqlSettings
+        )
+        if not sql_settings.SQL_QUEUE_NOTIFY:
+            logger.warning("event-driven is set but SQL_QUEUE_NOTIFY is "
+                           "not, new items are found by the periodic run.")
+        listener = SQLQueueListener(
+            sql_engine_from_settings(
+                cli_settings.connection_string, sql_settings
+            ),
+            cli_settings.queue_name,
+            wakeup_trigger
+        )
+        listener.start()
+        listeners.append(listener)
+
+    return listeners
+
+
+def handle_lease_choice(cli_settings, queue):
+    """Chooses the name the service leases items under, and starts a lease
+    sweeper on the queue, when lease-seconds is set.
+
+    Parameters:
+    -----------
+    cli_settings: TaskQueueCliSettings
+        Settings of the service.
+    queue: QueueBase
+        Queue the service takes items from.
+
+    Returns:
+    -----------
+    Returns the lease owner, or None when items are not leased.
+    """
+    if cli_settings.lease_seconds is None:
+        return None
+    LeaseSweeper(queue, cli_settings.periodic_seconds).start()
+    return cli_settings.lease_owner
+
 def handle_job_release_strategy_choice(cli_settings):
     """Handles the job release strategy choice.
 
@@ -237,7 +422,11 @@ def handle_job_release_strategy_choice(cli_settings):
     if cli_settings.resource_limits:
         job_release_strategy = ResourceLimit(
             cli_settings.resource_limits,
-            cli_settings.resource_key
+            cli_settings.resource_key,
+            reconcile_interval=cli_settings.resource_reconcile_interval,
+            admission=cli_settings.resource_admission.value,
+            lookahead=cli_settings.resource_lookahead,
+            max_skips=cli_settings.resource_max_skips
         )
     elif cli_settings.processing_limit:
         job_release_strategy = ProcessingLimit(
@@ -273,26 +462,46 @@ def start_jobs_with_processing_limit(max_processing_limit,
                 len(started_jobs))
 
 
-def main(job_release_strategy, work_queue, period_sec=10):
+def run_once(job_release_strategy, work_queue):
+    """Updates the job statuses, then releases new jobs.
+
+    Parameters:
+    -----------
+    job_release_strategy: JobReleaseStrategy
+        Strategy used to release new jobs.
+    work_queue: WorkQueue
+        Work Queue
+    """
+    logger.info("Updating job statuses")
+    work_queue.update_job_status()
+
+    logger.info("Releasing new jobs")
+    job_release_strategy.release_next_jobs(work_queue)
+
+
+def main(job_release_strategy, work_queue, period_sec=10,
+         wakeup_trigger=None):
     """Main function, runs functions periodically with a set time to wait.
 
     Parameters:
     -----------
-    periodic_functions: List[Callable[[], None]]
-        Functions to run periodically.
+    job_release_strategy: JobReleaseStrategy
+        Strategy used to release new jobs.
     work_queue: WorkQueue
         Work Queue
     period_sec: int (default=10)
         Number of seconds to wait between running periodic functions.
+    wakeup_trigger: WakeupTrigger (default=None)
+        When given, the functions also run as soon as the trigger is
+        notified. They still run every `period_sec` as a safety sweep.
     """
     while True:
-        logger.info("Updating job statuses")
-        work_queue.update_job_status()
-
-        logger.info("Releasing new jobs")
-        job_release_strategy.release_next_jobs(work_queue)
+        run_once(job_release_strategy, work_queue)
 
-        time.sleep(period_sec)
+        if wakeup_trigger is None:
+            time.sleep(period_sec)
+        else:
+            wakeup_trigger.wait(period_sec)
 
 
 if __name__ == "__main__":
@@ -312,22 +521,44 @@ if __name__ == "__main__":
         logger.error(error_string)
         raise ValueError("\n" + error_string)
 
+    unique_wakeup_trigger = handle_wakeup_trigger_choice(settings)
+
     unique_worker_interface = handle_worker_interface_choice(
-        settings
+        settings,
+        unique_wakeup_trigger
     )
 
     unique_queue = handle_queue_implementation_choice(
         settings,
     )
 
+    unique_lease_owner = handle_lease_choice(settings, unique_queue)
+
     unique_work_queue = WorkQueue(
         unique_queue,
-        unique_worker_interface
+        unique_worker_interface,
+        send_concurrency=settings.send_concurrency,
+        default_timeout_sec=settings.job_timeout_seconds,
+        timeout_key=settings.job_timeout_key,
+        lease_owner=unique_lease_owner,
+        lease_sec=settings.lease_seconds
     )
 
     unique_job_release_strategy = handle_job_release_strategy_choice(
         settings
     )
-    main(unique_job_release_strategy,
-         unique_work_queue,
-         settings.periodic_seconds)
+    start_wakeup_sources(
+        settings,
+        unique_wakeup_trigger,
+        unique_worker_interface
+    )
+    try:
+        main(unique_job_release_strategy,
+             unique_work_queue,
+             settings.periodic_seconds,
+             unique_wakeup_trigger)
+    finally:
+        unique_work_queue.close()
+        if isinstance(unique_worker_interface,
+                      (ProcessQueueWorker, ArgoWorkflowsQueueWorker)):
+            unique_worker_interface.close()
@@ -42,12 +42,32 @@ class EventStoreChoices(str, Enum):
     SQL_JSON = 'sql-json'
 
 
+class ResourceAdmissionChoices(str, Enum):
+    """Enum options for how the resource limit chooses jobs to start."""
+    FIFO = 'fifo'
+    BEST_FIT = 'best-fit'
+
+
 class WorkerInterfaceChoices(str, Enum):
     """Enum options for the available worker interfaces choices."""
     ARGO_WORKFLOWS = 'argo-workflows'
     PROCESS = 'process'
 
 
+class ProcessModeChoices(str, Enum):
+    """Enum options for how the process worker runs jobs."""
+    PROCESS = 'process'
+    POOL = 'pool'
+    POPEN = 'popen'
+
+
+class LogSinkChoices(str, Enum):
+    """Enum options for where the logs of finished jobs are saved."""
+    LOGGER = 'logger'
+    DIRECTORY = 'directory'
+    S3 = 's3'
+
+
 class TaskQueueBaseSetting(BaseSettings):
     """Core settings logic to add config_path and logging."""
     model_config = SettingsConfigDict(
@@ -81,6 +101,14 @@ class TaskQueueSqlSettings(TaskQueueBaseSetting):
     SQL_QUEUE_POSTGRES_USER: Optional[str] = None
     SQL_QUEUE_POSTGRES_PORT: int = 5432
     SQL_QUEUE_CONNECTION_STRING: Optional[str] = None
+    SQL_QUEUE_CACHE_SIZES: bool = False
+    SQL_QUEUE_PARTIAL_INDEX: bool = False
+    SQL_QUEUE_MIGRATE: bool = False
+    SQL_QUEUE_POOL_SIZE: int = 5
+    SQL_QUEUE_POOL_MAX_OVERFLOW: int = 10
+    SQL_QUEUE_POOL_PRE_PING: bool = True
+    SQL_QUEUE_STATEMENT_TIMEOUT_MS: int = 0
+    SQL_QUEUE_NOTIFY: bool = False
 
     @field_validator('SQL_QUEUE_CONNECTION_STRING')
     @classmethod
@@ -125,6 +153,16 @@ class TaskQueueS3Settings(TaskQueueBaseSetting):
         return v
 
 
+class TaskQueueRetrySettings(TaskQueueBaseSetting):
+    """Retry policy of failed items, shared by every queue implementation.
+    """
+    RETRY_MAX_ATTEMPTS: int = 1
+    RETRY_BACKOFF_SECONDS: float = 30.0
+    RETRY_BACKOFF_MULTIPLIER: float = 2.0
+    RETRY_MAX_BACKOFF_SECONDS: float = 3600.0
+    RETRY_JITTER: float = 0.5
+
+
 class TaskQueueApiSettings(TaskQueueBaseSetting):
     """Base settings for the task queue library REST API.
 
@@ -134,6 +172,9 @@ class TaskQueueApiSettings(TaskQueueBaseSetting):
     3) Defaults given here
     """
     QUEUE_IMPLEMENTATION: QueueImplementations = QueueImplementations.SQL_JSON
+    # Seconds between two sweeps returning items with expired leases to
+    # WAITING. 0 disables the sweeper.
+    LEASE_SWEEP_SECONDS: float = 30.0
 
 
 class TaskQueueCliSettings(TaskQueueBaseSetting,
@@ -179,11 +220,78 @@ class TaskQueueCliSettings(TaskQueueBaseSetting,
             "resources that this queue item uses."
         )
     )
+    resource_reconcile_interval : int = Field(
+        default=30,
+        alias='resource-reconcile-interval',
+        description=(
+            "Number of job releases between full recounts of the resources "
+            "used by processing jobs when resource-limits is set. In "
+            "between, the resources are tracked as jobs start and finish."
+        )
+    )
+    resource_admission : ResourceAdmissionChoices = Field(
+        default=ResourceAdmissionChoices.FIFO,
+        alias='resource-admission',
+        description=(
+            "How jobs are chosen when resource-limits is set. 'fifo' starts "
+            "jobs in queue order until one does not fit. 'best-fit' packs "
+            "the jobs that fit from the first resource-lookahead waiting "
+            "jobs, largest first."
+        )
+    )
+    resource_lookahead : int = Field(
+        default=100,
+        alias='resource-lookahead',
+        description="Number of waiting jobs considered by best-fit admission."
+    )
+    resource_max_skips : int = Field(
+        default=20,
+        alias='resource-max-skips',
+        description=(
+            "Number of releases a job can be passed over by best-fit "
+            "admission before no other job is started ahead of it."
+        )
+    )
     processing_limit : Optional[int] = Field(
         default=None,
         alias='processing-limit',
         description="Number of jobs to be run concurrently."
     )
+    send_concurrency : int = Field(
+        default=1,
+        alias='send-concurrency',
+        description="Number of jobs sent to the worker interface at once."
+    )
+    job_timeout_seconds : Optional[float] = Field(
+        default=None,
+        alias='job-timeout-seconds',
+        description="Seconds a job may run before it is stopped and moved "
+                    "to FAIL, for items that do not set their own timeout. "
+                    "By default jobs have no timeout."
+    )
+    job_timeout_key : str = Field(
+        default="timeout_sec",
+        alias='job-timeout-key',
+        description="Key of the item body holding the item's own timeout "
+                    "in seconds."
+    )
+    lease_seconds : Optional[float] = Field(
+        default=None,
+        alias='lease-seconds',
+        description="Lease taken on the items this service sends, renewed "
+                    "every periodic-seconds while they run. Items whose "
+                    "lease expires, for example because the service died "
+                    "before sending them, go back to WAITING. Must be "
+                    "longer than periodic-seconds. By default items are "
+                    "not leased."
+    )
+    lease_owner : Optional[str] = Field(
+        default=None,
+        alias='lease-owner',
+        description="Name the service leases items under, unique among the "
+                    "services sharing the queue and the same across "
+                    "restarts. Required with lease-seconds."
+    )
 
     periodic_seconds : int = Field(
         default=10,
@@ -191,6 +299,21 @@ class TaskQueueCliSettings(TaskQueueBaseSetting,
         description="Number of seconds to wait before checking if "
                     "additional jobs can be submitted."
     )
+    event_driven : bool = Field(
+        default=False,
+        alias='event-driven',
+        description="Also check for jobs to submit as soon as items are "
+                    "added to the queue or jobs finish, instead of only "
+                    "every periodic-seconds. Uses SQL queue notifications "
+                    "(SQL_QUEUE_NOTIFY must be set for every writer), "
+                    "process exits and the Argo Workflows event stream."
+    )
+    wakeup_debounce_ms : int = Field(
+        default=50,
+        alias='wakeup-debounce-ms',
+        description="With event-driven, milliseconds to gather further "
+                    "events after the first before checking for jobs."
+    )
     worker_interface_id : Optional[str] = Field(
         default=None,
         alias='worker-interface-id',
@@ -211,12 +334,121 @@ class TaskQueueCliSettings(TaskQueueBaseSetting,
                     "running. Required when worker-interface is set "
                     f"to {WorkerInterfaceChoices.ARGO_WORKFLOWS.value}"
     )
+    argo_pool_size : int = Field(
+        default=10,
+        alias='argo-pool-size',
+        description="Number of keep-alive connections to the ARGO "
+                    "Workflows API kept open for reuse."
+    )
+    argo_max_retries : int = Field(
+        default=3,
+        alias='argo-max-retries',
+        description="Number of times ARGO Workflows API reads and deletes "
+                    "are retried after connection errors or 429 and 5xx "
+                    "responses. Submissions are never retried."
+    )
+    argo_retry_backoff : float = Field(
+        default=0.5,
+        alias='argo-retry-backoff',
+        description="Backoff factor in seconds between ARGO Workflows API "
+                    "retries, doubled on every retry."
+    )
+    argo_incremental_poll : bool = Field(
+        default=False,
+        alias='argo-incremental-poll',
+        description="Keep ARGO Workflows statuses in a local cache, listed "
+                    "once and then updated from the workflow event stream, "
+                    "instead of listing every workflow on each poll."
+    )
+    argo_list_page_size : int = Field(
+        default=500,
+        alias='argo-list-page-size',
+        description="Number of workflows per page when listing for "
+                    "argo-incremental-poll."
+    )
+    log_sink : LogSinkChoices = Field(
+        default=LogSinkChoices.LOGGER,
+        alias='log-sink',
+        description="Where the ARGO Workflows logs of finished jobs are "
+                    "saved, in the background before the workflow is "
+                    "deleted. 'directory' and 's3' write one file per "
+                    "container under log-path."
+    )
+    log_path : Optional[str] = Field(
+        default=None,
+        alias='log-path',
+        description="Directory or S3 path the logs are written to. "
+                    "Required when log-sink is set to "
+                    f"{LogSinkChoices.DIRECTORY.value} or "
+                    f"{LogSinkChoices.S3.value}"
+    )
+    log_archive_workers : int = Field(
+        default=4,
+        alias='log-archive-workers',
+        description="Number of job logs saved at once."
+    )
+    log_archive_queue_size : int = Field(
+        default=1000,
+        alias='log-archive-queue-size',
+        description="Number of finished jobs that can wait for their logs "
+                    "to be saved. When full, workflows are deleted without "
+                    "saving their logs."
+    )
+    log_max_bytes : int = Field(
+        default=10 * 1024 * 1024,
+        alias='log-max-bytes',
+        description="Maximum number of bytes saved of each container log."
+    )
     path_to_scripts : Optional[str] = Field(
         default=None,
         description="Path to python scripts stored outside of task queue "
                     "source code. Required when worker-interface is set "
                     f"to {WorkerInterfaceChoices.PROCESS.value}"
     )
+    process_mode : ProcessModeChoices = Field(
+        default=ProcessModeChoices.PROCESS,
+        alias='process-mode',
+        description="How the process worker runs jobs. 'process' runs each "
+                    "script in a new python interpreter. 'pool' runs the "
+                    "run(args) function of each script in a pool of "
+                    "long-lived interpreters that import it once. 'popen' "
+                    "starts each script directly as a child process with "
+                    "its output written to log files."
+    )
+    process_pool_size : Optional[int] = Field(
+        default=None,
+        alias='process-pool-size',
+        description="Number of interpreters when process-mode is 'pool'. "
+                    "Defaults to the number of CPUs."
+    )
+    process_log_dir : Optional[str] = Field(
+        default=None,
+        alias='process-log-dir',
+        description="Directory of the job log files when process-mode is "
+                    "'popen'. Defaults to a new temporary directory."
+    )
+    process_log_retention : Optional[int] = Field(
+        default=None,
+        alias='process-log-retention',
+        description="Number of finished jobs whose log files are kept when "
+                    "process-mode is 'popen'. The files of older jobs are "
+                    "removed. Defaults to keeping them all."
+    )
+    process_enforce_resources : bool = Field(
+        default=False,
+        alias='process-enforce-resources',
+        description="Pin each process worker job declaring a 'cpu' resource "
+                    "to its own cores and limit the memory of jobs "
+                    "declaring a 'memory_mb' resource. Not available when "
+                    "process-mode is 'pool'."
+    )
+    process_cgroup_root : Optional[str] = Field(
+        default=None,
+        alias='process-cgroup-root',
+        description="Delegated cgroup v2 group to create a cgroup for each "
+                    "job in when process-enforce-resources is set. Without "
+                    "it, memory is limited with setrlimit."
+    )
     connection_string : Optional[str] = Field(
         default=None,
         alias='connection-string',
@@ -231,6 +463,14 @@ class TaskQueueCliSettings(TaskQueueBaseSetting,
                     "string. Required when queue-implementation "
                     f"is set to {QueueImplementations.SQL_JSON.value}"
     )
+    migrate : bool = Field(
+        default=False,
+        alias='migrate',
+        description="Add the columns and indexes of the current version to "
+                    "an existing SQL queue table before starting, as "
+                    "SQL_QUEUE_MIGRATE does. Required once when upgrading "
+                    "a queue table created by an earlier version."
+    )
     s3_base_path : Optional[str] = Field(
         default=None,
         alias='s3-base-path',
@@ -33,17 +33,48 @@ class ResourceLimit(JobReleaseStrategyBase):
     """
     Releases new jobs while there are resources available for the next queue
     items.
+
+    With `admission="fifo"` (the default), items are started in queue order
+    until the next item does not fit. With `admission="best-fit"`, the first
+    `lookahead` WAITING items are packed into the available resources
+    largest first, so small items can start while a large item at the head of
+    the queue waits. An item passed over `max_skips` times is no longer passed
+    over: nothing else starts until it fits.
+
+    The resources used by PROCESSING items are kept in a running ledger. It
+    is seeded from the queue on the first release, then updated as the work
+    queue starts and finishes jobs, and fully recomputed from the queue every
+    `reconcile_interval` releases to correct any drift (for example from
+    items moved by another process).
     """
 
+    # Pylint does not like more than 5 parameters or 7 attributes. The
+    # admission options are keyword-only.
+    # pylint: disable=too-many-arguments
+    # pylint: disable=too-many-instance-attributes
     def __init__(
             self,
             resource_limits:dict[str, int],
             resource_key:str="resources",
-            peek_batch_size=10
+            peek_batch_size=10,
+            *,
+            reconcile_interval=30,
+            admission="fifo",
+            lookahead=100,
+            max_skips=20
         ):
+        if admission not in ("fifo", "best-fit"):
+            raise ValueError(
+                f"admission must be 'fifo' or 'best-fit', not {admission!r}"
+            )
+
         self.resource_key = resource_key
         self.resource_limits = resource_limits.copy()
         self.peek_batch_size=peek_batch_size
+        self.reconcile_interval = reconcile_interval
+        self.admission = admission
+        self.lookahead = lookahead
+        self.max_skips = max_skips
 
         # So we can add a negative number to do a subtraction later.
         self.negative_resource_limits = {
@@ -51,30 +82,111 @@ class ResourceLimit(JobReleaseStrategyBase):
             for k,v in self.resource_limits.items()
         }
 
+        self._work_queue = None
+        self._releases_since_reconcile = 0
+        # Total resources used by PROCESSING items.
+        self._resources_used = {}
+        # Resources of the jobs started since the last reconciliation, so
+        # they can be released without looking up the item.
+        self._reservations = {}
+        # Number of releases in which a WAITING item was passed over by the
+        # best-fit admission.
+        self._skip_counts = {}
+        # Items that need more than the resource limits, already warned about.
+        self._oversized_ids = set()
 
-    def release_next_jobs(self, work_queue):
-        jobs_processing = work_queue.queue.lookup_state(
-            QueueItemStage.PROCESSING
-        )
+    def jobs_started(self, items):
+        """Adds the resources of jobs sent by the work queue to the ledger.
+
+        Parameters:
+        -----------
+        items: List[Tuple[str, Any]]
+            (queue_item_id, queue_item_body) of the jobs that were sent.
+        """
+        for item_id, item_body in items:
+            resources = self.filter_by_available_resources(
+                item_body.get(self.resource_key, {})
+            )
+            self._reservations[item_id] = resources
+            self._resources_used = sum_dictionaries(
+                [self._resources_used, resources]
+            )
+
+    def jobs_finished(self, item_ids):
+        """Removes the resources of jobs that left PROCESSING from the ledger.
+
+        Parameters:
+        -----------
+        item_ids: List[str]
+            IDs of the jobs that finished.
+        """
+        for item_id in item_ids:
+            resources = self._reservations.pop(item_id, None)
+            if resources is None:
+                # Started before the ledger was last reconciled.
+                resources = self.filter_by_available_resources(
+                    self._work_queue.queue
+                    .lookup_item(item_id)["item_body"]
+                    .get(self.resource_key, {})
+                )
+            self._resources_used = sum_dictionaries([
+                self._resources_used,
+                {k: -v for k, v in resources.items()}
+            ])
 
-        resources_used_by_processing = sum_dictionaries(
-            (
-                work_queue.queue
-                .lookup_item(item_id)["item_body"]
-                .get(self.resource_key, {})
+    def reconcile(self):
+        """Recomputes the resources used by PROCESSING items from the queue,
+        replacing the ledger.
+        """
+        resources_used = self.filter_by_available_resources(
+            self._work_queue.queue.sum_resources(
+                QueueItemStage.PROCESSING,
+                self.resource_key
             )
-            for item_id in jobs_processing
         )
+        ledger = {k: v for k, v in self._resources_used.items() if v != 0}
+        if self._releases_since_reconcile > 0 and resources_used != ledger:
+            logger.warning(
+                "ResourceLimit.reconcile: Ledger %s drifted from queue %s",
+                ledger,
+                resources_used
+            )
+
+        self._resources_used = resources_used
+        self._reservations = {}
+        self._releases_since_reconcile = 0
+
+    def _track(self, work_queue):
+        """Starts keeping the ledger for `work_queue`.
+        """
+        self._work_queue = work_queue
+        work_queue.add_jobs_started_callback(self.jobs_started)
+        work_queue.add_jobs_finished_callback(self.jobs_finished)
+        self._releases_since_reconcile = 0
+        self.reconcile()
+
+    def release_next_jobs(self, work_queue):
+        if work_queue is not self._work_queue:
+            self._track(work_queue)
+        elif self.reconcile_interval is not None \
+                and self._releases_since_reconcile >= self.reconcile_interval:
+            self.reconcile()
+        self._releases_since_reconcile += 1
 
         negative_available_resources = sum_dictionaries(
-            [
-                self.filter_by_available_resources(
-                    resources_used_by_processing
-                ),
-                self.negative_resource_limits
-            ]
+            [self._resources_used, self.negative_resource_limits]
         )
 
+        if any_value_positive(negative_available_resources) \
+                and self._releases_since_reconcile > 1:
+            # The ledger may have drifted, check against the queue before
+            # deciding we are overcommitted.
+            self.reconcile()
+            self._releases_since_reconcile += 1
+            negative_available_resources = sum_dictionaries(
+                [self._resources_used, self.negative_resource_limits]
+            )
+
         # Sanity check - we're not already overcommitted on resources.
         assert not any_value_positive(negative_available_resources)
 
@@ -83,6 +195,13 @@ class ResourceLimit(JobReleaseStrategyBase):
             { k:-v for k,v in negative_available_resources.items() }
         )
 
+        if self.admission == "best-fit":
+            self._release_best_fit(
+                work_queue,
+                { k:-v for k,v in negative_available_resources.items() }
+            )
+            return
+
         done = False
         total_jobs_pushed = 0
         while not done:
@@ -127,6 +246,134 @@ class ResourceLimit(JobReleaseStrategyBase):
             total_jobs_pushed
         )
 
+    def _release_best_fit(self, work_queue, available_resources):
+        """Starts the WAITING items in the lookahead window that fit in the
+        available resources, largest first.
+
+        Parameters:
+        -----------
+        work_queue: WorkQueue
+            Work queue to start the jobs on.
+        available_resources: dict
+            Resources available for new jobs.
+        """
+        seen_ids = set()
+        started_ids = set()
+        skipped_ids = set()
+        while True:
+            window = work_queue.queue.peek(self.lookahead)
+            seen_ids.update(item_id for item_id, _ in window)
+
+            chosen_ids, blocked = self._pack(window, available_resources)
+            if chosen_ids:
+                work_queue.push_jobs(chosen_ids)
+                started_ids.update(chosen_ids)
+
+                # Items ahead of a started item in the queue were skipped.
+                window_ids = [item_id for item_id, _ in window]
+                last_position = max(
+                    window_ids.index(item_id) for item_id in chosen_ids
+                )
+                chosen = set(chosen_ids)
+                skipped_ids.update(
+                    item_id for item_id in window_ids[:last_position]
+                    if item_id not in chosen
+                    and item_id not in self._oversized_ids
+                )
+
+            if blocked or not chosen_ids:
+                break
+
+        # Only keep the skip counts of items still waiting in the window,
+        # and count each skipped item once per release.
+        skipped_ids -= started_ids
+        self._skip_counts = {
+            item_id: self._skip_counts.get(item_id, 0)
+            + (1 if item_id in skipped_ids else 0)
+            for item_id in seen_ids - started_ids
+            if item_id in skipped_ids or item_id in self._skip_counts
+        }
+        self._oversized_ids &= seen_ids
+
+        logger.info(
+            "ResourceLimit.release_next_jobs: Started %s jobs",
+            len(started_ids)
+        )
+
+    def _pack(self, window, available_resources):
+        """Chooses the items of the window to start, subtracting their
+        resources from `available_resources`.
+
+        Items passed over `max_skips` times are considered first, in queue
+        order. If one of them does not fit, nothing after it is started. The
+        other items are packed first-fit-decreasing by their share of the
+        resource limits.
+
+        Parameters:
+        -----------
+        window: List[Tuple[str, Any]]
+            (queue_item_id, queue_item_body) of WAITING items in queue order.
+        available_resources: dict
+            Resources available for new jobs, updated in place.
+
+        Returns:
+        -----------
+        Returns the list of item ids to start, and whether an aged item is
+        blocking the others.
+        """
+        aged = []
+        candidates = []
+        for position, (item_id, item_body) in enumerate(window):
+            resources = self.filter_by_available_resources(
+                item_body.get(self.resource_key, {})
+            )
+            if any(
+                v > self.resource_limits[k] for k, v in resources.items()
+            ):
+                if item_id not in self._oversized_ids:
+                    logger.warning(
+                        "ResourceLimit: Item %s needs %s, more than the "
+                        "resource limits. It will not be started.",
+                        item_id,
+                        resources
+                    )
+                    self._oversized_ids.add(item_id)
+                continue
+
+            if self._skip_counts.get(item_id, 0) >= self.max_skips:
+                aged.append((item_id, resources))
+            else:
+                size = sum(
+                    v / self.resource_limits[k]
+                    for k, v in resources.items()
+                    if self.resource_limits[k] > 0
+                )
+                candidates.append((-size, position, item_id, resources))
+
+        chosen_ids = []
+
+        def fits(resources):
+            return all(
+                v <= available_resources.get(k, 0)
+                for k, v in resources.items()
+            )
+
+        def take(item_id, resources):
+            chosen_ids.append(item_id)
+            for k, v in resources.items():
+                available_resources[k] -= v
+
+        for item_id, resources in aged:
+            if not fits(resources):
+                return chosen_ids, True
+            take(item_id, resources)
+
+        for _, _, item_id, resources in sorted(candidates):
+            if fits(resources):
+                take(item_id, resources)
+
+        return chosen_ids, False
+
     def filter_by_available_resources(self, resource_dict):
         """
         Removes keys in the dictionary that are not in this object's
@@ -3,7 +3,7 @@ inputs and outputs of the API and Client, when applicable."""
 import json
 from typing import Any, Annotated, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PositiveFloat
 from pydantic.functional_validators import AfterValidator
 
 from task_queue.queues.queue_base import QueueItemStage
@@ -38,8 +38,33 @@ class LookupQueueItemModel(BaseModel):
     status : QueueItemStage
     item_body : QueueItemBodyType
 
+class LookupStatePageModel(BaseModel):
+    """A Pydantic model representing the return dictionary for the
+    /lookup_state/{queue_item_stage}/page endpoint and lookup_state_page() in
+    client."""
+    item_ids : list[str]
+    next_after : Optional[str] = None
+
+class LeaseModel(BaseModel):
+    """A Pydantic model representing the request body of the /lease/ack and
+    /lease/release endpoints."""
+    item_ids : list[str]
+    lease_owner : str
+
+class LeaseExtendModel(LeaseModel):
+    """A Pydantic model representing the request body of the /lease/extend
+    endpoint."""
+    lease_sec : PositiveFloat
+
+class PutPrioritiesModel(BaseModel):
+    """A Pydantic model representing the request body of the
+    /put/priorities endpoint."""
+    items : dict[str, QueueItemBodyType]
+    priorities : dict[str, int]
+
 class ProcessWorkerModel(BaseModel):
     """A Pydantic model representing the requried dictionary for the process
     worker to run properly."""
     file_name : str
     args : Optional[list[str]] = None
+    resources : Optional[dict[str, float]] = None
@@ -34,6 +34,8 @@ except ModuleNotFoundError:
 from .in_memory_queue import in_memory_queue as memory_queue
 from .queue_with_events import queue_with_events as event_queue
 from .queue_base import QueueBase, QueueItemStage
+from .retry_policy import RetryPolicy
+from .lease_sweeper import LeaseSweeper
 
 __all__ = (
     "json_sql_queue",
@@ -41,5 +43,7 @@ __all__ = (
     "memory_queue",
     "event_queue",
     "QueueBase",
-    "QueueItemStage"
+    "QueueItemStage",
+    "RetryPolicy",
+    "LeaseSweeper"
 )
@@ -0,0 +1,47 @@
+"""Wherein is contained the BackgroundThread class, the base of the helpers
+that run a loop in a daemon thread until they are stopped.
+"""
+import threading
+
+
+class BackgroundThread:
+    """Runs `run` in a daemon thread between `start` and `stop`.
+
+    Subclasses implement `run`, which must return soon after `_stop` is set.
+    """
+
+    def __init__(self, thread_name):
+        """Initializes BackgroundThread.
+
+        Parameters:
+        -----------
+        thread_name: str
+            Name given to the thread.
+        """
+        self.thread_name = thread_name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts `run` in a daemon thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self.run,
+            name=self.thread_name,
+            daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops the loop and waits for the thread to exit.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self):
+        """Loops until `_stop` is set.
+        """
+        raise NotImplementedError
@@ -1,16 +1,22 @@
 """Wherein is contained the class and functions for the In Memory Queue.
 """
 from dataclasses import dataclass, field
-from typing import Dict, Any
+from functools import wraps
+from typing import Dict, Any, Tuple
+import heapq
 import itertools
 import json
+import threading
+import time
 
 from task_queue import logger
 from .queue_base import QueueBase, QueueItemStage
 
 
+# One field per stage and per retry or lease map, which are kept flat so
+# the queue is easy to inspect in tests.
 @dataclass
-class MemoryQueue():
+class MemoryQueue():  # pylint: disable=too-many-instance-attributes
     """Queue items are objects in a python dictionary.
 
     Primarily used for prototyping and testing.
@@ -20,6 +26,17 @@ class MemoryQueue():
     success : Dict[str, Any] = field(default_factory=dict)
     fail : Dict[str, Any] = field(default_factory=dict)
     index : set[str] = field(default_factory=set)
+    # WAITING items whose retry is not due yet, with a heap of their
+    # (not_before, item_id).
+    delayed : Dict[str, Any] = field(default_factory=dict)
+    retry_heap : list = field(default_factory=list)
+    # Number of failed attempts of each item.
+    attempts : Dict[str, int] = field(default_factory=dict)
+    # (lease_owner, lease_expires) of leased PROCESSING items, with a heap of
+    # their (lease_expires, item_id). Extending a lease leaves its old heap
+    # entry behind, which is skipped when popped.
+    leases : Dict[str, Tuple[str, float]] = field(default_factory=dict)
+    lease_heap : list = field(default_factory=list)
 
 
     def regenerate_index(self):
@@ -27,6 +44,7 @@ class MemoryQueue():
         """
         ids_in_queue = (
             list(self.waiting.keys())
+            + list(self.delayed.keys())
             + list(self.processing.keys())
             + list(self.success.keys())
             + list(self.fail.keys())
@@ -51,6 +69,8 @@ class MemoryQueue():
         """
         match stage:
             case QueueItemStage.WAITING:
+                if self.delayed:
+                    return {**self.waiting, **self.delayed}
                 return self.waiting
             case QueueItemStage.PROCESSING:
                 return self.processing
@@ -60,15 +80,53 @@ class MemoryQueue():
                 return self.fail
 
 
+def synchronized(method):
+    """Makes a method of InMemoryQueue hold the queue's lock while it runs.
+    """
+    @wraps(method)
+    def locked_method(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked_method
+
+
 class InMemoryQueue(QueueBase):
     """Creates the In Memory Queue.
+
+    Every public method holds a reentrant lock, so the queue can be shared
+    with a LeaseSweeper thread or the threads of the web API.
     """
-    def __init__(self):
+    def __init__(self, retry_policy=None, clock=time.time):
         """Initializes the QueueBase class.
+
+        Parameters:
+        -----------
+        retry_policy: RetryPolicy (default=None)
+            Policy deciding which failed items go back to WAITING, and when.
+        clock: Callable[[], float] (default=time.time)
+            Returns the current time in seconds, for retry delays and lease
+            expiry. Tests pass a fake clock to control time.
         """
         self.memory_queue = MemoryQueue()
+        self.retry_policy = retry_policy
+        self.clock = clock
+        self.lock = threading.RLock()
 
-    def put(self, items):
+    def _release_due_items(self):
+        """Moves the delayed items whose retry is due to the end of WAITING.
+        """
+        retry_heap = self.memory_queue.retry_heap
+        now = self.clock()
+        while retry_heap and retry_heap[0][0] <= now:
+            _, item_id = heapq.heappop(retry_heap)
+            move_dict_item(
+                self.memory_queue.delayed,
+                self.memory_queue.waiting,
+                item_id
+            )
+
+    @synchronized
+    def put(self, items, priorities=None):
         """Adds a new Item to the Queue in the WAITING stage.
 
         Parameters:
@@ -78,32 +136,61 @@ class InMemoryQueue(QueueBase):
             pair, where key is the item ID and value is the queue item body.
             The item ID must be a string and the item body must be
             serializable.
+        priorities: dict (default=None)
+            Not supported by this queue, which raises a ValueError when a
+            priority is not 0.
         """
+        self._check_priorities(priorities)
         # Filter out IDs that already exist in the index
         items = self._put(items)
         filtered_items = {
             k:v
             for k,v in items.items()
-            if k not in self.memory_queue.index
             if is_json_serializable(v)
         }
 
         # Add to queue
         self.memory_queue.waiting.update(filtered_items)
+        self.memory_queue.index.update(filtered_items.keys())
+
+    def _lookup_existing_ids(self, item_ids):
+        """Find which of the given Item IDs already exist in the queue using
+        the queue index.
 
-    def get(self, n_items=1):
+        Parameters:
+        ------------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs in item_ids that are already in the queue.
+        """
+        return [
+            item_id
+            for item_id in item_ids
+            if item_id in self.memory_queue.index
+        ]
+
+    @synchronized
+    def get(self, n_items=1, lease_owner=None, lease_sec=None):
         """Gets the next n items from the queue, moving them to PROCESSING.
 
         Parameters:
         -----------
         n_items: int (default=1)
             Number of items to retrieve from queue.
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
 
         Returns:
         ------------
         Returns a list of n_items from the queue, as
         List[(queue_item_id, queue_item_body)]
         """
+        self._release_due_items()
         # islice does not support negative values
         # `list` is necessary to freeze this iterator - now it won't break
         # When the dictionary changes size while iterating.
@@ -120,9 +207,171 @@ class InMemoryQueue(QueueBase):
 
             queue_items.append((i, queue_item))
 
+        if lease_sec is not None:
+            self._set_leases(next_ids, lease_owner, lease_sec)
+
         return queue_items
 
+    def _set_leases(self, item_ids, lease_owner, lease_sec):
+        """Leases items to `lease_owner` for `lease_sec` seconds from now.
+        """
+        lease_expires = self.clock() + lease_sec
+        for item_id in item_ids:
+            self.memory_queue.leases[item_id] = (lease_owner, lease_expires)
+            heapq.heappush(
+                self.memory_queue.lease_heap, (lease_expires, item_id)
+            )
+
+    def _leased_to(self, item_ids, lease_owner):
+        """Returns the IDs in item_ids that are PROCESSING and leased to
+        `lease_owner`, without duplicates.
+        """
+        return [
+            item_id for item_id in dict.fromkeys(item_ids)
+            if item_id in self.memory_queue.processing
+            and self.memory_queue.leases.get(item_id, (None,))[0]
+            == lease_owner
+        ]
+
+    @synchronized
+    def extend_lease(self, item_ids, lease_owner, lease_sec):
+        """Extends the lease of PROCESSING items held by `lease_owner` to
+        `lease_sec` seconds from now. Other items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        item_ids = self._leased_to(item_ids, lease_owner)
+        self._set_leases(item_ids, lease_owner, lease_sec)
+        return item_ids
+
+    @synchronized
+    def ack_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING items leased to `lease_owner` to SUCCESS. Other
+        items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        item_ids = self._leased_to(item_ids, lease_owner)
+        for item_id in item_ids:
+            self.success(item_id)
+        return item_ids
+
+    @synchronized
+    def release_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING items leased to `lease_owner` back to WAITING.
+        Other items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        item_ids = self._leased_to(item_ids, lease_owner)
+        for item_id in item_ids:
+            self._return_to_waiting(item_id)
+        return item_ids
+
+    @synchronized
+    def expire_leases(self):
+        """Moves the PROCESSING items whose lease has expired back to
+        WAITING.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        lease_heap = self.memory_queue.lease_heap
+        now = self.clock()
+        expired_ids = []
+        while lease_heap and lease_heap[0][0] <= now:
+            lease_expires, item_id = heapq.heappop(lease_heap)
+            lease = self.memory_queue.leases.get(item_id)
+            # Skip entries of leases that were extended or have ended.
+            if lease is None or lease[1] != lease_expires:
+                continue
+            self._return_to_waiting(item_id)
+            expired_ids.append(item_id)
+            logger.info("Lease of job %s held by %s expired",
+                        item_id, lease[0])
+        return expired_ids
+
+    def _return_to_waiting(self, item_id):
+        """Moves a leased item from PROCESSING to the end of WAITING.
+        """
+        self.memory_queue.leases.pop(item_id, None)
+        move_dict_item(
+            self.memory_queue.processing,
+            self.memory_queue.waiting,
+            item_id
+        )
+
+    @synchronized
+    def get_items(self, item_ids, lease_owner=None, lease_sec=None):
+        """Moves the given Items from WAITING to PROCESSING, wherever they
+        are in the Queue. Items that are not WAITING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        self._release_due_items()
+        queue_items = []
+        for i in item_ids:
+            if i not in self.memory_queue.waiting:
+                continue
+            queue_item = move_dict_item(
+                self.memory_queue.waiting,
+                self.memory_queue.processing,
+                i
+            )
+            queue_items.append((i, queue_item))
+
+        if lease_sec is not None:
+            self._set_leases(
+                [i for i, _ in queue_items], lease_owner, lease_sec
+            )
+
+        return queue_items
+
+    @synchronized
     def peek(self, n_items=1):
+        self._release_due_items()
         next_ids = list(itertools.islice(self.memory_queue.waiting, n_items))
 
         queue_items = []
@@ -132,8 +381,10 @@ class InMemoryQueue(QueueBase):
 
         return queue_items
 
+    @synchronized
     def success(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to SUCCESS.
+        """Moves a Queue Item from PROCESSING to SUCCESS. Raises KeyError if
+        the Item is not PROCESSING.
 
         Parameters:
         -----------
@@ -145,22 +396,54 @@ class InMemoryQueue(QueueBase):
             self.memory_queue.success,
             queue_item_id
         )
+        self.memory_queue.leases.pop(queue_item_id, None)
         logger.info("Job %s successfully completed", queue_item_id)
 
+    @synchronized
     def fail(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to FAIL.
+        """Moves a Queue Item from PROCESSING to FAIL, or back to WAITING
+        after a delay if the retry policy tries it again. Raises KeyError if
+        the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
-        """
-        move_dict_item(
-            self.memory_queue.processing,
-            self.memory_queue.fail,
-            queue_item_id)
-        logger.info("Job %s failed", queue_item_id)
 
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
+        """
+        if queue_item_id not in self.memory_queue.processing:
+            raise KeyError(queue_item_id)
+        attempts = self.memory_queue.attempts.get(queue_item_id, 0) + 1
+        if self.retry_policy is not None \
+            and self.retry_policy.should_retry(attempts):
+            move_dict_item(
+                self.memory_queue.processing,
+                self.memory_queue.delayed,
+                queue_item_id
+            )
+            delay = self.retry_policy.delay(attempts)
+            heapq.heappush(
+                self.memory_queue.retry_heap,
+                (self.clock() + delay, queue_item_id)
+            )
+            retried = True
+            logger.info("Job %s failed attempt %d, retrying in %.1fs",
+                        queue_item_id, attempts, delay)
+        else:
+            move_dict_item(
+                self.memory_queue.processing,
+                self.memory_queue.fail,
+                queue_item_id)
+            retried = False
+            logger.info("Job %s failed", queue_item_id)
+        self.memory_queue.attempts[queue_item_id] = attempts
+        self.memory_queue.leases.pop(queue_item_id, None)
+        return retried
+
+    @synchronized
     def size(self, queue_item_stage):
         """Determines how many items are in some stage of the queue.
 
@@ -175,6 +458,7 @@ class InMemoryQueue(QueueBase):
         """
         return len(self.memory_queue.get_for_stage(queue_item_stage))
 
+    @synchronized
     def lookup_status(self, queue_item_id):
         """Lookup which stage in the Queue Item is currently in.
 
@@ -196,6 +480,7 @@ class InMemoryQueue(QueueBase):
         logger.error("Item id not found %s", queue_item_id)
         raise KeyError(queue_item_id)
 
+    @synchronized
     def lookup_state(self, queue_item_stage):
         """Lookup which item ids are in the current Queue stage.
 
@@ -215,6 +500,7 @@ class InMemoryQueue(QueueBase):
             return item_ids
         return item_ids
 
+    @synchronized
     def lookup_item(self, queue_item_id):
         """Lookup an Item currently in the Queue.
 
@@ -250,6 +536,7 @@ class InMemoryQueue(QueueBase):
         desc = {"implementation": "memory"}
         return desc
 
+    @synchronized
     def requeue(self, item_ids):
         """Move input queue items from FAILED to WAITING.
 
@@ -265,6 +552,7 @@ class InMemoryQueue(QueueBase):
                 self.memory_queue.waiting,
                 item
             )
+            self.memory_queue.attempts.pop(item, None)
 
 
 # Pylint is disabled because the goal is to just have
@@ -311,7 +599,7 @@ def move_dict_item(dict_from, dict_to, key):
 
     return item
 
-def in_memory_queue():
+def in_memory_queue(retry_policy=None, clock=time.time):
     """Creates and returns an InMemoryQueue object.
     """
-    return InMemoryQueue()
+    return InMemoryQueue(retry_policy=retry_policy, clock=clock)
@@ -0,0 +1,50 @@
+"""Wherein is contained the LeaseSweeper class, which sends Queue Items whose
+lease has expired back to WAITING.
+"""
+from task_queue import logger
+from .background_thread import BackgroundThread
+
+
+class LeaseSweeper(BackgroundThread):
+    """Calls `expire_leases` on a queue every `interval_sec` seconds from a
+    daemon thread.
+    """
+
+    def __init__(self, queue, interval_sec=30):
+        """Initializes LeaseSweeper.
+
+        Parameters:
+        -----------
+        queue: QueueBase
+            Queue whose expired leases are swept.
+        interval_sec: float (default=30)
+            Seconds between two sweeps.
+        """
+        super().__init__("lease-sweeper")
+        self.queue = queue
+        self.interval_sec = interval_sec
+
+    # Disabled pylint because a failed sweep must not stop the thread, the
+    # next sweep tries again.
+    # pylint: disable=broad-exception-caught
+    def run(self):
+        """Sweeps until stopped.
+        """
+        while not self._stop.wait(self.interval_sec):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error("Couldn't expire leases: %s", e)
+
+    def sweep(self):
+        """Sends the Items whose lease has expired back to WAITING.
+
+        Returns:
+        -----------
+        Returns a list of the IDs that were moved.
+        """
+        expired_ids = self.queue.expire_leases()
+        if expired_ids:
+            logger.warning("Returned %d items with expired leases to WAITING",
+                           len(expired_ids))
+        return expired_ids
@@ -21,9 +21,36 @@ warnings.filterwarnings(
                 module=r'.*queue_base'
             )
 
-class QueueBase(ABC):
+# The queue API (leases, bulk transitions, paging) is one public method per
+# operation and is split no further.
+class QueueBase(ABC):  # pylint: disable=too-many-public-methods
     """Abstract Base Class for Queue.
+
+    Queues given a RetryPolicy send failed Items back to WAITING, and `get`,
+    `get_items` and `peek` skip them until their retry is due.
+
+    Queues whose `supports_priorities` is False claim Items in the order they
+    were added, and their `put` raises a ValueError when given a non-zero
+    priority.
     """
+    retry_policy = None
+    supports_priorities = False
+
+    def _check_priorities(self, priorities):
+        """Raises a ValueError if priorities are given to a Queue that does
+        not support them.
+
+        Parameters:
+        ------------
+        priorities: dict
+            Dictionary of item ID to integer priority, or None.
+        """
+        if self.supports_priorities or not priorities:
+            return
+        if any(int(priority) != 0 for priority in priorities.values()):
+            raise ValueError(
+                f"{type(self).__name__} does not support priorities."
+            )
 
     def _put(self, items):
         """Remove Item from items if the Item ID exists in the queue.
@@ -40,26 +67,51 @@ class QueueBase(ABC):
         ------------
         Returns a dictionary of items.
         """
-        # Get all IDs in queue
-        queue_ids = (self.lookup_state(QueueItemStage.FAIL)
-        + self.lookup_state(QueueItemStage.SUCCESS)
-        + self.lookup_state(QueueItemStage.WAITING)
-        + self.lookup_state(QueueItemStage.PROCESSING))
-
-        item_ids = items.keys()
-        duplicate_ids = list(set(item_ids).intersection(set(queue_ids)))
-
-        for id_ in duplicate_ids:
-            logger.warning("Item %s already in queue. Skipping.", id_)
-            warnings.warn(f"Item {id_!r} already in queue. Skipping.")
+        duplicate_ids = self._lookup_existing_ids(list(items.keys()))
+        self._warn_duplicates(duplicate_ids)
 
         no_duplicate_items = items.copy()
         for k in duplicate_ids:
             no_duplicate_items.pop(k)
         return no_duplicate_items
 
+    def _lookup_existing_ids(self, item_ids):
+        """Find which of the given Item IDs already exist in the queue.
+
+        This default implementation loads the IDs of every stage with
+        `lookup_state`, so backends that can check membership directly should
+        override it.
+
+        Parameters:
+        ------------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs in item_ids that are already in the queue.
+        """
+        queue_ids = set()
+        for stage in QueueItemStage:
+            queue_ids.update(self.lookup_state(stage))
+
+        return list(set(item_ids).intersection(queue_ids))
+
+    def _warn_duplicates(self, item_ids):
+        """Warn that items were skipped by put because their IDs are already
+        in the queue.
+
+        Parameters:
+        ------------
+        item_ids: [str]
+            IDs of the skipped Queue Items
+        """
+        for id_ in item_ids:
+            logger.warning("Item %s already in queue. Skipping.", id_)
+            warnings.warn(f"Item {id_!r} already in queue. Skipping.")
+
     @abstractmethod
-    def put(self, items):
+    def put(self, items, priorities=None):
         """Adds a new Item to the Queue in the WAITING stage.
 
         Parameters:
@@ -69,16 +121,30 @@ class QueueBase(ABC):
             pair, where key is the item ID and value is the queue item body.
             The item ID must be a string and the item body must be
             serializable.
+        priorities: dict (default=None)
+            Optional dictionary of item ID to integer priority. Items with a
+            higher priority are claimed by `get` first; items without one
+            have priority 0. Queues that do not support priorities raise a
+            ValueError when one is not 0.
         """
 
     @abstractmethod
-    def get(self, n_items=1):
+    def get(self, n_items=1, lease_owner=None, lease_sec=None):
         """Gets the next n Items from the Queue, moving them to PROCESSING.
 
+        With `lease_sec`, the Items are leased to `lease_owner` for that many
+        seconds. Unless the owner extends the lease, acknowledges the Items
+        or releases them before then, `expire_leases` sends them back to
+        WAITING.
+
         Parameters:
         -----------
         n_items: int (default=1)
             Number of items to retrieve from Queue.
+        lease_owner: str (default=None)
+            Name of the consumer the Items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the Items are not leased.
 
         Returns:
         ------------
@@ -86,6 +152,106 @@ class QueueBase(ABC):
         List[(queue_item_id, queue_item_body)]
         """
 
+    def get_items(self, item_ids, lease_owner=None, lease_sec=None):
+        """Moves the given Items from WAITING to PROCESSING, wherever they
+        are in the Queue. Items that are not WAITING are skipped. With
+        `lease_sec`, the Items are leased as by `get`.
+
+        Queues that cannot claim Items by ID raise NotImplementedError.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the Items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the Items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support get_items."
+        )
+
+    def extend_lease(self, item_ids, lease_owner, lease_sec):
+        """Extends the lease of PROCESSING Items held by `lease_owner` to
+        `lease_sec` seconds from now. Other Items are skipped.
+
+        This and the other lease methods raise NotImplementedError on queues
+        that do not support leases.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support leases."
+        )
+
+    def ack_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` to SUCCESS. Other
+        Items, including ones whose expired lease sent them back to WAITING,
+        are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support leases."
+        )
+
+    def release_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` back to WAITING
+        before their lease expires. Other Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support leases."
+        )
+
+    def expire_leases(self):
+        """Moves the PROCESSING Items whose lease has expired back to
+        WAITING. `LeaseSweeper` calls this periodically.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support leases."
+        )
+
     @abstractmethod
     def peek(self, n_items=1):
         """Return the next queue items without moving anything from WAITING to
@@ -99,7 +265,8 @@ class QueueBase(ABC):
 
     @abstractmethod
     def success(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to SUCCESS.
+        """Moves a Queue Item from PROCESSING to SUCCESS. Raises KeyError if
+        the Item is not PROCESSING.
 
         Parameters:
         -----------
@@ -109,14 +276,76 @@ class QueueBase(ABC):
 
     @abstractmethod
     def fail(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to FAIL.
+        """Moves a Queue Item from PROCESSING to FAIL, or back to WAITING if
+        the retry policy tries it again. Raises KeyError if the Item is not
+        PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
+
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
         """
 
+    def success_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to SUCCESS. Items that
+        are not PROCESSING are skipped.
+
+        Backends that can move many items at once should override this, the
+        default implementation calls `success` once per item.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = []
+        for item_id in item_ids:
+            try:
+                self.success(item_id)
+            except KeyError:
+                continue
+            moved_ids.append(item_id)
+        return moved_ids
+
+    def fail_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to FAIL, or back to
+        WAITING for the ones the retry policy tries again. Items that are not
+        PROCESSING are skipped.
+
+        Backends that can move many items at once should override this, the
+        default implementation calls `fail` once per item.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a tuple of the list of IDs moved to FAIL and the list of IDs
+        that will be retried.
+        """
+        failed_ids = []
+        retried_ids = []
+        for item_id in item_ids:
+            try:
+                retried = self.fail(item_id)
+            except KeyError:
+                continue
+            if retried:
+                retried_ids.append(item_id)
+            else:
+                failed_ids.append(item_id)
+        return failed_ids, retried_ids
+
     @abstractmethod
     def size(self, queue_item_stage):
         """Determines how many Items are in some stage of the Queue.
@@ -148,6 +377,38 @@ class QueueBase(ABC):
 
         return sizes_dict
 
+    def sum_resources(self, queue_item_stage, resource_key="resources"):
+        """Sums the resources requested by the Items in some stage of the
+        Queue. The resources of an Item are the dictionary under
+        `resource_key` in its body.
+
+        Backends that can aggregate Item bodies themselves should override
+        this, the default implementation looks up every Item in the stage.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage object
+            The specific stage of the Queue (PROCESSING, FAIL, etc.).
+        resource_key: str (default="resources")
+            Key of the resource dictionary in the Item bodies.
+
+        Returns:
+        ------------
+        Returns a dictionary of resource name to the total requested by the
+        Items in the stage. Resources no Item requests are left out, and
+        values that are not numbers are ignored.
+        """
+        totals = {}
+        for item_id in self.lookup_state(queue_item_stage):
+            item_body = self.lookup_item(item_id)["item_body"]
+            resources = item_body.get(resource_key)
+            if not isinstance(resources, dict):
+                continue
+            for k, v in resources.items():
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    totals[k] = totals.get(k, 0) + v
+        return totals
+
     @abstractmethod
     def lookup_status(self, queue_item_id):
         """Lookup which stage in the Queue Item is currently in.
@@ -192,6 +453,71 @@ class QueueBase(ABC):
         Returns a list of all item ids in the current queue stage.
         """
 
+    def lookup_state_page(self, queue_item_stage, page_size=1000, after=None):
+        """Lookup one page of the item ids in the current Queue stage, in
+        ascending order of item id.
+
+        Backends that can seek to an item id should override this, the
+        default implementation sorts the result of `lookup_state`.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage
+            stage of Queue Item
+        page_size: int (default=1000)
+            Maximum number of item ids to return.
+        after: str (default=None)
+            Cursor returned with the previous page. Only item ids greater than
+            it are returned. None starts from the first item id.
+
+        Returns:
+        ------------
+        Returns a tuple of the list of item ids in the page and the cursor for
+        the next page, which is None when there are no more pages.
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1.")
+
+        item_ids = sorted(
+            id_ for id_ in self.lookup_state(queue_item_stage)
+            if after is None or id_ > after
+        )[:page_size]
+        return item_ids, self._next_page_cursor(item_ids, page_size)
+
+    @staticmethod
+    def _next_page_cursor(item_ids, page_size):
+        """Returns the cursor of the page after `item_ids`, or None if it is
+        the last page.
+        """
+        if len(item_ids) < page_size:
+            return None
+        return item_ids[-1]
+
+    def iter_state(self, queue_item_stage, page_size=1000, after=None):
+        """Iterate over the item ids in the current Queue stage one page at a
+        time, so only one page is held in memory.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage
+            stage of Queue Item
+        page_size: int (default=1000)
+            Number of item ids fetched at a time.
+        after: str (default=None)
+            Only item ids greater than it are returned.
+
+        Returns:
+        ------------
+        Yields the item ids in the stage in ascending order.
+        """
+        while True:
+            item_ids, after = self.lookup_state_page(
+                queue_item_stage, page_size=page_size, after=after
+            )
+            yield from item_ids
+            if after is None:
+                return
+
     @abstractmethod
     def description(self):
         """A brief description of the Queue.
@@ -203,7 +529,8 @@ class QueueBase(ABC):
 
     @abstractmethod
     def requeue(self, item_ids):
-        """Move input queue items from FAILED to WAITING.
+        """Move input queue items from FAILED to WAITING, resetting their
+        number of attempts.
 
         Parameters:
         -----------
@@ -211,6 +538,19 @@ class QueueBase(ABC):
             ID of Queue Item
         """
 
+    def requeue_many(self, item_ids):
+        """Move several queue items from FAILED to WAITING.
+
+        Backends that can move many items at once should override this, the
+        default implementation calls `requeue`.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        """
+        self.requeue(item_ids)
+
     def _requeue(self, item_ids):
         """Remove ids from item_ids that are not in the FAIL state.
 
@@ -227,10 +567,20 @@ class QueueBase(ABC):
             item_ids = [item_ids]
 
         failed_ids = self.lookup_state(QueueItemStage.FAIL)
-        missing_ids = list(set(item_ids) - set(failed_ids))
-        for id_ in missing_ids:
-            logger.warning("Item %s not in a FAIL state. Skipping.", id_)
-            warnings.warn(f"Item {id_!r} not in a FAIL state. Skipping.")
+        self._warn_not_failed(list(set(item_ids) - set(failed_ids)))
 
         item_ids = [id_ for id_ in item_ids if id_ in failed_ids]
         return item_ids
+
+    def _warn_not_failed(self, item_ids):
+        """Warn that items were skipped by requeue because they are not in
+        the FAIL state.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of the skipped Queue Items
+        """
+        for id_ in item_ids:
+            logger.warning("Item %s not in a FAIL state. Skipping.", id_)
+            warnings.warn(f"Item {id_!r} not in a FAIL state. Skipping.")
@@ -60,7 +60,9 @@ class QueueMoveEventData(pydantic.BaseModel):
         """
         return v.value
 
-class QueueWithEvents(QueueBase):
+# The queue API (leases, bulk transitions, paging) is one public method per
+# operation and is split no further.
+class QueueWithEvents(QueueBase):  # pylint: disable=too-many-public-methods
     """Class for QueueWithEvents.
     """
     # Pylint does not like more than 5 parameters
@@ -91,9 +93,15 @@ class QueueWithEvents(QueueBase):
 
         self.event_schema_version = "0.0.1"
 
+    @property
+    def supports_priorities(self):
+        """Whether the wrapped queue supports priorities.
+        """
+        return self.queue.supports_priorities
+
     # Pylint disabled because BaseException is used to set exc
     # pylint: disable=broad-exception-caught
-    def put(self, items):
+    def put(self, items, priorities=None):
         """Adds a new Item to the Queue in the WAITING stage and logs the
         Event to an Event Store.
 
@@ -102,11 +110,16 @@ class QueueWithEvents(QueueBase):
         items: dict
             Dictionary of Queue Items to add Queue, where Item is a key:value
             pair, where key is the item ID and value is the queue item body.
+        priorities: dict (default=None)
+            Optional dictionary of item ID to integer priority, passed to the
+            wrapped queue. A ValueError is raised before any Event is logged
+            if the wrapped queue does not support priorities.
 
         Returns:
         -----------
         Results of putting filtered_items in queue in the WAITING stage.
         """
+        self._check_priorities(priorities)
         # The flow control of this function looks really weird to satisfy the
         # `test_put_with_exception` test.
         queue_event_data = []
@@ -133,7 +146,7 @@ class QueueWithEvents(QueueBase):
 
         self.event_store.add(queue_event_data)
 
-        out = self.queue.put(filtered_items)
+        out = self.queue.put(filtered_items, priorities=priorities)
 
         if exc is not None:
             logger.error(exc)
@@ -141,7 +154,7 @@ class QueueWithEvents(QueueBase):
 
         return out
 
-    def get(self, n_items=1):
+    def get(self, n_items=1, lease_owner=None, lease_sec=None):
         """Gets the next n items from the queue, moving them to PROCESSING and
         logs the Event.
 
@@ -149,6 +162,10 @@ class QueueWithEvents(QueueBase):
         -----------
         n_items: int (default=1)
             Number of items to retrieve from queue.
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
 
         Returns:
         ------------
@@ -157,7 +174,12 @@ class QueueWithEvents(QueueBase):
         """
         n_items = max(n_items, 0)
 
-        items = self.queue.get(n_items)
+        if lease_sec is None:
+            items = self.queue.get(n_items)
+        else:
+            items = self.queue.get(
+                n_items, lease_owner=lease_owner, lease_sec=lease_sec
+            )
 
         queue_event_data = [
             Event(
@@ -177,42 +199,217 @@ class QueueWithEvents(QueueBase):
 
         return items
 
+    def get_items(self, item_ids, lease_owner=None, lease_sec=None):
+        """Moves the given Items from WAITING to PROCESSING and logs the
+        Events. Items that are not WAITING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        if lease_sec is None:
+            items = self.queue.get_items(item_ids)
+        else:
+            items = self.queue.get_items(
+                item_ids, lease_owner=lease_owner, lease_sec=lease_sec
+            )
+
+        self.record_queue_move_events(
+            [k for k, _ in items],
+            QueueItemStage.WAITING,
+            QueueItemStage.PROCESSING
+        )
+
+        return items
+
+    def extend_lease(self, item_ids, lease_owner, lease_sec):
+        """Extends the lease of PROCESSING Items held by `lease_owner`.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        return self.queue.extend_lease(item_ids, lease_owner, lease_sec)
+
+    def ack_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` to SUCCESS and logs
+        the Events.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = self.queue.ack_lease(item_ids, lease_owner)
+        self.record_queue_move_events(
+            moved_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.SUCCESS
+        )
+        return moved_ids
+
+    def release_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` back to WAITING and
+        logs the Events.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = self.queue.release_lease(item_ids, lease_owner)
+        self.record_queue_move_events(
+            moved_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.WAITING
+        )
+        return moved_ids
+
+    def expire_leases(self):
+        """Moves the PROCESSING Items whose lease has expired back to
+        WAITING and logs the Events.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = self.queue.expire_leases()
+        self.record_queue_move_events(
+            moved_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.WAITING
+        )
+        return moved_ids
+
     def peek(self, n_items=1):
         return self.queue.peek(n_items)
 
     def success(self, queue_item_id):
         """Moves a Queue Item from PROCESSING to SUCCESS and logs the Event.
+        Raises KeyError if the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
         """
+        # The Event is recorded after the move, so an Item that is not
+        # PROCESSING leaves no Event behind.
+        self.queue.success(queue_item_id)
         self.record_queue_move_event(
             queue_item_id,
             QueueItemStage.PROCESSING,
             QueueItemStage.SUCCESS
         )
-
-        self.queue.success(queue_item_id)
         logger.info("Job %s successfully completed", queue_item_id)
 
     def fail(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to FAIL and logs the Event.
+        """Moves a Queue Item from PROCESSING to FAIL, or back to WAITING if
+        the retry policy of the queue tries it again, and logs the Event.
+        Raises KeyError if the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
+
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
         """
+        # The retry policy of the queue decides where the Item goes, so the
+        # Event is recorded after the move.
+        retried = bool(self.queue.fail(queue_item_id))
         self.record_queue_move_event(
             queue_item_id,
             QueueItemStage.PROCESSING,
-            QueueItemStage.FAIL
+            QueueItemStage.WAITING if retried else QueueItemStage.FAIL
         )
-
-        self.queue.fail(queue_item_id)
         logger.info("Job %s failed", queue_item_id)
+        return retried
+
+    def success_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to SUCCESS and logs the
+        Events of the Items that were moved.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = list(self.queue.success_many(item_ids))
+        if moved_ids:
+            self.record_queue_move_events(
+                moved_ids,
+                QueueItemStage.PROCESSING,
+                QueueItemStage.SUCCESS
+            )
+        return moved_ids
+
+    def fail_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to FAIL, or back to
+        WAITING for the ones the retry policy of the queue tries again, and
+        logs the Events of the Items that were moved.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a tuple of the list of IDs moved to FAIL and the list of IDs
+        that will be retried.
+        """
+        failed_ids, retried_ids = self.queue.fail_many(item_ids)
+        if failed_ids:
+            self.record_queue_move_events(
+                failed_ids,
+                QueueItemStage.PROCESSING,
+                QueueItemStage.FAIL
+            )
+        if retried_ids:
+            self.record_queue_move_events(
+                retried_ids,
+                QueueItemStage.PROCESSING,
+                QueueItemStage.WAITING
+            )
+        return failed_ids, retried_ids
 
     def size(self, queue_item_stage):
         """Determines how many items are in some stage of the queue.
@@ -228,6 +425,16 @@ class QueueWithEvents(QueueBase):
         """
         return self.queue.size(queue_item_stage)
 
+    def sizes(self):
+        """Determines how many items are in each stage of the queue, with
+        the wrapped queue's `sizes`, which may count every stage at once.
+
+        Returns:
+        ------------
+        Returns the number of items in each stage of the queue as an integer.
+        """
+        return self.queue.sizes()
+
     def lookup_status(self, queue_item_id):
         """Lookup which stage in the Queue Item is currently in.
 
@@ -257,6 +464,46 @@ class QueueWithEvents(QueueBase):
         """
         return self.queue.lookup_state(queue_item_stage)
 
+    def sum_resources(self, queue_item_stage, resource_key="resources"):
+        """Sums the resources requested by the Items in some stage of the
+        Queue.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage object
+            The specific stage of the Queue (PROCESSING, FAIL, etc.).
+        resource_key: str (default="resources")
+            Key of the resource dictionary in the Item bodies.
+
+        Returns:
+        ------------
+        Returns a dictionary of resource name to the total requested by the
+        Items in the stage.
+        """
+        return self.queue.sum_resources(queue_item_stage, resource_key)
+
+    def lookup_state_page(self, queue_item_stage, page_size=1000, after=None):
+        """Lookup one page of the item ids in the current Queue stage, in
+        ascending order of item id.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage
+            stage of Queue Item
+        page_size: int (default=1000)
+            Maximum number of item ids to return.
+        after: str (default=None)
+            Cursor returned with the previous page.
+
+        Returns:
+        ------------
+        Returns a tuple of the list of item ids in the page and the cursor for
+        the next page, which is None when there are no more pages.
+        """
+        return self.queue.lookup_state_page(
+            queue_item_stage, page_size=page_size, after=after
+        )
+
     def lookup_item(self, queue_item_id):
         """Lookup an Item currently in the Queue.
 
@@ -304,6 +551,38 @@ class QueueWithEvents(QueueBase):
             )
 
 
+    def record_queue_move_events(
+        self,
+        item_ids,
+        from_stage,
+        to_stage
+    ):
+        """Tracks the movement of several Items in Queue via Event Store
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        from_stage: QueueItemStage
+            Stage Items are being moved from.
+        to_stage: QueueItemStage
+            Stage Items are being moved to.
+        """
+        queue_event_data = [
+            Event(
+                name = self.move_event_name,
+                version = self.event_schema_version,
+                data = QueueMoveEventData(
+                    queue_index_key=item_id,
+                    stage_from=from_stage,
+                    stage_to=to_stage
+                ).model_dump()
+            )
+            for item_id in item_ids
+        ]
+
+        self.event_store.add(queue_event_data)
+
     def record_queue_move_event(
         self,
         item_id,
@@ -0,0 +1,104 @@
+"""Wherein is contained the RetryPolicy class, which decides when failed
+queue items are tried again.
+"""
+import random
+
+
+class RetryPolicy:
+    """Sends failed Queue Items back to WAITING until they have been tried
+    `max_attempts` times.
+
+    After its n-th failed attempt an Item is not handed out by `get` or
+    `peek` for `backoff_sec * backoff_multiplier ** (n - 1)` seconds, at most
+    `max_backoff_sec`, shortened by a random fraction of up to `jitter` so
+    Items that failed together are not all retried at once.
+    """
+
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 max_attempts=3,
+                 backoff_sec=30.0,
+                 backoff_multiplier=2.0,
+                 max_backoff_sec=3600.0,
+                 jitter=0.5):
+        """Initializes RetryPolicy.
+
+        Parameters:
+        -----------
+        max_attempts: int (default=3)
+            Number of times an Item is tried before it stays in FAIL.
+        backoff_sec: float (default=30.0)
+            Delay before the first retry.
+        backoff_multiplier: float (default=2.0)
+            Factor applied to the delay after each further failure.
+        max_backoff_sec: float (default=3600.0)
+            Longest delay between two attempts.
+        jitter: float (default=0.5)
+            Largest fraction of the delay removed at random, between 0 and 1.
+        """
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        self.max_attempts = max_attempts
+        self.backoff_sec = backoff_sec
+        self.backoff_multiplier = backoff_multiplier
+        self.max_backoff_sec = max_backoff_sec
+        self.jitter = jitter
+
+    def should_retry(self, attempts):
+        """Decides whether an Item is tried again.
+
+        Parameters:
+        -----------
+        attempts: int
+            Number of failed attempts of the Item, including the one that
+            just failed.
+
+        Returns:
+        -----------
+        Returns True if the Item goes back to WAITING.
+        """
+        return attempts < self.max_attempts
+
+    def delay(self, attempts):
+        """Returns the seconds to wait before the next attempt of an Item.
+
+        Parameters:
+        -----------
+        attempts: int
+            Number of failed attempts of the Item, including the one that
+            just failed.
+
+        Returns:
+        -----------
+        Returns the delay in seconds as a float.
+        """
+        delay = min(
+            self.backoff_sec * self.backoff_multiplier ** (attempts - 1),
+            self.max_backoff_sec
+        )
+        return delay * (1 - self.jitter * random.random())
+
+
+def retry_policy_from_settings(retry_settings):
+    """Creates the RetryPolicy described by TaskQueueRetrySettings.
+
+    Parameters:
+    -----------
+    retry_settings: TaskQueueRetrySettings
+
+    Returns:
+    -----------
+    Returns a RetryPolicy, or None when items are tried only once.
+    """
+    if retry_settings.RETRY_MAX_ATTEMPTS <= 1:
+        return None
+    return RetryPolicy(
+        max_attempts=retry_settings.RETRY_MAX_ATTEMPTS,
+        backoff_sec=retry_settings.RETRY_BACKOFF_SECONDS,
+        backoff_multiplier=retry_settings.RETRY_BACKOFF_MULTIPLIER,
+        max_backoff_sec=retry_settings.RETRY_MAX_BACKOFF_SECONDS,
+        jitter=retry_settings.RETRY_JITTER
+    )
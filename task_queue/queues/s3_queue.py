@@ -2,6 +2,7 @@
 """
 import json
 import os
+import time
 from functools import reduce
 
 import s3fs
@@ -15,11 +16,27 @@ from . import queue_base
 fs = s3fs.S3FileSystem()
 
 
-class JsonS3Queue(QueueBase):
+# One path per stage and per retry, attempt and lease folder.
+class JsonS3Queue(QueueBase):  # pylint: disable=too-many-instance-attributes
     """Class for the JsonS3Queue.
+
+    With a retry policy, WAITING items whose retry is not due yet are kept
+    under `RETRY/<not_before>_<item_id>.json`, where `not_before` is the
+    retry time in milliseconds, so due items are found by listing `RETRY`
+    once. The attempts of each failed item are kept in
+    `ATTEMPTS/<item_id>.json`. `get`, `get_items` and `peek` release the
+    due items at most once every `release_interval_sec` seconds.
+
+    The owner and expiry time of each leased item are kept in
+    `LEASES/<item_id>.json`. The expiry time comes from the clock of the
+    process taking or extending the lease.
     """
-    def __init__(self, queue_base_s3_path):
+    def __init__(self, queue_base_s3_path, retry_policy=None,
+                 release_interval_sec=1):
         self.queue_base_path = queue_base_s3_path
+        self.retry_policy = retry_policy
+        self.release_interval_sec = release_interval_sec
+        self._next_release = 0
         fs.mkdir(self.queue_base_path)
         self.waiting_path = os.path.join(
             queue_base_s3_path,
@@ -38,6 +55,9 @@ class JsonS3Queue(QueueBase):
             queue_base_s3_path,
             queue_base.QueueItemStage.FAIL.name
         )
+        self.retry_path = os.path.join(queue_base_s3_path, "RETRY")
+        self.attempts_path = os.path.join(queue_base_s3_path, "ATTEMPTS")
+        self.leases_path = os.path.join(queue_base_s3_path, "LEASES")
 
         if s5fs.HAS_S5CMD:
             logger.info("S3 Queue is using S5CMD")
@@ -46,7 +66,7 @@ class JsonS3Queue(QueueBase):
 
     # BaseExeption is used to tell the user the failed items
     # pylint: disable=broad-exception-raised
-    def put(self, items):
+    def put(self, items, priorities=None):
         """Adds a new Item to the Queue in the WAITING stage.
 
         Parameters:
@@ -56,11 +76,15 @@ class JsonS3Queue(QueueBase):
             pair, where key is the item ID and value is the queue item body.
             The item ID must be a string and the item body must be
             serializable.
+        priorities: dict (default=None)
+            Not supported by this queue, which raises a ValueError when a
+            priority is not 0.
 
         Returns:
         -----------
         Returns the length of the list of added items.
         """
+        self._check_priorities(priorities)
         # Get a list of item keys that are already in the index, and remove
         # them from the incoming items list
         # These are only items whose keys are not in the index
@@ -104,13 +128,33 @@ class JsonS3Queue(QueueBase):
 
         return len(added_items)
 
-    def get(self, n_items=1):
+    def _lookup_existing_ids(self, item_ids):
+        """Find which of the given Item IDs already exist in the queue by
+        reading the queue index once.
+
+        Parameters:
+        ------------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs in item_ids that are already in the queue.
+        """
+        index_ids = set(get_queue_index_items(self.queue_index_path))
+        return [item_id for item_id in item_ids if item_id in index_ids]
+
+    def get(self, n_items=1, lease_owner=None, lease_sec=None):
         """Gets the next n items from the queue, moving them to PROCESSING.
 
         Parameters:
         -----------
         n_items: int
             Number of items to retrieve from queue.
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
 
         Returns:
         ------------
@@ -118,6 +162,7 @@ class JsonS3Queue(QueueBase):
         List[(queue_item_id, queue_item_body)]
         """
         n_items = max(n_items, 0)
+        self._release_due_items()
 
         queue_items = safe_s3fs_ls(
             fs,
@@ -135,15 +180,57 @@ class JsonS3Queue(QueueBase):
             with fs.open(item_path) as f:
                 item_data = json.load(f)
 
+            # The lease is written first, so a PROCESSING item always has
+            # its lease.
+            if lease_sec is not None:
+                self._write_lease(
+                    fname_to_id(item_path), lease_owner, lease_sec
+                )
             # move item to processing
             s3_move(item_path, self.processing_path)
             output.append((fname_to_id(item_path), item_data))
 
         return output
 
+    def get_items(self, item_ids, lease_owner=None, lease_sec=None):
+        """Moves the given Items from WAITING to PROCESSING, wherever they
+        are in the Queue. Items that are not WAITING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        self._release_due_items()
+        output = []
+        for item_id in item_ids:
+            item_path = os.path.join(self.waiting_path, id_to_fname(item_id))
+            if not fs.exists(item_path):
+                continue
+
+            with fs.open(item_path) as f:
+                item_data = json.load(f)
+
+            if lease_sec is not None:
+                self._write_lease(item_id, lease_owner, lease_sec)
+            s3_move(item_path, self.processing_path)
+            output.append((item_id, item_data))
+
+        return output
+
     def peek(self, n_items=1):
 
         n_items = max(n_items, 0)
+        self._release_due_items()
 
         queue_items = safe_s3fs_ls(
             fs,
@@ -166,32 +253,112 @@ class JsonS3Queue(QueueBase):
         return output
 
     def success(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to SUCCESS.
+        """Moves a Queue Item from PROCESSING to SUCCESS. Raises KeyError if
+        the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
         """
-        s3_move(
-            os.path.join(self.processing_path, id_to_fname(queue_item_id)),
-            self.success_path
-        )
+        try:
+            s3_move(
+                os.path.join(
+                    self.processing_path, id_to_fname(queue_item_id)
+                ),
+                self.success_path
+            )
+        except FileNotFoundError as e:
+            raise KeyError(queue_item_id) from e
+        self._remove_lease(queue_item_id)
         logger.info("Job %s successfully completed", queue_item_id)
 
     def fail(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to FAIL.
+        """Moves a Queue Item from PROCESSING to FAIL, or to RETRY if the
+        retry policy tries it again. Raises KeyError if the Item is not
+        PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
+
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
         """
-        s3_move(
-            os.path.join(self.processing_path, id_to_fname(queue_item_id)),
-            self.fail_path
+        item_path = os.path.join(
+            self.processing_path, id_to_fname(queue_item_id)
         )
-        logger.info("Job %s failed", queue_item_id)
+        if not fs.exists(item_path):
+            raise KeyError(queue_item_id)
+        self._remove_lease(queue_item_id)
+        if self.retry_policy is None:
+            s3_move(item_path, self.fail_path)
+            logger.info("Job %s failed", queue_item_id)
+            return False
+
+        attempts_path = os.path.join(
+            self.attempts_path, id_to_fname(queue_item_id)
+        )
+        attempts = 1
+        if fs.exists(attempts_path):
+            with fs.open(attempts_path) as f:
+                attempts += json.load(f)["attempts"]
+
+        if not self.retry_policy.should_retry(attempts):
+            maybe_write_s3_json(attempts_path, {"attempts": attempts})
+            s3_move(item_path, self.fail_path)
+            logger.info("Job %s failed", queue_item_id)
+            return False
+
+        delay = self.retry_policy.delay(attempts)
+        maybe_write_s3_json(attempts_path, {"attempts": attempts})
+        move(
+            item_path,
+            os.path.join(
+                self.retry_path,
+                retry_fname(queue_item_id, time.time() + delay)
+            )
+        )
+        logger.info("Job %s failed attempt %d, retrying in %.1fs",
+                    queue_item_id, attempts, delay)
+        return True
+
+    def _release_due_items(self):
+        """Moves the items in RETRY whose retry is due back to WAITING, with
+        one listing of RETRY. Does nothing if the last sweep was less than
+        `release_interval_sec` seconds ago.
+        """
+        now = time.time()
+        if now < self._next_release:
+            return
+        self._next_release = now + self.release_interval_sec
+        for item_path in safe_s3fs_ls(fs, self.retry_path, detail=False,
+                                      refresh=True):
+            not_before, item_id = retry_fname_to_id(item_path)
+            if not_before <= now:
+                move(
+                    item_path,
+                    os.path.join(self.waiting_path, id_to_fname(item_id))
+                )
+
+    def _retry_item_path(self, queue_item_id):
+        """Finds the path of an Item waiting for its retry.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            ID of Queue Item
+
+        Returns:
+        ------------
+        Returns the path under RETRY, or None if the Item is not there.
+        """
+        for item_path in safe_s3fs_ls(fs, self.retry_path, detail=False):
+            if retry_fname_to_id(item_path)[1] == queue_item_id:
+                return item_path
+        return None
 
     def size(self, queue_item_stage):
         """Determines how many items are in some stage of the queue.
@@ -211,6 +378,8 @@ class JsonS3Queue(QueueBase):
                 os.path.join(self.queue_base_path, queue_item_stage.name)
             )
         )
+        if queue_item_stage == queue_base.QueueItemStage.WAITING:
+            item_stage_size += len(safe_s3fs_ls(fs, self.retry_path))
         return item_stage_size
 
     def lookup_status(self, queue_item_id):
@@ -228,13 +397,20 @@ class JsonS3Queue(QueueBase):
         """
         paths_with_status = [
             (self.waiting_path, queue_base.QueueItemStage.WAITING),
+            (self.retry_path, queue_base.QueueItemStage.WAITING),
             (self.success_path, queue_base.QueueItemStage.SUCCESS),
             (self.fail_path, queue_base.QueueItemStage.FAIL),
             (self.processing_path, queue_base.QueueItemStage.PROCESSING)
         ]
 
         for p, s in paths_with_status:
-            item_ids = map(fname_to_id, safe_s3fs_ls(fs, p))
+            if p == self.retry_path:
+                item_ids = (
+                    retry_fname_to_id(item_path)[1]
+                    for item_path in safe_s3fs_ls(fs, p)
+                )
+            else:
+                item_ids = map(fname_to_id, safe_s3fs_ls(fs, p))
             if queue_item_id in item_ids:
                 return s
 
@@ -286,6 +462,9 @@ class JsonS3Queue(QueueBase):
                     item_stage.name,
                     id_to_fname(item_id)
                 )
+                if item_stage == queue_base.QueueItemStage.WAITING \
+                    and not fs.exists(fname):
+                    fname = self._retry_item_path(item_id)
                 with fs.open(fname) as f:
                     item_body = json.load(f)
 
@@ -295,6 +474,150 @@ class JsonS3Queue(QueueBase):
             'item_body':item_body
         }
 
+    def _lease_path(self, queue_item_id):
+        """Returns the path of the lease of an Item.
+        """
+        return os.path.join(self.leases_path, id_to_fname(queue_item_id))
+
+    def _write_lease(self, queue_item_id, lease_owner, lease_sec):
+        """Leases an Item to `lease_owner` for `lease_sec` seconds from now.
+        """
+        maybe_write_s3_json(
+            self._lease_path(queue_item_id),
+            {
+                "lease_owner": lease_owner,
+                "lease_expires": time.time() + lease_sec
+            }
+        )
+
+    def _remove_lease(self, queue_item_id):
+        """Removes the lease of an Item, if it has one.
+        """
+        try:
+            fs.rm(self._lease_path(queue_item_id))
+        except FileNotFoundError:
+            pass
+
+    def _leased_to(self, item_ids, lease_owner):
+        """Returns the PROCESSING Items of item_ids leased to `lease_owner`.
+        """
+        leased_ids = []
+        for item_id in dict.fromkeys(item_ids):
+            try:
+                with fs.open(self._lease_path(item_id)) as f:
+                    lease = json.load(f)
+            except FileNotFoundError:
+                continue
+            if lease["lease_owner"] == lease_owner and fs.exists(
+                os.path.join(self.processing_path, id_to_fname(item_id))
+            ):
+                leased_ids.append(item_id)
+        return leased_ids
+
+    def _return_to_waiting(self, queue_item_id):
+        """Moves a leased Item from PROCESSING back to WAITING and removes
+        its lease.
+
+        Returns:
+        ------------
+        Returns True if the Item was PROCESSING.
+        """
+        try:
+            s3_move(
+                os.path.join(self.processing_path, id_to_fname(queue_item_id)),
+                self.waiting_path
+            )
+        except FileNotFoundError:
+            return False
+        finally:
+            self._remove_lease(queue_item_id)
+        return True
+
+    def extend_lease(self, item_ids, lease_owner, lease_sec):
+        """Extends the lease of PROCESSING Items held by `lease_owner` to
+        `lease_sec` seconds from now. Other Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        item_ids = self._leased_to(item_ids, lease_owner)
+        for item_id in item_ids:
+            self._write_lease(item_id, lease_owner, lease_sec)
+        return item_ids
+
+    def ack_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` to SUCCESS. Other
+        Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        return self.success_many(self._leased_to(item_ids, lease_owner))
+
+    def release_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` back to WAITING.
+        Other Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        return [
+            item_id for item_id in self._leased_to(item_ids, lease_owner)
+            if self._return_to_waiting(item_id)
+        ]
+
+    def expire_leases(self):
+        """Moves the PROCESSING Items whose lease has expired back to
+        WAITING, reading every lease under `LEASES`.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        now = time.time()
+        expired_ids = []
+        for lease_path in safe_s3fs_ls(fs, self.leases_path, detail=False,
+                                       refresh=True):
+            try:
+                with fs.open(lease_path) as f:
+                    lease = json.load(f)
+            except FileNotFoundError:
+                continue
+            if lease["lease_expires"] > now:
+                continue
+            item_id = fname_to_id(lease_path)
+            if self._return_to_waiting(item_id):
+                expired_ids.append(item_id)
+                logger.info("Lease of job %s held by %s expired",
+                            item_id, lease["lease_owner"])
+        return expired_ids
+
     def requeue(self, item_ids):
         """Move input queue items from FAILED to WAITING.
 
@@ -309,6 +632,9 @@ class JsonS3Queue(QueueBase):
                 os.path.join(self.fail_path, id_to_fname(item)),
                 self.waiting_path
             )
+            attempts_path = os.path.join(self.attempts_path, id_to_fname(item))
+            if fs.exists(attempts_path):
+                fs.rm(attempts_path)
 
     def description(self):
         """A brief description of the Queue.
@@ -500,6 +826,40 @@ def id_to_fname(item_id):
     """
     return f"{item_id}.json"
 
+def retry_fname(item_id, not_before):
+    """Converts an Item ID and its retry time into the filename it is kept
+    under in RETRY. Filenames sort in order of retry time.
+
+    Parameters:
+    -----------
+    item_id: str
+        ID of Item.
+    not_before: float
+        Time of the retry, in seconds since the epoch.
+
+    Returns:
+    -----------
+    Returns a JSON filename holding the retry time and the Item ID.
+    """
+    return f"{int(not_before * 1000):015d}_{id_to_fname(item_id)}"
+
+def retry_fname_to_id(item_fname):
+    """Converts a filename made by `retry_fname` back into the retry time
+    and the Item ID.
+
+    Parameters:
+    -----------
+    item_fname: str
+        Filename of Item in RETRY.
+
+    Returns:
+    -----------
+    Returns a tuple of the retry time, in seconds since the epoch, and the
+    Item ID.
+    """
+    not_before, _, fname = os.path.basename(item_fname).partition("_")
+    return int(not_before) / 1000, fname_to_id(fname)
+
 def fname_to_id(item_fname):
     """Converts a filename to an Item ID.
 
@@ -567,7 +927,12 @@ def s3_move(item_path, dest_path):
 
     return dest
 
-def json_s3_queue(queue_base_s3_path):
+def json_s3_queue(queue_base_s3_path, retry_policy=None,
+                  release_interval_sec=1):
     """Creates and returns the S3 Queue.
     """
-    return JsonS3Queue(queue_base_s3_path)
+    return JsonS3Queue(
+        queue_base_s3_path,
+        retry_policy=retry_policy,
+        release_interval_sec=release_interval_sec
+    )
@@ -0,0 +1,93 @@
+"""Wherein is contained the SQLQueueListener class, which wakes workers up
+when a SQL queue created with `notify=True` changes.
+"""
+import select as select_module
+
+from task_queue import logger
+from .background_thread import BackgroundThread
+
+def sql_queue_notify_channel(tablename:str="sqlqueue"):
+    """Returns the name of the Postgres NOTIFY channel that a SQL queue table
+    announces changes on. The payload of each notification is the queue name.
+    """
+    return f"{tablename}_changed"
+
+class SQLQueueListener(BackgroundThread):
+    """Listens for the notifications sent by SQL queues created with
+    `notify=True`, and calls a `WakeupTrigger` when the watched queue
+    changes.
+
+    The listener keeps one connection of the engine's pool checked out while
+    it listens, discards it when done, and reconnects after errors.
+    """
+
+    def __init__(self, engine, queue_name, wakeup_trigger,
+                 tablename="sqlqueue", reconnect_sec=5):
+        """Initializes SQLQueueListener.
+
+        Parameters:
+        -----------
+        engine: sqlalchemy.Engine
+            Engine connected to the database holding the queue table.
+        queue_name: str
+            Name of the queue to watch.
+        wakeup_trigger: WakeupTrigger
+            Trigger notified when the queue changes.
+        tablename: str (default "sqlqueue")
+            Name of the table used for the SQL Queue.
+        reconnect_sec: float (default=5)
+            Seconds to wait before reconnecting after an error.
+        """
+        self.channel = sql_queue_notify_channel(tablename)
+        super().__init__(f"{self.channel}-listener")
+        self.engine = engine
+        self.queue_name = queue_name
+        self.wakeup_trigger = wakeup_trigger
+        self.reconnect_sec = reconnect_sec
+
+    # Disabled pylint because any error from the connection should only
+    # lead to a reconnect, the periodic sweep still runs in the meantime.
+    # pylint: disable=broad-exception-caught
+    def run(self):
+        """Listens until stopped, reconnecting after errors.
+        """
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning("Lost %s listener connection: %s",
+                               self.channel, e)
+                self._stop.wait(self.reconnect_sec)
+
+    def _listen(self):
+        """Opens a connection, subscribes to the channel and passes
+        notifications for the queue to the trigger until stopped.
+        """
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            logger.info("Listening for changes on %s", self.channel)
+            # Anything put while the listener was not connected.
+            self.wakeup_trigger.notify("listener connected")
+
+            while not self._stop.is_set():
+                readable, _, _ = select_module.select(
+                    [dbapi_connection], [], [], 1
+                )
+                if not readable:
+                    continue
+                dbapi_connection.poll()
+                notified = False
+                while dbapi_connection.notifies:
+                    notification = dbapi_connection.notifies.pop(0)
+                    notified |= notification.payload == self.queue_name
+                if notified:
+                    self.wakeup_trigger.notify(
+                        f"{self.queue_name} changed"
+                    )
+        finally:
+            connection.invalidate()
+            connection.close()
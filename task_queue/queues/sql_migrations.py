@@ -0,0 +1,208 @@
+"""Wherein are contained the functions that create the indexes of a SQL
+Queue table and bring tables created by older versions of the queue up to
+date.
+"""
+from sqlalchemy import Engine, text, inspect
+
+from .queue_base import QueueItemStage
+
+# Columns added to the queue table after its first version, with their
+# definitions.
+SQL_QUEUE_ADDED_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "json_native": "BOOLEAN NOT NULL DEFAULT false",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "not_before": "TIMESTAMP WITH TIME ZONE",
+    "lease_owner": "VARCHAR",
+    "lease_expires": "TIMESTAMP WITH TIME ZONE",
+}
+
+def add_sql_queue_columns(engine:Engine, tablename:str="sqlqueue"):
+    """Adds the columns introduced after a queue table was first created, if
+    they are missing. Safe to call on tables created by any version of the
+    queue. The statement timeout of the engine is disabled for the
+    migration.
+
+    Parameters:
+    -----------
+    engine: sqlalchemy.Engine
+        Engine connected to the database holding the queue table.
+    tablename: str (default "sqlqueue")
+        Name of the table used for the SQL Queue.
+    """
+    with engine.connect() as connection:
+        connection.execute(text("SET LOCAL statement_timeout = 0"))
+        for column_name, column_definition in SQL_QUEUE_ADDED_COLUMNS.items():
+            connection.execute(text(
+                f"ALTER TABLE {tablename} "
+                f"ADD COLUMN IF NOT EXISTS {column_name} {column_definition}"
+            ))
+        connection.commit()
+
+def convert_legacy_json_data(engine:Engine,
+                             tablename:str="sqlqueue",
+                             batch_size:int=10000):
+    """Rewrites item bodies stored as JSON strings by older versions of the
+    queue into native JSONB values, one batch per transaction. Reading the
+    queue does not require this, but converted rows can be filtered on their
+    body by the database.
+
+    Parameters:
+    -----------
+    engine: sqlalchemy.Engine
+        Engine connected to the database holding the queue table.
+    tablename: str (default "sqlqueue")
+        Name of the table used for the SQL Queue.
+    batch_size: int (default=10000)
+        Number of rows converted per transaction.
+
+    Returns:
+    -----------
+    Returns the number of rows converted.
+    """
+    n_converted = 0
+    while True:
+        with engine.connect() as connection:
+            result = connection.execute(
+                text(
+                    f"UPDATE {tablename} "
+                    "SET json_data = (json_data #>> '{}')::jsonb, "
+                    "json_native = true "
+                    f"WHERE id IN (SELECT id FROM {tablename} "
+                    "WHERE NOT json_native LIMIT :batch_size "
+                    "FOR UPDATE SKIP LOCKED)"
+                ),
+                {"batch_size": batch_size}
+            )
+            connection.commit()
+        if result.rowcount == 0:
+            return n_converted
+        n_converted += result.rowcount
+
+def create_sql_queue_indexes(engine:Engine,
+                             tablename:str="sqlqueue",
+                             partial_index:bool=False,
+                             concurrently:bool=False):
+    """Creates the indexes used to find queue items by stage, if they do not
+    exist yet. Safe to call on tables created by older versions of the queue.
+
+    The composite `(queue_name, queue_item_stage, priority DESC, id)` index
+    serves `get`, `peek`, `size` and `lookup_state` without scanning the rows
+    of other queues or stages, and hands out WAITING items in claim order.
+    The `(queue_name, queue_item_stage, index_key)` index lets
+    `lookup_state_page` seek straight to its cursor. The partial
+    `(queue_name, not_before)` index only holds items waiting for a retry,
+    so `get` finds the ones that are due without scanning the queue. The
+    partial `(queue_name, lease_expires)` index likewise only holds leased
+    items, for `expire_leases`. The optional partial
+    index only holds WAITING and PROCESSING rows, so it stays small no matter
+    how many SUCCESS and FAIL rows accumulate.
+
+    Parameters:
+    -----------
+    engine: sqlalchemy.Engine
+        Engine connected to the database holding the queue table.
+    tablename: str (default "sqlqueue")
+        Name of the table used for the SQL Queue.
+    partial_index: bool (default=False)
+        Also create the partial index on WAITING and PROCESSING rows.
+    concurrently: bool (default=False)
+        Build the indexes with `CREATE INDEX CONCURRENTLY`, which does not
+        block writes to the table. Use this when migrating a large table that
+        is in use. The statement timeout of the engine is disabled while the
+        indexes are built.
+    """
+    indexes = [
+        (
+            f"{tablename}_queue_stage_priority_id_idx",
+            "(queue_name, queue_item_stage, priority DESC, id)"
+        ),
+        (
+            f"{tablename}_queue_stage_key_idx",
+            '(queue_name, queue_item_stage, index_key COLLATE "C")'
+        ),
+        (
+            f"{tablename}_queue_not_before_idx",
+            "(queue_name, not_before) WHERE not_before IS NOT NULL"
+        ),
+        (
+            f"{tablename}_queue_lease_expires_idx",
+            "(queue_name, lease_expires) WHERE lease_expires IS NOT NULL"
+        ),
+    ]
+    if partial_index:
+        active_stages = ", ".join(
+            str(stage.value)
+            for stage in (QueueItemStage.WAITING, QueueItemStage.PROCESSING)
+        )
+        indexes.append((
+            f"{tablename}_active_stage_priority_id_idx",
+            "(queue_name, queue_item_stage, priority DESC, id) "
+            f"WHERE queue_item_stage IN ({active_stages})"
+        ))
+
+    concurrently_clause = " CONCURRENTLY" if concurrently else ""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        # RESET goes back to the timeout the connection was opened with,
+        # before it returns to the pool.
+        connection.execute(text("SET statement_timeout = 0"))
+        try:
+            for index_name, index_definition in indexes:
+                connection.execute(text(
+                    f"CREATE INDEX{concurrently_clause} IF NOT EXISTS "
+                    f"{index_name} ON {tablename} {index_definition}"
+                ))
+        finally:
+            connection.execute(text("RESET statement_timeout"))
+
+def migrate_sql_queue(engine:Engine,
+                      tablename:str="sqlqueue",
+                      partial_index:bool=False):
+    """Brings a queue table created by an older version of the queue up to
+    date: adds the missing columns and builds the missing indexes with
+    `CREATE INDEX CONCURRENTLY`, so writes to the table are not blocked. The
+    statement timeout of the engine is disabled for the migration. Run it
+    once per upgrade, before starting the queue on the table.
+
+    Parameters:
+    -----------
+    engine: sqlalchemy.Engine
+        Engine connected to the database holding the queue table.
+    tablename: str (default "sqlqueue")
+        Name of the table used for the SQL Queue.
+    partial_index: bool (default=False)
+        Also create the partial index on WAITING and PROCESSING rows.
+    """
+    add_sql_queue_columns(engine, tablename)
+    create_sql_queue_indexes(
+        engine, tablename, partial_index, concurrently=True
+    )
+
+def check_sql_queue_columns(engine:Engine, tablename:str="sqlqueue"):
+    """Raises a ValueError if the queue table lacks columns added by newer
+    versions of the queue.
+
+    Parameters:
+    -----------
+    engine: sqlalchemy.Engine
+        Engine connected to the database holding the queue table.
+    tablename: str (default "sqlqueue")
+        Name of the table used for the SQL Queue.
+    """
+    column_names = {
+        column["name"] for column in inspect(engine).get_columns(tablename)
+    }
+    missing_columns = [
+        column_name for column_name in SQL_QUEUE_ADDED_COLUMNS
+        if column_name not in column_names
+    ]
+    if missing_columns:
+        raise ValueError(
+            f"Table {tablename} is missing the columns "
+            f"{', '.join(missing_columns)}. Upgrade it by starting once "
+            "with SQL_QUEUE_MIGRATE=true or --migrate, or with "
+            "`migrate_sql_queue` from `task_queue.queues.sql_migrations`."
+        )
@@ -1,14 +1,25 @@
 """Wherein is contained the functions for implementing the SQL Queue.
 """
+# The SQLQueue class implements the whole queue API in SQL, the table
+# migrations and the listener already live in their own modules.
+# pylint: disable=too-many-lines
+from datetime import datetime
 from typing import Optional, Any
 import json
 
 from sqlmodel import Field, Session, SQLModel, select, func, UniqueConstraint
-from sqlalchemy.dialects.postgresql import insert, JSONB
-from sqlalchemy import Engine, Column
+from sqlalchemy.dialects.postgresql import insert, JSONB, ARRAY
+from sqlalchemy import (
+    Engine, Column, DateTime, String, update, any_, bindparam, text, cast,
+    literal, case, or_, true, inspect
+)
 
 from task_queue import logger
 from .queue_base import QueueBase, QueueItemStage
+from .sql_listener import sql_queue_notify_channel
+from .sql_migrations import (
+    check_sql_queue_columns, create_sql_queue_indexes, migrate_sql_queue
+)
 
 def new_sql_queue_table(tablename:str, constraint_name:str):
     """Creates a SQL table for the SQL Queue based on the table name provided.
@@ -35,32 +46,162 @@ def new_sql_queue_table(tablename:str, constraint_name:str):
 
         id: Optional[int] = Field(default=None, primary_key=True)
         queue_item_stage: Optional[int] = QueueItemStage.WAITING.value
-        json_data: dict[Any, Any] = Field(sa_column=Column(JSONB))
+        # Higher priority items are claimed first, then in the order they
+        # were added.
+        priority: int = Field(default=0, sa_column_kwargs={
+            "server_default": "0", "nullable": False
+        })
+        json_data: Any = Field(sa_column=Column(JSONB))
+        # Rows written by older versions hold the item body as a JSON string
+        # scalar instead of a JSONB value, and have json_native = false.
+        json_native: bool = Field(default=True, sa_column_kwargs={
+            "server_default": "false", "nullable": False
+        })
         index_key: str
         queue_name: str
+        # Number of failed attempts, and for WAITING items sent back by a
+        # retry policy, the time before which they are not handed out.
+        attempts: int = Field(default=0, sa_column_kwargs={
+            "server_default": "0", "nullable": False
+        })
+        not_before: Optional[datetime] = Field(
+            default=None,
+            sa_column=Column(DateTime(timezone=True), nullable=True)
+        )
+        # Consumer holding a leased PROCESSING item, and when the lease
+        # expires.
+        lease_owner: Optional[str] = None
+        lease_expires: Optional[datetime] = Field(
+            default=None,
+            sa_column=Column(DateTime(timezone=True), nullable=True)
+        )
     return SqlQueueTable
 
-class SQLQueue(QueueBase):
+def decode_json_data(json_data, json_native):
+    """Returns the item body stored in a queue row.
+
+    Parameters:
+    -----------
+    json_data: Any
+        Value of the `json_data` column, already decoded from JSONB.
+    json_native: bool
+        Value of the `json_native` column. False for rows written by older
+        versions, whose `json_data` is the item body encoded as a JSON string.
+
+    Returns:
+    -----------
+    Returns the item body.
+    """
+    if json_native:
+        return json_data
+    return json.loads(json_data)
+
+def new_sql_queue_sizes_table(tablename:str):
+    """Creates a SQL table which caches how many items each queue has in each
+    stage.
+
+    Parameters:
+    -----------
+    tablename: str
+        Name for the table used to cache the queue sizes
+
+    Returns:
+    -----------
+    Returns the model class for the specific table
+    """
+    class SqlQueueSizesTable(SQLModel, table=True):
+        """Class to define the schema for a row in the SQL sizes table.
+        """
+        __tablename__ = tablename
+        __table_args__ = {'extend_existing':True}
+
+        queue_name: str = Field(primary_key=True)
+        queue_item_stage: int = Field(primary_key=True)
+        item_count: int = 0
+    return SqlQueueSizesTable
+
+# The queue API (leases, bulk transitions, paging) is one public method per
+# operation and is split no further.
+class SQLQueue(QueueBase):  # pylint: disable=too-many-public-methods
     """Creates the SQL Queue.
     """
+    supports_priorities = True
+
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
     def __init__(self,
                  engine,
                  queue_name,
                  tablename="sqlqueue",
-                 constraint_name="_queue_name_index_key_uc"):
+                 constraint_name="_queue_name_index_key_uc",
+                 *,
+                 cache_sizes=False,
+                 partial_index=False,
+                 notify=False,
+                 retry_policy=None,
+                 migrate=False):
         """Initializes the QueueBase class.
+
+        A new queue table is created with its columns and indexes. An
+        existing table is not altered unless `migrate` is set, and a
+        ValueError is raised if it lacks columns the queue needs.
+
+        Parameters:
+        -----------
+        cache_sizes: bool (default=False)
+            Keep per-stage item counts in a `<tablename>_sizes` table, updated
+            in the same transaction as every stage move, so `size` and `sizes`
+            do not have to count the rows of the queue table. Every process
+            writing to the queue must use the same setting, otherwise the
+            counts drift until `refresh_size_counts` is called.
+        partial_index: bool (default=False)
+            Also create a partial index on WAITING and PROCESSING rows when
+            the table is created or migrated. See
+            `sql_migrations.create_sql_queue_indexes`.
+        notify: bool (default=False)
+            Send a Postgres NOTIFY on the `sql_queue_notify_channel` channel,
+            with the queue name as payload, when items are put or moved to
+            WAITING, SUCCESS or FAIL. `SQLQueueListener` uses these to wake
+            the work queue service.
+        retry_policy: RetryPolicy (default=None)
+            Policy deciding which failed items go back to WAITING, and when.
+            The retry delay is computed by the database, from its clock.
+        migrate: bool (default=False)
+            Run `migrate_sql_queue` on an existing table before using it.
+            Prefer running it once per upgrade, outside of the processes
+            using the queue.
         """
         self.sql_queue = new_sql_queue_table(tablename, constraint_name)
+        self.notify_channel = None
+        if notify:
+            self.notify_channel = sql_queue_notify_channel(tablename)
+        self.sql_queue_sizes = None
+        if cache_sizes:
+            self.sql_queue_sizes = new_sql_queue_sizes_table(
+                f"{tablename}_sizes"
+            )
+        table_exists = inspect(engine).has_table(tablename)
         SQLModel.metadata.create_all(engine)
+        if not table_exists:
+            # The table is empty, so building its indexes is cheap.
+            create_sql_queue_indexes(engine, tablename, partial_index)
+        elif migrate:
+            migrate_sql_queue(engine, tablename, partial_index)
+        else:
+            check_sql_queue_columns(engine, tablename)
         self.queue_name = queue_name
         self.engine = engine
+        self.retry_policy = retry_policy
+
+        if self.sql_queue_sizes is not None:
+            self.refresh_size_counts()
 
     # Disabled pylint because BaseException is used to record
     # and keep the program running correctly until the raise
     # BaseException is used to report on the error
     # pylint: disable=broad-exception-caught
     # pylint: disable=broad-exception-raised
-    def put(self, items):
+    def put(self, items, priorities=None):
         """Adds a new Item to the Queue in the WAITING stage.
 
         Parameters:
@@ -70,39 +211,68 @@ class SQLQueue(QueueBase):
             pair, where key=index_key, and value is the json expected when the
             job is submitted for processing. The item ID must be a string and
             the item body must be serializable.
+        priorities: dict (default=None)
+            Optional dictionary of item ID to integer priority. Items with a
+            higher priority are claimed by `get` first; items without one
+            have priority 0. Items of equal priority are claimed in the order
+            they were added.
 
         Returns:
         -----------
         Returns the number of items successfully added to the sql queue.
         """
-        items = self._put(items)
-
         if len(items) == 0:
             # Nothing to add.
             return 0
 
+        if priorities is None:
+            priorities = {}
+
         fail_items = []
 
         db_items = []
         for k, v in items.items():
             try:
-                db_items.append(
-                    self.sql_queue(
-                        json_data=json.dumps(v),
-                        index_key=str(k),
-                        queue_name=self.queue_name
-                    ).model_dump(exclude_unset=True)
-                )
+                # The body is encoded once here and parsed into a JSONB value
+                # by the database.
+                db_items.append({
+                    "json_data": cast(literal(json.dumps(v), String), JSONB),
+                    "json_native": True,
+                    "index_key": str(k),
+                    "queue_name": self.queue_name,
+                    "priority": int(priorities.get(k, 0))
+                })
             except Exception as e:
                 logger.warning(e)
 
 
-        with Session(self.engine) as session:
-            statement = (insert(self.sql_queue).values(db_items) \
-                         .on_conflict_do_nothing())
-            session.exec(statement)
+        added_ids = []
+        if db_items:
+            # Items whose index_key is already in this queue are skipped by
+            # the unique constraint, so duplicates are found without reading
+            # the IDs already in the table.
+            with Session(self.engine) as session:
+                statement = (insert(self.sql_queue).values(db_items) \
+                             .on_conflict_do_nothing() \
+                             .returning(self.sql_queue.index_key))
+                added_ids = session.exec(statement).scalars().all()
+                self._update_size_counts(
+                    session,
+                    {QueueItemStage.WAITING: len(added_ids)}
+                )
+                if added_ids:
+                    self._notify(session)
 
-            session.commit()
+                session.commit()
+
+        added_id_set = set(added_ids)
+        self._warn_duplicates(
+            [
+                item["index_key"]
+                for item in db_items
+                if item["index_key"] not in added_id_set
+            ]
+        )
 
         if len(db_items) != len(items):
             logger.error("Error writing at least one queue object to SQL: %s",\
@@ -111,89 +281,673 @@ class SQLQueue(QueueBase):
                 "Error writing at least one queue object to SQL:",
                 fail_items)
 
-        return len(db_items)
+        return len(added_ids)
 
-    def get(self, n_items=1):
+    def get(self, n_items=1, lease_owner=None, lease_sec=None):
         """Gets the next n items from the queue, moving them to PROCESSING.
 
+        The items are claimed with a single `UPDATE ... RETURNING` statement
+        whose row selection uses `FOR UPDATE SKIP LOCKED`, so several
+        processes can safely call `get` on the same queue at once without
+        claiming the same item twice. The lease expiry is computed by the
+        database, from its clock.
+
         Parameters:
         -----------
         n_items: int
             Number of items to retrieve from queue.
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
 
         Returns:
         ------------
         Returns a list of n_items from the queue, as
         List[(queue_item_id, queue_item_body)]
         """
+        n_items = max(n_items, 0)
+
         with Session(self.engine) as session:
-            stmt = select(self.sql_queue).where(
-                (self.queue_name == self.sql_queue.queue_name) &
-                (self.sql_queue.queue_item_stage==QueueItemStage.WAITING.value)
-            ).limit(n_items)
-            results = session.exec(stmt)
+            self._release_due_items(session, n_items)
+            next_ids = (
+                select(self.sql_queue.id)
+                .where(
+                    (self.queue_name == self.sql_queue.queue_name) &
+                    (self.sql_queue.queue_item_stage
+                     == QueueItemStage.WAITING.value) &
+                    self.sql_queue.not_before.is_(None)
+                )
+                .order_by(self.sql_queue.priority.desc(), self.sql_queue.id)
+                .limit(n_items)
+                .with_for_update(skip_locked=True)
+            )
+            claimed = (
+                update(self.sql_queue)
+                .where(self.sql_queue.id.in_(next_ids.scalar_subquery()))
+                .values(
+                    queue_item_stage=QueueItemStage.PROCESSING.value,
+                    **self._lease_values(lease_owner, lease_sec)
+                )
+                .returning(
+                    self.sql_queue.id,
+                    self.sql_queue.priority,
+                    self.sql_queue.index_key,
+                    self.sql_queue.json_data,
+                    self.sql_queue.json_native
+                )
+                .cte("claimed")
+            )
+            # RETURNING has no defined order, so sort the claimed rows the
+            # same way `peek` does.
+            stmt = (
+                select(
+                    claimed.c.index_key,
+                    claimed.c.json_data,
+                    claimed.c.json_native
+                )
+                .order_by(claimed.c.priority.desc(), claimed.c.id)
+            )
+            results = session.exec(stmt).all()
+            self._update_size_counts(
+                session,
+                {
+                    QueueItemStage.WAITING: -len(results),
+                    QueueItemStage.PROCESSING: len(results)
+                }
+            )
+            session.commit()
 
-            outputs = []
-            for queue_item in results:
-                outputs.append((queue_item.index_key,
-                                json.loads(queue_item.json_data)))
-                update_stage(self.engine,
-                             self.queue_name,
-                             QueueItemStage.PROCESSING,
-                             queue_item.index_key,
-                             self.sql_queue)
+        outputs = []
+        for index_key, json_data, json_native in results:
+            outputs.append(
+                (index_key, decode_json_data(json_data, json_native))
+            )
 
-            return outputs
+        return outputs
+
+    def _lease_values(self, lease_owner, lease_sec):
+        """Returns the column values leasing an Item to `lease_owner` for
+        `lease_sec` seconds from now, or clearing its lease when `lease_sec`
+        is None.
+        """
+        if lease_sec is None:
+            return {"lease_owner": None, "lease_expires": None}
+        return {
+            "lease_owner": lease_owner,
+            "lease_expires": func.now() + func.make_interval(
+                0, 0, 0, 0, 0, 0, lease_sec
+            )
+        }
+
+    def extend_lease(self, item_ids, lease_owner, lease_sec):
+        """Extends the lease of PROCESSING Items held by `lease_owner` to
+        `lease_sec` seconds from now, with a single UPDATE statement. Other
+        Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+        lease_sec: float
+            New duration of the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs whose lease was extended.
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        if not item_ids:
+            return []
+
+        with Session(self.engine) as session:
+            statement = (
+                update(self.sql_queue)
+                .where(
+                    (self.sql_queue.queue_name == self.queue_name) &
+                    (self.sql_queue.index_key == any_(
+                        bindparam("item_ids", item_ids, type_=ARRAY(String))
+                    )) &
+                    (self.sql_queue.queue_item_stage
+                     == QueueItemStage.PROCESSING.value) &
+                    (self.sql_queue.lease_owner == lease_owner)
+                )
+                .values(**self._lease_values(lease_owner, lease_sec))
+                .returning(self.sql_queue.index_key)
+            )
+            extended_ids = session.exec(statement).scalars().all()
+            session.commit()
+
+        return extended_ids
+
+    def ack_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` to SUCCESS with a
+        single UPDATE statement. Other Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = self._move_stage(
+            item_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.SUCCESS,
+            values=self._lease_values(None, None),
+            where=self.sql_queue.lease_owner == lease_owner
+        )
+        for item_id in moved_ids:
+            logger.info("Job %s successfully completed", item_id)
+        return moved_ids
+
+    def release_lease(self, item_ids, lease_owner):
+        """Moves PROCESSING Items leased to `lease_owner` back to WAITING
+        with a single UPDATE statement. Other Items are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str
+            Name of the consumer holding the leases.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        return self._move_stage(
+            item_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.WAITING,
+            values=self._lease_values(None, None),
+            where=self.sql_queue.lease_owner == lease_owner
+        )
+
+    def expire_leases(self):
+        """Moves the PROCESSING Items whose lease has expired back to
+        WAITING with a single UPDATE statement. Rows locked by another
+        process are skipped, so several sweepers can run at once.
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        expired_ids = (
+            select(self.sql_queue.id)
+            .where(
+                (self.sql_queue.queue_name == self.queue_name) &
+                (self.sql_queue.lease_expires <= func.now()) &
+                (self.sql_queue.queue_item_stage
+                 == QueueItemStage.PROCESSING.value)
+            )
+            .with_for_update(skip_locked=True)
+        )
+        with Session(self.engine) as session:
+            statement = (
+                update(self.sql_queue)
+                .where(self.sql_queue.id.in_(expired_ids.scalar_subquery()))
+                .values(
+                    queue_item_stage=QueueItemStage.WAITING.value,
+                    **self._lease_values(None, None)
+                )
+                .returning(self.sql_queue.index_key)
+            )
+            moved_ids = session.exec(statement).scalars().all()
+            self._update_size_counts(
+                session,
+                {
+                    QueueItemStage.PROCESSING: -len(moved_ids),
+                    QueueItemStage.WAITING: len(moved_ids)
+                }
+            )
+            if moved_ids:
+                self._notify(session)
+            session.commit()
+
+        for item_id in moved_ids:
+            logger.info("Lease of job %s expired", item_id)
+        return moved_ids
+
+    def get_items(self, item_ids, lease_owner=None, lease_sec=None):
+        """Moves the given Items from WAITING to PROCESSING, wherever they
+        are in the Queue, with a single UPDATE statement. Items that are not
+        WAITING, including ones claimed by another process at the same time,
+        are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        lease_owner: str (default=None)
+            Name of the consumer the items are leased to.
+        lease_sec: float (default=None)
+            Duration of the lease. By default the items are not leased.
+
+        Returns:
+        ------------
+        Returns a list of the Items that were moved, in the order of
+        item_ids, as List[(queue_item_id, queue_item_body)]
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        if not item_ids:
+            return []
+
+        with Session(self.engine) as session:
+            self._release_due_items(session, len(item_ids), item_ids)
+            statement = (
+                update(self.sql_queue)
+                .where(
+                    (self.sql_queue.queue_name == self.queue_name) &
+                    (self.sql_queue.index_key == any_(
+                        bindparam("item_ids", item_ids, type_=ARRAY(String))
+                    )) &
+                    (self.sql_queue.queue_item_stage
+                     == QueueItemStage.WAITING.value) &
+                    self.sql_queue.not_before.is_(None)
+                )
+                .values(
+                    queue_item_stage=QueueItemStage.PROCESSING.value,
+                    **self._lease_values(lease_owner, lease_sec)
+                )
+                .returning(
+                    self.sql_queue.index_key,
+                    self.sql_queue.json_data,
+                    self.sql_queue.json_native
+                )
+            )
+            results = session.exec(statement).all()
+            self._update_size_counts(
+                session,
+                {
+                    QueueItemStage.WAITING: -len(results),
+                    QueueItemStage.PROCESSING: len(results)
+                }
+            )
+            session.commit()
+
+        bodies = {
+            index_key: decode_json_data(json_data, json_native)
+            for index_key, json_data, json_native in results
+        }
+        return [
+            (item_id, bodies[item_id])
+            for item_id in dict.fromkeys(item_ids)
+            if item_id in bodies
+        ]
 
     def peek(self, n_items=1):
         with Session(self.engine) as session:
             stmt = select(self.sql_queue).where(
                 (self.queue_name == self.sql_queue.queue_name) &
                 (self.sql_queue.queue_item_stage==QueueItemStage.WAITING.value)
+                & or_(
+                    self.sql_queue.not_before.is_(None),
+                    self.sql_queue.not_before <= func.now()
+                )
+            ).order_by(
+                self.sql_queue.priority.desc(), self.sql_queue.id
             ).limit(n_items)
             results = session.exec(stmt)
 
             outputs = []
             for queue_item in results:
-                outputs.append((queue_item.index_key,
-                                json.loads(queue_item.json_data)))
+                outputs.append((
+                    queue_item.index_key,
+                    decode_json_data(
+                        queue_item.json_data, queue_item.json_native
+                    )
+                ))
 
             return outputs
 
 
+    def _release_due_items(self, session, n_items, item_ids=None):
+        """Clears the retry time of up to `n_items` WAITING items whose retry
+        is due, longest due first, in the caller's transaction, so they can
+        be claimed. Rows locked by another process doing the same are
+        skipped.
+
+        Parameters:
+        -----------
+        session: Session
+            Open session whose transaction then claims Items.
+        n_items: int
+            Most Items released.
+        item_ids: [str] (default=None)
+            Only release these Items.
+        """
+        if n_items <= 0:
+            return
+        condition = (
+            (self.sql_queue.queue_name == self.queue_name) &
+            (self.sql_queue.not_before <= func.now())
+        )
+        if item_ids is not None:
+            condition &= self.sql_queue.index_key == any_(
+                bindparam("due_item_ids", item_ids, type_=ARRAY(String))
+            )
+        due_ids = (
+            select(self.sql_queue.id)
+            .where(condition)
+            .order_by(self.sql_queue.not_before)
+            .limit(n_items)
+            .with_for_update(skip_locked=True)
+        )
+        session.exec(
+            update(self.sql_queue)
+            .where(self.sql_queue.id.in_(due_ids.scalar_subquery()))
+            .values(not_before=None)
+        )
+
     def success(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to SUCCESS.
+        """Moves a Queue Item from PROCESSING to SUCCESS. Raises KeyError if
+        the Item is not PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
         """
-        update_stage(
-            self.engine,
-            self.queue_name,
-            QueueItemStage.SUCCESS,
-            queue_item_id,
-            self.sql_queue
-        )
-        logger.info("Job %s successfully completed", queue_item_id)
+        if not self.success_many([queue_item_id]):
+            logger.error("Item %s is not processing", queue_item_id)
+            raise KeyError(queue_item_id)
 
     def fail(self, queue_item_id):
-        """Moves a Queue Item from PROCESSING to FAIL.
+        """Moves a Queue Item from PROCESSING to FAIL, or back to WAITING if
+        the retry policy tries it again. Raises KeyError if the Item is not
+        PROCESSING.
 
         Parameters:
         -----------
         queue_item_id: str
             ID of Queue Item
+
+        Returns:
+        ------------
+        Returns True if the Item will be retried.
         """
-        update_stage(
-            self.engine,
-            self.queue_name,
-            QueueItemStage.FAIL,
-            queue_item_id,
-            self.sql_queue
+        failed_ids, retried_ids = self.fail_many([queue_item_id])
+        if not failed_ids and not retried_ids:
+            logger.error("Item %s is not processing", queue_item_id)
+            raise KeyError(queue_item_id)
+        return bool(retried_ids)
+
+    def success_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to SUCCESS with a single
+        UPDATE statement. Items that are not PROCESSING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a list of the IDs that were moved.
+        """
+        moved_ids = self._move_stage(
+            item_ids,
+            QueueItemStage.PROCESSING,
+            QueueItemStage.SUCCESS,
+            values=self._lease_values(None, None)
+        )
+        for item_id in moved_ids:
+            logger.info("Job %s successfully completed", item_id)
+        return moved_ids
+
+    def fail_many(self, item_ids):
+        """Moves several Queue Items from PROCESSING to FAIL with a single
+        UPDATE statement, which also counts the failed attempt. With a retry
+        policy, the Items it tries again go back to WAITING instead, with a
+        retry time computed by the database.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+
+        Returns:
+        ------------
+        Returns a tuple of the IDs that were moved to FAIL and the IDs that
+        will be retried. Items that are not PROCESSING are skipped.
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        if not item_ids:
+            return [], []
+
+        # Column values in SET are those from before the update, so
+        # `attempts` still excludes the attempt that just failed.
+        values = {
+            "attempts": self.sql_queue.attempts + 1,
+            "queue_item_stage": QueueItemStage.FAIL.value,
+            **self._lease_values(None, None)
+        }
+        policy = self.retry_policy
+        if policy is not None:
+            retry = self.sql_queue.attempts + 1 < policy.max_attempts
+            delay_sec = (
+                func.least(
+                    policy.backoff_sec * func.power(
+                        policy.backoff_multiplier, self.sql_queue.attempts
+                    ),
+                    policy.max_backoff_sec
+                ) * (1 - policy.jitter * func.random())
+            )
+            values = {
+                "attempts": self.sql_queue.attempts + 1,
+                "queue_item_stage": case(
+                    (retry, QueueItemStage.WAITING.value),
+                    else_=QueueItemStage.FAIL.value
+                ),
+                "not_before": case(
+                    (retry, func.now() + func.make_interval(
+                        0, 0, 0, 0, 0, 0, delay_sec
+                    )),
+                    else_=None
+                ),
+                **self._lease_values(None, None)
+            }
+
+        with Session(self.engine) as session:
+            statement = (
+                update(self.sql_queue)
+                .where(
+                    (self.sql_queue.queue_name == self.queue_name) &
+                    (self.sql_queue.index_key == any_(
+                        bindparam("item_ids", item_ids, type_=ARRAY(String))
+                    )) &
+                    (self.sql_queue.queue_item_stage
+                     == QueueItemStage.PROCESSING.value)
+                )
+                .values(**values)
+                .returning(
+                    self.sql_queue.index_key,
+                    self.sql_queue.queue_item_stage
+                )
+            )
+            moved = session.exec(statement).all()
+            retried_ids = [
+                index_key for index_key, stage in moved
+                if stage == QueueItemStage.WAITING.value
+            ]
+            self._update_size_counts(
+                session,
+                {
+                    QueueItemStage.PROCESSING: -len(moved),
+                    QueueItemStage.WAITING: len(retried_ids),
+                    QueueItemStage.FAIL: len(moved) - len(retried_ids)
+                }
+            )
+            if moved:
+                self._notify(session)
+            session.commit()
+
+        retried_set = set(retried_ids)
+        for index_key, _ in moved:
+            if index_key in retried_set:
+                logger.info("Job %s failed, it will be retried", index_key)
+            else:
+                logger.info("Job %s failed", index_key)
+        failed_ids = [
+            index_key for index_key, _ in moved
+            if index_key not in retried_set
+        ]
+        return failed_ids, retried_ids
+
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
+    def _move_stage(self, item_ids, from_stage, to_stage, values=None,
+                    where=None):
+        """Moves every Item in `item_ids` that is currently in `from_stage`
+        to `to_stage` with a single UPDATE statement.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        from_stage: QueueItemStage
+            Stage the Items must currently be in to be moved.
+        to_stage: QueueItemStage
+            Stage to move the Items to.
+        values: dict (default=None)
+            Other columns to set on the moved Items.
+        where: ColumnElement (default=None)
+            Further condition the Items must meet to be moved.
+
+        Returns:
+        -----------
+        Returns a list of the IDs that were moved.
+        """
+        item_ids = [str(item_id) for item_id in item_ids]
+        if not item_ids:
+            return []
+
+        with Session(self.engine) as session:
+            statement = (
+                update(self.sql_queue)
+                .where(
+                    (self.sql_queue.queue_name == self.queue_name) &
+                    (self.sql_queue.index_key == any_(
+                        bindparam("item_ids", item_ids, type_=ARRAY(String))
+                    )) &
+                    (self.sql_queue.queue_item_stage == from_stage.value) &
+                    (where if where is not None else true())
+                )
+                .values(queue_item_stage=to_stage.value, **(values or {}))
+                .returning(self.sql_queue.index_key)
+            )
+            moved_ids = session.exec(statement).scalars().all()
+            self._update_size_counts(
+                session,
+                {from_stage: -len(moved_ids), to_stage: len(moved_ids)}
+            )
+            # Items claimed for processing were claimed by the service that
+            # would be notified, so only other moves are announced.
+            if moved_ids and to_stage != QueueItemStage.PROCESSING:
+                self._notify(session)
+            session.commit()
+
+        return moved_ids
+
+    def _notify(self, session):
+        """Sends a notification that the queue changed, delivered when the
+        caller's transaction commits. Does nothing when notify is off.
+        """
+        if self.notify_channel is None:
+            return
+        session.exec(
+            select(func.pg_notify(self.notify_channel, self.queue_name))
+        )
+
+    def _update_size_counts(self, session, deltas):
+        """Adds the given deltas to the cached queue sizes, in the caller's
+        transaction. Does nothing when sizes are not cached.
+
+        Parameters:
+        -----------
+        session: Session
+            Open session whose transaction also moves the Items.
+        deltas: Dict[QueueItemStage, int]
+            Change in the number of Items for each stage.
+        """
+        if self.sql_queue_sizes is None:
+            return
+
+        # Always touch the counter rows in the same order so concurrent
+        # transactions cannot deadlock on them.
+        rows = [
+            {
+                "queue_name": self.queue_name,
+                "queue_item_stage": stage.value,
+                "item_count": delta
+            }
+            for stage, delta in sorted(
+                deltas.items(),
+                key=lambda stage_delta: stage_delta[0].value
+            )
+            if delta != 0
+        ]
+        if not rows:
+            return
+
+        statement = insert(self.sql_queue_sizes).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["queue_name", "queue_item_stage"],
+            set_={
+                "item_count": (self.sql_queue_sizes.item_count
+                               + statement.excluded.item_count)
+            }
         )
-        logger.info("Job %s failed", queue_item_id)
+        session.exec(statement)
+
+    def refresh_size_counts(self):
+        """Recounts the items in each stage and overwrites the cached queue
+        sizes. Only used when sizes are cached.
+
+        The counter rows are locked before counting, so stage moves that
+        happen at the same time are not lost.
+        """
+        if self.sql_queue_sizes is None:
+            return
+
+        with Session(self.engine) as session:
+            # Make sure every counter row exists so all of them can be locked.
+            session.exec(
+                insert(self.sql_queue_sizes).values([
+                    {
+                        "queue_name": self.queue_name,
+                        "queue_item_stage": stage.value,
+                        "item_count": 0
+                    }
+                    for stage in QueueItemStage
+                ]).on_conflict_do_nothing()
+            )
+            session.exec(
+                select(self.sql_queue_sizes)
+                .where(self.sql_queue_sizes.queue_name == self.queue_name)
+                .order_by(self.sql_queue_sizes.queue_item_stage)
+                .with_for_update()
+            ).all()
+
+            counts = self._count_stages(session)
+            for stage in QueueItemStage:
+                session.exec(
+                    update(self.sql_queue_sizes)
+                    .where(
+                        (self.sql_queue_sizes.queue_name == self.queue_name) &
+                        (self.sql_queue_sizes.queue_item_stage == stage.value)
+                    )
+                    .values(item_count=counts.get(stage.value, 0))
+                )
+            session.commit()
 
     # Pylint cannot correctly tell that func has a count method
     # This raises an error that can be ignored
@@ -211,6 +965,9 @@ class SQLQueue(QueueBase):
         ------------
         Returns the number of Items in that stage of the Queue as an integer.
         """
+        if self.sql_queue_sizes is not None:
+            return self.sizes()[queue_item_stage.name]
+
         with Session(self.engine) as session:
             statement = select(func.count(self.sql_queue.id)).filter(
                 self.sql_queue.queue_name == self.queue_name,
@@ -219,6 +976,54 @@ class SQLQueue(QueueBase):
 
             return session.exec(statement).first()
 
+    def sizes(self):
+        """Determines how many Items are in each stage of the Queue with a
+        single query.
+
+        Returns:
+        ------------
+        Returns the number of Items in each stage of the Queue as an integer.
+        """
+        with Session(self.engine) as session:
+            if self.sql_queue_sizes is not None:
+                statement = (
+                    select(
+                        self.sql_queue_sizes.queue_item_stage,
+                        self.sql_queue_sizes.item_count
+                    )
+                    .where(self.sql_queue_sizes.queue_name == self.queue_name)
+                )
+                counts = dict(session.exec(statement).all())
+            else:
+                counts = self._count_stages(session)
+
+        return {
+            stage.name: counts.get(stage.value, 0)
+            for stage in QueueItemStage
+        }
+
+    def _count_stages(self, session):
+        """Counts the rows of this queue in each stage with one GROUP BY query.
+
+        Parameters:
+        -----------
+        session: Session
+            Open session to run the query in.
+
+        Returns:
+        ------------
+        Returns a dictionary of stage value to number of Items.
+        """
+        statement = (
+            select(
+                self.sql_queue.queue_item_stage,
+                func.count(self.sql_queue.id)
+            )
+            .where(self.sql_queue.queue_name == self.queue_name)
+            .group_by(self.sql_queue.queue_item_stage)
+        )
+        return dict(session.exec(statement).all())
+
     def lookup_status(self, queue_item_id):
         """Lookup which stage in the Queue Item is currently in.
 
@@ -271,6 +1076,101 @@ class SQLQueue(QueueBase):
             result = session.exec(statement).all()
             return result
 
+    def sum_resources(self, queue_item_stage, resource_key="resources"):
+        """Sums the resources requested by the Items in some stage of the
+        Queue with a single aggregate query, without reading the Item bodies
+        into Python.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage object
+            The specific stage of the Queue (PROCESSING, FAIL, etc.).
+        resource_key: str (default="resources")
+            Key of the resource dictionary in the Item bodies.
+
+        Returns:
+        ------------
+        Returns a dictionary of resource name to the total requested by the
+        Items in the stage. Resources no Item requests are left out, and
+        values that are not numbers are ignored.
+        """
+        tablename = self.sql_queue.__tablename__
+        # Legacy rows hold the body as a JSON string, which `#>> '{}'`
+        # unwraps so it can be parsed again.
+        statement = text(
+            "SELECT resource.key, SUM(resource.value::numeric) "
+            f"FROM {tablename} AS q "
+            "CROSS JOIN LATERAL (SELECT (CASE WHEN q.json_native "
+            "THEN q.json_data ELSE (q.json_data #>> '{}')::jsonb END) "
+            "-> :resource_key AS resources) AS item "
+            "CROSS JOIN LATERAL jsonb_each(CASE WHEN "
+            "jsonb_typeof(item.resources) = 'object' "
+            "THEN item.resources END) AS resource "
+            "WHERE q.queue_name = :queue_name "
+            "AND q.queue_item_stage = :queue_item_stage "
+            "AND jsonb_typeof(resource.value) = 'number' "
+            "GROUP BY resource.key"
+        )
+        with Session(self.engine) as session:
+            rows = session.connection().execute(
+                statement,
+                {
+                    "resource_key": resource_key,
+                    "queue_name": self.queue_name,
+                    "queue_item_stage": queue_item_stage.value
+                }
+            ).all()
+
+        return {
+            key: int(total) if total == int(total) else float(total)
+            for key, total in rows
+        }
+
+    def lookup_state_page(self, queue_item_stage, page_size=1000, after=None):
+        """Lookup one page of the item ids in the current Queue stage, in
+        ascending order of item id.
+
+        Pages are read with keyset pagination: each page seeks past the
+        previous cursor in the `(queue_name, queue_item_stage, index_key)`
+        index, so later pages cost the same as the first.
+
+        Parameters:
+        -----------
+        queue_item_stage: QueueItemStage
+            stage of Queue Item
+        page_size: int (default=1000)
+            Maximum number of item ids to return.
+        after: str (default=None)
+            Cursor returned with the previous page. Only item ids greater than
+            it are returned. None starts from the first item id.
+
+        Returns:
+        ------------
+        Returns a tuple of the list of item ids in the page and the cursor for
+        the next page, which is None when there are no more pages.
+        """
+        if page_size < 1:
+            raise ValueError("page_size must be at least 1.")
+
+        # The "C" collation orders ids by code point, the same as Python.
+        index_key = self.sql_queue.index_key.collate("C")
+        with Session(self.engine) as session:
+            statement = (
+                select(self.sql_queue.index_key)
+                .where(
+                    (self.queue_name == self.sql_queue.queue_name) &
+                    (queue_item_stage.value == self.sql_queue.queue_item_stage)
+                )
+                .order_by(index_key)
+                .limit(page_size)
+            )
+            if after is not None:
+                statement = statement.where(index_key > after)
+
+            item_ids = list(session.exec(statement).all())
+
+        return item_ids, self._next_page_cursor(item_ids, page_size)
+
     def lookup_item(self, queue_item_id):
         """Lookup an Item currently in the Queue.
 
@@ -295,7 +1195,9 @@ class SQLQueue(QueueBase):
             results = session.exec(stmt)
 
             for queue_item in results:
-                item_body = json.loads(queue_item.json_data)
+                item_body = decode_json_data(
+                    queue_item.json_data, queue_item.json_native
+                )
 
         return {
             'item_id':queue_item_id,
@@ -324,46 +1226,44 @@ class SQLQueue(QueueBase):
         item_ids: [str]
             ID of Queue Item
         """
-        for item in self._requeue(item_ids):
-            update_stage(self.engine,
-                         self.queue_name,
-                         QueueItemStage.WAITING,
-                         item,
-                         self.sql_queue)
+        self.requeue_many(item_ids)
 
+    def requeue_many(self, item_ids):
+        """Move several queue items from FAILED to WAITING with a single
+        UPDATE statement.
 
-def update_stage(engine, queue_name, new_stage, item_key, sql_queue):
-    """Updates the stage of an Item.
-
-    Parameters:
-    -----------
-    engine: Engine
-    queue_name: str
-        Name of Queue.
-    new_stage: QueueItemStage.[STAGE]
-        New stage for the Item to get moved to.
-    item_key: str
-        Key of the Item to be staged.
-    """
-    with Session(engine) as session:
-        statement = select(sql_queue).where(
-            (sql_queue.index_key == item_key) & \
-                (sql_queue.queue_name == queue_name)
-        )
-        results = session.exec(statement)
+        Items that are not in the FAIL stage are skipped with a warning.
 
-        item = results.one()
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of Queue Items
+        """
+        if isinstance(item_ids, str):
+            item_ids = [item_ids]
 
-        item.queue_item_stage = new_stage.value
+        moved_ids = self._move_stage(
+            item_ids,
+            QueueItemStage.FAIL,
+            QueueItemStage.WAITING,
+            values={"attempts": 0, "not_before": None}
+        )
+        self._warn_not_failed(list(set(item_ids) - set(moved_ids)))
 
-        session.add(item)
-        session.commit()
 
+# Pylint does not like more than 5 parameters
+# pylint: disable=too-many-arguments
 def json_sql_queue(
     engine:Engine,
     queue_name,
     table_name="sqlqueue",
-    constraint_name="_queue_name_index_key_uc"
+    constraint_name="_queue_name_index_key_uc",
+    *,
+    cache_sizes=False,
+    partial_index=False,
+    notify=False,
+    retry_policy=None,
+    migrate=False
 ):
     """Creates and returns the SQL Queue.
     """
@@ -371,5 +1271,10 @@ def json_sql_queue(
         engine,
         queue_name,
         tablename=table_name,
-        constraint_name=constraint_name
+        constraint_name=constraint_name,
+        cache_sizes=cache_sizes,
+        partial_index=partial_index,
+        notify=notify,
+        retry_policy=retry_policy,
+        migrate=migrate
     )
@@ -0,0 +1,104 @@
+"""Module for creating the SQLAlchemy engines shared by the SQL queue and the
+SQL event store.
+"""
+import threading
+
+from sqlalchemy import create_engine, Engine
+
+from task_queue import logger
+
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+# pylint: disable=too-many-arguments
+def get_sql_engine(connection_string:str,
+                   pool_size:int=5,
+                   max_overflow:int=10,
+                   pool_pre_ping:bool=True,
+                   statement_timeout_ms:int=0) -> Engine:
+    """Returns the engine for a connection string and pool configuration,
+    creating it on first use. Later calls with the same arguments return the
+    same engine, so everything in a process shares one connection pool.
+
+    Parameters:
+    -----------
+    connection_string: str
+        SQLAlchemy connection string of the database.
+    pool_size: int (default=5)
+        Number of connections kept open in the pool.
+    max_overflow: int (default=10)
+        Number of connections that may be opened beyond `pool_size` when the
+        pool is exhausted. These are closed when returned to the pool.
+    pool_pre_ping: bool (default=True)
+        Test connections when they are taken from the pool, replacing any
+        that the server has closed.
+    statement_timeout_ms: int (default=0)
+        Postgres `statement_timeout` for every connection, in milliseconds.
+        0 means no timeout.
+
+    Returns:
+    -----------
+    Returns a sqlalchemy.Engine.
+    """
+    key = (
+        connection_string,
+        pool_size,
+        max_overflow,
+        pool_pre_ping,
+        statement_timeout_ms
+    )
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(key)
+        if engine is None:
+            connect_args = {}
+            if statement_timeout_ms > 0:
+                connect_args["options"] = \
+                    f"-c statement_timeout={statement_timeout_ms}"
+
+            engine = create_engine(
+                connection_string,
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_pre_ping=pool_pre_ping,
+                connect_args=connect_args
+            )
+            logger.info(
+                "Created SQL engine with pool_size=%d, max_overflow=%d",
+                pool_size,
+                max_overflow
+            )
+            _ENGINES[key] = engine
+    return engine
+
+def sql_engine_from_settings(connection_string:str, sql_settings) -> Engine:
+    """Returns the shared engine for a connection string, configured from
+    the pool settings in `TaskQueueSqlSettings`.
+
+    Parameters:
+    -----------
+    connection_string: str
+        SQLAlchemy connection string of the database.
+    sql_settings: TaskQueueSqlSettings
+        Settings holding the SQL_QUEUE_POOL_* and
+        SQL_QUEUE_STATEMENT_TIMEOUT_MS parameters.
+
+    Returns:
+    -----------
+    Returns a sqlalchemy.Engine.
+    """
+    return get_sql_engine(
+        connection_string,
+        pool_size=sql_settings.SQL_QUEUE_POOL_SIZE,
+        max_overflow=sql_settings.SQL_QUEUE_POOL_MAX_OVERFLOW,
+        pool_pre_ping=sql_settings.SQL_QUEUE_POOL_PRE_PING,
+        statement_timeout_ms=sql_settings.SQL_QUEUE_STATEMENT_TIMEOUT_MS
+    )
+
+def dispose_sql_engines():
+    """Closes the connections of every shared engine and forgets them.
+    """
+    with _ENGINES_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
@@ -0,0 +1,63 @@
+"""Module for waking the work queue service when there may be work to do,
+instead of waiting for its next periodic run.
+"""
+import threading
+import time
+
+from task_queue import logger
+
+
+class WakeupTrigger:
+    """Wakes a waiting loop early.
+
+    Event sources (queue notifications, finished processes, workflow
+    watches) call `notify` from any thread. The service loop calls `wait`
+    between runs, which returns as soon as a source has notified, or after
+    the timeout for the periodic sweep.
+    """
+
+    def __init__(self, debounce_sec=0.05):
+        """Initializes WakeupTrigger.
+
+        Parameters:
+        -----------
+        debounce_sec: float (default=0.05)
+            Time to wait after the first notification before returning from
+            `wait`, so a burst of notifications causes a single run. This
+            also bounds how often the loop can run.
+        """
+        self.debounce_sec = debounce_sec
+        self._event = threading.Event()
+
+    def notify(self, reason=None):
+        """Wakes the waiting loop.
+
+        Parameters:
+        -----------
+        reason: str (default=None)
+            Description of the event, for logging.
+        """
+        if reason is not None:
+            logger.debug("Wakeup: %s", reason)
+        self._event.set()
+
+    def wait(self, timeout):
+        """Waits until `notify` is called or the timeout expires.
+
+        Notifications received while the loop was running are not lost; the
+        next call returns immediately.
+
+        Parameters:
+        -----------
+        timeout: float
+            Maximum number of seconds to wait.
+
+        Returns:
+        -----------
+        Returns True if woken by a notification, False on timeout.
+        """
+        woken = self._event.wait(timeout)
+        if woken and self.debounce_sec > 0:
+            time.sleep(self.debounce_sec)
+        self._event.clear()
+        return woken
@@ -0,0 +1,301 @@
+"""Wherein is contained the ArgoWorkflowWatchMixin class, which follows the
+Argo Workflows event stream for the Argo Workflows Queue Worker.
+"""
+import json
+import threading
+import time
+
+import requests
+
+from task_queue import logger
+
+
+class ArgoWorkflowWatchMixin:
+    """Watches the workflow event stream of an `ArgoWorkflowsQueueWorker`,
+    to wake the work queue up when a workflow completes and to keep the
+    status cache of the incremental poll current.
+
+    The state it uses is initialized by `ArgoWorkflowsQueueWorker`.
+    """
+
+    # Seconds after which the server ends a watch, so a connection that
+    # silently died is noticed. The read timeout leaves it some slack.
+    WATCH_TIMEOUT_SEC = 60
+    WATCH_READ_TIMEOUT_SEC = WATCH_TIMEOUT_SEC + 30
+    # Seconds after which the incremental poll lists every workflow again,
+    # in case the event stream missed a change.
+    CACHE_RELIST_SEC = 600
+
+    def start_watch(self, wakeup_trigger, reconnect_sec=5):
+        """Watches the workflow event stream in a daemon thread, notifying
+        `wakeup_trigger` whenever a workflow of this worker completes.
+
+        Parameters:
+        -----------
+        wakeup_trigger: WakeupTrigger
+            Trigger notified when a workflow completes.
+        reconnect_sec: float (default=5)
+            Seconds to wait before reconnecting after the stream ends or
+            fails.
+        """
+        self._wakeup_trigger = wakeup_trigger
+        self._watch_reconnect_sec = reconnect_sec
+        if self._incremental_poll:
+            # The watch that updates the status cache notifies the trigger.
+            return
+
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop,
+            args=(wakeup_trigger, reconnect_sec,),
+            name=f"{self._worker_interface_id}-argo-watch",
+            daemon=True
+        )
+        self._watch_thread.start()
+
+    def stop_watch(self):
+        """Stops watching the workflow event stream. The thread exits once
+        the stream sends its next event or heartbeat. With the incremental
+        poll, every later poll lists all workflows instead.
+        """
+        self._watch_stop.set()
+
+    def _watch_loop(self, wakeup_trigger, reconnect_sec):
+        """Reads the workflow event stream until stopped, reconnecting when
+        it ends or fails.
+
+        Parameters:
+        -----------
+        wakeup_trigger: WakeupTrigger
+            Trigger notified when a workflow completes.
+        reconnect_sec: float
+            Seconds to wait before reconnecting.
+        """
+        params = self._construct_poll_query()
+        params["fields"] = "result.type,result.object.metadata.labels"
+        params["listOptions.timeoutSeconds"] = str(self.WATCH_TIMEOUT_SEC)
+        while not self._watch_stop.is_set():
+            try:
+                with self._session.get(
+                    self._argo_workflows_events_url,
+                    params=params,
+                    stream=True,
+                    timeout=(10, self.WATCH_READ_TIMEOUT_SEC)
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if self._watch_stop.is_set():
+                            return
+                        if line and self._is_completion_event(
+                            json.loads(line)
+                        ):
+                            wakeup_trigger.notify("workflow completed")
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning("Argo workflow watch failed: %s", e)
+            self._watch_stop.wait(reconnect_sec)
+
+    def _is_completion_event(self, event):
+        """Checks if a workflow event stream message reports that a workflow
+        has completed.
+
+        Parameters:
+        -----------
+        event: dict
+            A message from the workflow event stream.
+
+        Returns:
+        -----------
+        True if the message is a modification of a completed workflow.
+        """
+        result = event.get("result") or {}
+        if result.get("type") != "MODIFIED":
+            return False
+        labels = (result.get("object") or {}) \
+            .get("metadata", {}).get("labels") or {}
+        return labels.get("workflows.argoproj.io/completed") == "true"
+
+    def _list_workflows(self):
+        """Lists every workflow of this worker in pages of
+        `list_page_size`.
+
+        Returns:
+        -----------
+        Tuple of the list of workflows and the resourceVersion of the list.
+        """
+        params = self._construct_poll_query()
+        params["fields"] = \
+            "items.metadata,metadata.resourceVersion,metadata.continue"
+        params["listOptions.limit"] = str(self._list_page_size)
+
+        workflows = []
+        while True:
+            response = self._session.get(
+                self._argo_workflows_list_url,
+                params=params,
+                timeout=10
+            )
+            if response.status_code == 410 and \
+                "listOptions.continue" in params:
+                # The continue token expired, start again.
+                logger.info("Workflow list expired, listing again")
+                del params["listOptions.continue"]
+                workflows = []
+                continue
+            response.raise_for_status()
+
+            body = response.json()
+            workflows += body.get("items") or []
+            metadata = body.get("metadata") or {}
+            if not metadata.get("continue"):
+                return workflows, metadata.get("resourceVersion")
+            params["listOptions.continue"] = metadata["continue"]
+
+    def _relist_status_cache(self):
+        """Rebuilds the status cache from a full list of the workflows.
+        """
+        logger.debug("Listing workflows for the status cache")
+        workflows, resource_version = self._list_workflows()
+        cached_workflows = {}
+        for workflow in workflows:
+            cached_workflows[workflow['metadata']['name']] = \
+                self._workflow_cache_entry(workflow)
+
+        with self._cache_lock:
+            self._cached_workflows = cached_workflows
+            self._resource_version = resource_version
+            self._cache_listed_at = time.monotonic()
+
+    def _cache_workflow(self, workflow):
+        """Adds or updates a workflow of this worker in the status cache.
+
+        Parameters:
+        -----------
+        workflow: dict
+            A workflow with its metadata.
+        """
+        labels = self.get_labels(workflow) or {}
+        if self.WORK_QUEUE_ITEM_ID_LABEL not in labels:
+            return
+        entry = self._workflow_cache_entry(workflow)
+        with self._cache_lock:
+            self._cached_workflows[workflow['metadata']['name']] = entry
+
+    def _apply_watch_event(self, event):
+        """Applies a message of the workflow event stream to the status
+        cache.
+
+        Parameters:
+        -----------
+        event: dict
+            A message from the workflow event stream.
+
+        Returns:
+        -----------
+        False if the stream reported an error, such as an expired
+        resourceVersion, after which the cache must be relisted.
+        """
+        result = event.get("result") or {}
+        event_type = result.get("type")
+        if "error" in event or event_type == "ERROR":
+            logger.info("Workflow watch error: %s", event)
+            return False
+
+        workflow = result.get("object") or {}
+        metadata = workflow.get("metadata") or {}
+        name = metadata.get("name")
+        if event_type == "DELETED":
+            with self._cache_lock:
+                self._cached_workflows.pop(name, None)
+        elif event_type in ("ADDED", "MODIFIED") and name:
+            try:
+                self._cache_workflow(workflow)
+            except (KeyError, ValueError, TypeError) as e:
+                logger.warning("Skipping workflow event for %s: %s", name, e)
+
+        if metadata.get("resourceVersion"):
+            with self._cache_lock:
+                self._resource_version = metadata["resourceVersion"]
+
+        if self._wakeup_trigger is not None and \
+            self._is_completion_event(event):
+            self._wakeup_trigger.notify("workflow completed")
+        return True
+
+    def _cache_watch_loop(self):
+        """Updates the status cache from the workflow event stream, resuming
+        from the last resourceVersion seen when the server ends the stream,
+        until stopped or until the cache must be relisted. A failed stream
+        marks the cache stale, as events may have been missed.
+        """
+        params = self._construct_poll_query()
+        params["fields"] = "result.type,result.object.metadata"
+        params["listOptions.timeoutSeconds"] = str(self.WATCH_TIMEOUT_SEC)
+        while not self._watch_stop.is_set():
+            with self._cache_lock:
+                resource_version = self._resource_version
+            if resource_version is None:
+                return
+            params["listOptions.resourceVersion"] = resource_version
+
+            try:
+                with self._session.get(
+                    self._argo_workflows_events_url,
+                    params=params,
+                    stream=True,
+                    timeout=(10, self.WATCH_READ_TIMEOUT_SEC)
+                ) as response:
+                    if response.status_code == 410:
+                        self._invalidate_status_cache()
+                        return
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if self._watch_stop.is_set():
+                            return
+                        if line and \
+                            not self._apply_watch_event(json.loads(line)):
+                            self._invalidate_status_cache()
+                            return
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning("Argo workflow watch failed: %s", e)
+                self._invalidate_status_cache()
+                return
+            self._watch_stop.wait(self._watch_reconnect_sec)
+
+    def _invalidate_status_cache(self):
+        """Marks the status cache to be relisted by the next poll.
+        """
+        logger.info("Workflow status cache expired, relisting on next poll")
+        with self._cache_lock:
+            self._resource_version = None
+
+    def _poll_status_cache(self):
+        """Gets the status of each workflow of this worker from the status
+        cache, relisting first when needed and keeping the watch running.
+
+        Returns:
+        -----------
+        Returns Dict[Any, QueueItemStage]
+        """
+        with self._cache_lock:
+            must_relist = self._resource_version is None \
+                or time.monotonic() - self._cache_listed_at \
+                    > self.CACHE_RELIST_SEC
+        if must_relist or self._watch_stop.is_set():
+            self._relist_status_cache()
+
+        if not self._watch_stop.is_set() and (
+            self._cache_thread is None or not self._cache_thread.is_alive()
+        ):
+            self._cache_thread = threading.Thread(
+                target=self._cache_watch_loop,
+                name=f"{self._worker_interface_id}-argo-status-watch",
+                daemon=True
+            )
+            self._cache_thread.start()
+
+        with self._cache_lock:
+            entries = [
+                (name, *entry)
+                for name, entry in self._cached_workflows.items()
+            ]
+        return self._newest_statuses(entries)
@@ -1,16 +1,56 @@
 """Wherein is contained the class for the Argo Workflow Queue Worker.
 """
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 import datetime
+import threading
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from task_queue.workers.argo_workflow_watch import ArgoWorkflowWatchMixin
 from task_queue.workers.queue_worker_interface import QueueWorkerInterface
 from task_queue.queues.queue_base import QueueItemStage
 from task_queue import logger
 
 
-class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
+def new_argo_session(pool_size=10, max_retries=3, retry_backoff=0.5):
+    """Creates the HTTP session used to talk to the Argo Workflows server,
+    which keeps connections alive between requests and retries GET and
+    DELETE requests with exponential backoff.
+
+    Parameters:
+    -----------
+    pool_size: int (default=10)
+        Maximum number of connections kept open per host.
+    max_retries: int (default=3)
+        Number of retries for GET and DELETE requests.
+    retry_backoff: float (default=0.5)
+        Backoff factor in seconds between retries.
+
+    Returns:
+    -----------
+    Returns a requests.Session.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=retry_backoff,
+        status_forcelist=ArgoWorkflowsQueueWorker.RETRY_STATUS_CODES,
+        allowed_methods=frozenset(["GET", "DELETE"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# The connection, watch and status cache state is kept on the worker, which
+# the watch mixin shares.
+# pylint: disable=too-many-instance-attributes
+class ArgoWorkflowsQueueWorker(ArgoWorkflowWatchMixin, QueueWorkerInterface):
     """
     Pushes `queue_item_body.submit_body` directly to the argo workflows rest
     API.
@@ -49,13 +89,24 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
     PAYLOAD_FIELD = "submit_body"
     WORK_QUEUE_ID_LABEL = "work-queue.interface-id"
     WORK_QUEUE_ITEM_ID_LABEL = "work-queue.queue-item-id"
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+    # The session is shared by threads and the status cache is locked.
+    thread_safe = True
 
-
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
     def __init__(
         self,
         worker_interface_id,
         argo_workflows_endpoint,
-        namespace
+        namespace,
+        *,
+        pool_size=10,
+        max_retries=3,
+        retry_backoff=0.5,
+        incremental_poll=False,
+        list_page_size=500,
+        log_archiver=None
     ):
         """Initializes ArgoWorkflowQueueInterface
 
@@ -67,10 +118,57 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
             Argo Workflows endpoint
         namespace: str
             Kubernetes namespace for ArgoWorkflowQueueInterface.
+        pool_size: int (default=10)
+            Number of keep-alive connections to the Argo Workflows server
+            kept open for reuse.
+        max_retries: int (default=3)
+            Number of times GET and DELETE requests are retried after
+            connection errors or 429 and 5xx responses. Submissions are not
+            retried, so a workflow is never submitted twice.
+        retry_backoff: float (default=0.5)
+            Backoff factor in seconds between retries, doubled on every
+            retry. `Retry-After` headers are respected.
+        incremental_poll: bool (default=False)
+            Keep the status of the workflows in a local cache, listed once
+            in pages of `list_page_size` and then updated from the workflow
+            event stream starting at the list's `resourceVersion`. The list
+            is repeated every `CACHE_RELIST_SEC` seconds, and by the next
+            poll after the stream fails or reports the version as expired
+            (410 Gone). Otherwise every poll lists every workflow.
+        list_page_size: int (default=500)
+            Number of workflows requested per page when listing for the
+            incremental poll.
+        log_archiver: LogArchiver (default=None)
+            When given, `delete_job` hands the workflow to the archiver,
+            which streams its logs to the archiver's sink and then deletes
+            it in the background. Otherwise the logs are downloaded and
+            logged before the workflow is deleted.
         """
         self._worker_interface_id = worker_interface_id
         self._argo_workflows_endpoint = argo_workflows_endpoint
         self._namespace = namespace
+        self._session = new_argo_session(pool_size, max_retries, retry_backoff)
+        self._pool_size = pool_size
+        # Name of the newest workflow of each queue item, refreshed by every
+        # poll so finished jobs can be deleted without looking them up.
+        self._workflow_names = {}
+        self._watch_stop = threading.Event()
+        self._watch_thread = None
+        self._wakeup_trigger = None
+        self._watch_reconnect_sec = 5
+
+        self._log_archiver = log_archiver
+        self._incremental_poll = incremental_poll
+        self._list_page_size = list_page_size
+        # Workflow name -> (queue item id, creation time, status), the
+        # resourceVersion it is current to and the time.monotonic() of its
+        # last full list. A None version means it is stale and must be
+        # relisted.
+        self._cached_workflows = {}
+        self._resource_version = None
+        self._cache_listed_at = None
+        self._cache_lock = threading.Lock()
+        self._cache_thread = None
 
     def urlconcat(self, *components):
         """Concatenates URL components into one URL.
@@ -113,6 +211,19 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
             self._namespace
         )
 
+    @property
+    def _argo_workflows_events_url(self):
+        """Returns the URL to the argo workflows server that streams workflow
+        events.
+        """
+        return self.urlconcat(
+            self._argo_workflows_endpoint,
+            "api",
+            "v1",
+            "workflow-events",
+            self._namespace
+        )
+
     def _argo_workflows_delete_url(self, workflow_name):
         """Returns the URL to the argo workflows server to delete a workflow.
         """
@@ -189,11 +300,14 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         Returns the name of the argo workflow that corresponds to the given
         Queue Item ID.
         """
+        name = self._workflow_names.get(queue_item_id)
+        if name is not None:
+            return name
 
         item_id_label = f"{self.WORK_QUEUE_ITEM_ID_LABEL}={queue_item_id}"
 
         try:
-            res = requests.get(
+            res = self._session.get(
                 self._argo_workflows_list_url,
                 timeout=10,
                 params=self._construct_poll_query(
@@ -216,6 +330,7 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
                 wf_item_id = labels[self.WORK_QUEUE_ITEM_ID_LABEL]
                 if wf_item_id == queue_item_id:
                     name = item.get("metadata",{}).get("name","Unknown")
+                    self._workflow_names[queue_item_id] = name
                     return name
 
             return None
@@ -238,8 +353,10 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         """
         request_body = self._construct_submit_body(item_id, queue_item_body)
         request_url = self._argo_workflows_submit_url
+        # A rerun item gets a new workflow, found by the next poll.
+        self._workflow_names.pop(item_id, None)
 
-        response = requests.post(
+        response = self._session.post(
             request_url,
             json=request_body,
             timeout=10
@@ -253,6 +370,14 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
             logger.warning(request_body)
             raise e
 
+        if self._incremental_poll:
+            # Cache the new workflow now, so the next poll sees the job even
+            # if its watch event has not arrived yet.
+            try:
+                self._cache_workflow(response.json())
+            except (ValueError, KeyError, TypeError):
+                logger.debug("No workflow in submit response for %s", item_id)
+
     def delete_job(self, queue_item_id):
         """Sends a delete request to argo workflows to delete a specific
         workflow.
@@ -262,14 +387,74 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         queue_item_id: str
             Item ID of job in workflow
         """
-        logs = self.get_logs(queue_item_id)
-        for container, log in logs.items():
-            logger.info("Item: %s Container: %s: %s"
-                        , queue_item_id, container, pformat(log))
-
         name = self._get_workflow_name(queue_item_id)
+        if self._log_archiver is not None:
+            # The logs must be read before the workflow is deleted, so the
+            # archiver deletes it once they are saved.
+            if self._log_archiver.submit(
+                queue_item_id,
+                lambda: self._stream_logs(queue_item_id, name),
+                on_done=lambda: self._delete_workflow(queue_item_id, name)
+            ):
+                return
+            logger.warning("Log archive queue is full, deleting %s without "
+                           "saving its logs", queue_item_id)
+        else:
+            logs = self.get_logs(queue_item_id, workflow_name=name)
+            for container, log in logs.items():
+                logger.info("Item: %s Container: %s: %s"
+                            , queue_item_id, container, pformat(log))
+
+        self._delete_workflow(queue_item_id, name)
+
+    def delete_jobs(self, queue_item_ids):
+        """Deletes the workflows of several finished jobs, up to `pool_size`
+        at once over the pooled session. Every job is attempted; the first
+        error is raised afterwards.
+
+        The Argo Workflows API deletes one workflow per request, so the
+        requests are sent concurrently rather than by label selector.
+
+        Parameters:
+        -----------
+        queue_item_ids: [str]
+            Queue Item IDs
+        """
+        if len(queue_item_ids) <= 1 or self._log_archiver is not None:
+            # The archiver already deletes in the background.
+            super().delete_jobs(queue_item_ids)
+            return
+
+        with ThreadPoolExecutor(
+            max_workers=min(self._pool_size, len(queue_item_ids))
+        ) as pool:
+            futures = [
+                (queue_item_id, pool.submit(self.delete_job, queue_item_id))
+                for queue_item_id in queue_item_ids
+            ]
+
+        errors = []
+        for queue_item_id, future in futures:
+            error = future.exception()
+            if error is not None:
+                logger.error("Couldn't delete job %s: %s",
+                             queue_item_id, error)
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+    def _delete_workflow(self, queue_item_id, name):
+        """Sends a delete request for a workflow.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            Item ID of job in workflow
+        name: str
+            Name of the workflow
+        """
         delete_url = self._argo_workflows_delete_url(name)
-        response = requests.delete(delete_url, timeout = 10)
+        response = self._session.delete(delete_url, timeout = 10)
         try:
             logger.info("Deleting workflow %s", name)
             response.raise_for_status()
@@ -277,27 +462,31 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
             logger.error("Couldn't delete workflow %s", name)
             raise e
 
+        self._workflow_names.pop(queue_item_id, None)
         logger.debug("Deleted workflow %s", name)
 
-    def get_logs(self, queue_item_id):
+    def get_logs(self, queue_item_id, workflow_name=None):
         """Retrieves the logs of a specific argo workflow.
 
         Parameters:
         -----------
         queue_item_id: str
             Queue Item ID of the job we are looking for
+        workflow_name: str (default=None)
+            Name of the workflow of the job, looked up when not given.
 
         Returns:
         ---------
         Dictionary where the key is the container where the log came
         from and the value is the logs stored in that container.
         """
-        workflow_name = self._get_workflow_name(queue_item_id)
+        if workflow_name is None:
+            workflow_name = self._get_workflow_name(queue_item_id)
         log_types = ["main","wait","init"]
         logs = {}
         for container in log_types:
             log_url = self._argo_workflows_logs_url(workflow_name,container)
-            response = requests.get(log_url, timeout=10)
+            response = self._session.get(log_url, timeout=10)
             try:
                 response.raise_for_status()
                 logs[container] = response.text
@@ -308,6 +497,41 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
                                     f"logs for {queue_item_id}"
         return logs
 
+    def _stream_logs(self, queue_item_id, workflow_name, chunk_size=65536):
+        """Streams the logs of a specific argo workflow without holding them
+        in memory.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            Queue Item ID of the job
+        workflow_name: str
+            Name of the workflow of the job
+        chunk_size: int (default=65536)
+            Size in bytes of the chunks read from the server.
+
+        Returns:
+        -----------
+        Yields (container, chunks of the log) for each container. Each
+        container's chunks must be read before moving to the next one.
+        """
+        for container in ["main","wait","init"]:
+            log_url = self._argo_workflows_logs_url(workflow_name,container)
+            with self._session.get(
+                log_url, stream=True, timeout=10
+            ) as response:
+                try:
+                    response.raise_for_status()
+                except requests.HTTPError:
+                    logger.warning("Couldn't find %s logs for %s",
+                                   container, queue_item_id)
+                    yield container, [
+                        f"Couldn't find {container} logs for "
+                        f"{queue_item_id}".encode()
+                    ]
+                    continue
+                yield container, response.iter_content(chunk_size)
+
     def _construct_poll_query(self, additional_label_queries=None):
         """Creates a dictionary used to ping Argo for information regarding all
         jobs relevant to worker_interface_id.
@@ -442,7 +666,9 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
 
     def _get_response_ids_and_status(self, response_body):
         """"Converts the response body of the argo workflows server list
-        endpoint into a dictionary of { item_id : queue_item_status }.
+        endpoint into a dictionary of { item_id : queue_item_status }. Also
+        replaces the cached workflow name of each item with the name of its
+        newest workflow.
 
         Parameters:
         -----------
@@ -465,16 +691,59 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         # handle this case by only taking the most recent one.
 
         logger.debug("Filtering results")
+        return self._newest_statuses(
+            (workflow['metadata'].get('name'),
+             *self._workflow_cache_entry(workflow))
+            for workflow in workflows
+        )
+
+    def _workflow_cache_entry(self, workflow):
+        """Reads the fields the status poll needs from a workflow.
+
+        Parameters:
+        -----------
+        workflow: dict
+            A workflow with its metadata.
+
+        Returns:
+        -----------
+        Tuple of (queue item id, creation time, QueueItemStage).
+        """
+        return (
+            self.get_workflow_queue_item_id(workflow),
+            self.get_workflow_create_time(workflow),
+            self.get_workflow_status(workflow)
+        )
+
+    def _newest_statuses(self, entries):
+        """Finds the status of the newest workflow of each queue item, and
+        replaces the cached workflow names with the names of those
+        workflows.
+
+        Parameters:
+        -----------
+        entries: Iterable[Tuple[str, str, datetime, QueueItemStage]]
+            (workflow name, queue item id, creation time, status) of every
+            workflow.
+
+        Returns:
+        -----------
+        Dictionary of the workflow status of each item
+        """
         results = {}
         completed_times = {}
+        names = {}
 
-        for workflow in workflows:
-            timestamp = self.get_workflow_create_time(workflow)
-            item_id = self.get_workflow_queue_item_id(workflow)
+        for name, item_id, timestamp, status in entries:
             if (item_id not in results) or \
                 (timestamp > completed_times[item_id]):
-                results[item_id] = self.get_workflow_status(workflow)
+                results[item_id] = status
                 completed_times[item_id] = timestamp
+                names[item_id] = name
+
+        self._workflow_names = {
+            item_id: name for item_id, name in names.items() if name
+        }
 
         return results
 
@@ -487,11 +756,14 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         -----------
         Returns Dict[Any, QueueItemStage]
         """
+        if self._incremental_poll:
+            return self._poll_status_cache()
+
         logger.debug("Getting status from Argo Workflows")
         request_url = self._argo_workflows_list_url
         request_params = self._construct_poll_query()
 
-        response = requests.get(
+        response = self._session.get(
             request_url,
             params=request_params,
             timeout=10
@@ -502,3 +774,11 @@ class ArgoWorkflowsQueueWorker(QueueWorkerInterface):
         response.raise_for_status()
 
         return self._get_response_ids_and_status(response.json())
+
+    def close(self):
+        """Stops watching the workflow event stream and waits for the log
+        archiver to save the logs it was given.
+        """
+        self.stop_watch()
+        if self._log_archiver is not None:
+            self._log_archiver.close()
@@ -0,0 +1,211 @@
+"""Wherein is contained the Abstract Class for AsyncQueueWorkerInterface.
+"""
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+
+
+class AsyncQueueWorkerInterface(ABC):
+    """Abstract Queue Worker Interface Class with coroutine methods, used by
+    the AsyncWorkQueue, and through it by the WorkQueue.
+    """
+
+    @abstractmethod
+    async def send_job(self, item_id, queue_item_body):
+        """Starts a job from queue item.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: dict
+            Body of the Queue Item, in the format of the worker interface.
+        """
+
+    @abstractmethod
+    async def delete_job(self, queue_item_id):
+        """Clears up any remaining resources of a finished job.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            Queue Item ID
+        """
+
+    async def delete_jobs(self, queue_item_ids):
+        """Deletes several finished jobs. Deletes one job at a time unless
+        the worker interface has a faster way.
+
+        Parameters:
+        -----------
+        queue_item_ids: [str]
+            Queue Item IDs
+        """
+        for queue_item_id in queue_item_ids:
+            await self.delete_job(queue_item_id)
+
+    @abstractmethod
+    async def poll_all_status(self):
+        """Poll status of all jobs sent by the worker interface.
+
+        Returns:
+        -----------
+        Returns Dict[Any, QueueItemStage]
+        """
+
+
+class ThreadedAsyncWorkerInterface(AsyncQueueWorkerInterface):
+    """Runs the methods of a QueueWorkerInterface in threads, so blocking
+    calls like HTTP requests can run concurrently from asyncio.
+
+    Calls to an interface that is not `thread_safe` are made one at a time.
+    """
+
+    def __init__(self, interface):
+        """Initializes ThreadedAsyncWorkerInterface.
+
+        Parameters:
+        -----------
+        interface: QueueWorkerInterface
+            Worker interface to wrap.
+        """
+        self.interface = interface
+        self._lock = None
+        if not getattr(interface, "thread_safe", False):
+            self._lock = threading.Lock()
+
+    def _call(self, method, *args):
+        """Calls a method of the wrapped interface, holding the lock if the
+        interface is not thread-safe.
+        """
+        if self._lock is None:
+            return method(*args)
+        with self._lock:
+            return method(*args)
+
+    async def send_job(self, item_id, queue_item_body):
+        """Starts a job from queue item in a thread.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: dict
+            Body of the Queue Item, in the format of the worker interface.
+        """
+        await asyncio.to_thread(
+            self._call, self.interface.send_job, item_id, queue_item_body
+        )
+
+    async def delete_job(self, queue_item_id):
+        """Clears up any remaining resources of a finished job in a thread.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            Queue Item ID
+        """
+        await asyncio.to_thread(
+            self._call, self.interface.delete_job, queue_item_id
+        )
+
+    async def delete_jobs(self, queue_item_ids):
+        """Deletes several finished jobs with the wrapped interface's
+        `delete_jobs`, in a thread.
+
+        Parameters:
+        -----------
+        queue_item_ids: [str]
+            Queue Item IDs
+        """
+        await asyncio.to_thread(
+            self._call, self.interface.delete_jobs, queue_item_ids
+        )
+
+    async def poll_all_status(self):
+        """Poll status of all jobs sent by the worker interface in a thread.
+
+        Returns:
+        -----------
+        Returns Dict[Any, QueueItemStage]
+        """
+        return await asyncio.to_thread(
+            self._call, self.interface.poll_all_status
+        )
+
+
+class DirectAsyncWorkerInterface(AsyncQueueWorkerInterface):
+    """Calls the methods of a QueueWorkerInterface directly from its
+    coroutines, which therefore never suspend. Used by WorkQueue to run
+    AsyncWorkQueue coroutines in the calling thread, without an event loop.
+    """
+
+    def __init__(self, interface):
+        """Initializes DirectAsyncWorkerInterface.
+
+        Parameters:
+        -----------
+        interface: QueueWorkerInterface
+            Worker interface to wrap.
+        """
+        self.interface = interface
+
+    async def send_job(self, item_id, queue_item_body):
+        """Starts a job from queue item.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: dict
+            Body of the Queue Item, in the format of the worker interface.
+        """
+        self.interface.send_job(item_id, queue_item_body)
+
+    async def delete_job(self, queue_item_id):
+        """Clears up any remaining resources of a finished job.
+
+        Parameters:
+        -----------
+        queue_item_id: str
+            Queue Item ID
+        """
+        self.interface.delete_job(queue_item_id)
+
+    async def delete_jobs(self, queue_item_ids):
+        """Deletes several finished jobs with the wrapped interface's
+        `delete_jobs`.
+
+        Parameters:
+        -----------
+        queue_item_ids: [str]
+            Queue Item IDs
+        """
+        self.interface.delete_jobs(queue_item_ids)
+
+    async def poll_all_status(self):
+        """Poll status of all jobs sent by the worker interface.
+
+        Returns:
+        -----------
+        Returns Dict[Any, QueueItemStage]
+        """
+        return self.interface.poll_all_status()
+
+
+def as_async_worker_interface(interface):
+    """Returns the interface as an AsyncQueueWorkerInterface, wrapping
+    synchronous interfaces in a ThreadedAsyncWorkerInterface.
+
+    Parameters:
+    -----------
+    interface: QueueWorkerInterface or AsyncQueueWorkerInterface
+        Worker interface.
+
+    Returns:
+    -----------
+    Returns an AsyncQueueWorkerInterface.
+    """
+    if isinstance(interface, AsyncQueueWorkerInterface):
+        return interface
+    return ThreadedAsyncWorkerInterface(interface)
@@ -0,0 +1,454 @@
+"""Wherein is contained the AsyncWorkQueue class.
+"""
+import asyncio
+import heapq
+import time
+
+from task_queue.queues.queue_base import QueueItemStage, QueueBase
+from task_queue.workers.async_queue_worker_interface import (
+    as_async_worker_interface
+)
+from task_queue import logger
+
+
+async def send_jobs_concurrently(interface, items, max_concurrency):
+    """Sends jobs to an async worker interface, with at most
+    `max_concurrency` submissions in flight at once.
+
+    Parameters:
+    -----------
+    interface: AsyncQueueWorkerInterface
+        Worker interface to send the jobs to.
+    items: List[Tuple[str, Any]]
+        (queue_item_id, queue_item_body) of the jobs to send.
+    max_concurrency: int
+        Maximum number of concurrent submissions.
+
+    Returns:
+    -----------
+    Returns a list with, for each item in order, None if it was sent or the
+    exception raised while sending it.
+    """
+    # Pylint disabled because the exception is returned so the caller can
+    # fail the item
+    # pylint: disable=broad-exception-caught
+    async def send(queue_item_id, queue_item_body):
+        try:
+            await interface.send_job(queue_item_id, queue_item_body)
+            return None
+        except Exception as e:
+            return e
+
+    if max_concurrency == 1:
+        # Sending one job at a time needs no event loop when the interface's
+        # coroutines never suspend, as with WorkQueue.
+        return [
+            await send(queue_item_id, queue_item_body)
+            for queue_item_id, queue_item_body in items
+        ]
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def send_bounded(queue_item_id, queue_item_body):
+        async with semaphore:
+            return await send(queue_item_id, queue_item_body)
+
+    return await asyncio.gather(*(
+        send_bounded(queue_item_id, queue_item_body)
+        for queue_item_id, queue_item_body in items
+    ))
+
+
+# Each option, and each part of the deadline and callback bookkeeping, is
+# its own attribute.
+# pylint: disable=too-many-instance-attributes
+class AsyncWorkQueue():
+    """Work Queue that submits jobs concurrently with asyncio.
+
+    Calls to the queue, which is synchronous, run in threads so they do not
+    block the event loop. `WorkQueue` runs these coroutines for synchronous
+    callers.
+    """
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
+    def __init__(self, queue:QueueBase, interface, *, max_concurrency=10,
+                 default_timeout_sec=None, timeout_key="timeout_sec",
+                 lease_owner=None, lease_sec=None, clock=time.monotonic):
+        """Initializes Async Work Queue.
+
+        Parameters:
+        -----------
+        queue: QueueBase
+        interface: AsyncQueueWorkerInterface or QueueWorkerInterface
+            Synchronous interfaces are run in threads.
+        max_concurrency: int (default=10)
+            Maximum number of jobs sent at once.
+        default_timeout_sec: float (default=None)
+            Seconds a job may stay PROCESSING before it is deleted from the
+            worker interface and moved to FAIL, for items that do not set
+            their own. None means no timeout. Deadlines are kept in memory:
+            the jobs still running in the worker interface when this work
+            queue starts get theirs on the first `update_job_status`,
+            counted from then.
+        timeout_key: str (default="timeout_sec")
+            Key of the item body holding the item's own timeout in seconds.
+        lease_owner: str (default=None)
+            Name this work queue leases items under. Must differ between
+            work queues sharing a queue.
+        lease_sec: float (default=None)
+            Lease taken on the items of `push_next_jobs` and `push_jobs`,
+            renewed by every `update_job_status` while they are PROCESSING.
+            If this work queue stops renewing, for example because it died
+            before sending them, the queue's lease sweeper returns them to
+            WAITING. Must be longer than the time between two calls to
+            `update_job_status`. None means items are not leased.
+        clock: Callable[[], float] (default=time.monotonic)
+            Returns the current time in seconds, for job deadlines.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if lease_sec is not None and lease_owner is None:
+            raise ValueError("lease_owner is required with lease_sec")
+        self._queue = queue
+        self._interface = as_async_worker_interface(interface)
+        self._max_concurrency = max_concurrency
+        self._default_timeout_sec = default_timeout_sec
+        self._timeout_key = timeout_key
+        self._lease_owner = lease_owner
+        self._lease_sec = lease_sec
+        self._clock = clock
+        # Heap of (deadline, queue_item_id) of the jobs sent, and the current
+        # deadline of each job. Heap entries of jobs that finished or were
+        # sent again no longer match and are skipped when popped.
+        self._deadline_heap = []
+        self._deadlines = {}
+        self._deadlines_seeded = False
+        self._jobs_started_callbacks = []
+        self._jobs_finished_callbacks = []
+
+    @property
+    def queue(self):
+        """The queue object managed by this work queue.
+        """
+        return self._queue
+
+    async def _call_queue(self, method, *args, **kwargs):
+        """Calls a method of the queue, which is synchronous, in a thread.
+        """
+        return await asyncio.to_thread(method, *args, **kwargs)
+
+    def add_jobs_started_callback(self, callback):
+        """Registers a function called with the jobs this work queue sends to
+        the worker interface.
+
+        Parameters:
+        -----------
+        callback: Callable[[List[Tuple[str, Any]]], None]
+            Called with the list of (queue_item_id, queue_item_body) of the
+            jobs that were sent.
+        """
+        self._jobs_started_callbacks.append(callback)
+
+    def add_jobs_finished_callback(self, callback):
+        """Registers a function called with the jobs this work queue moves out
+        of PROCESSING, whether they succeeded or failed.
+
+        Parameters:
+        -----------
+        callback: Callable[[List[str]], None]
+            Called with the list of queue item ids that finished.
+        """
+        self._jobs_finished_callbacks.append(callback)
+
+    async def get_queue_size(self, queue_item_stage):
+        """Gets the queue size for the given QueueItemStage stage.
+
+        Parameters:
+        -----------
+        queue_item_stage: enum
+               The requested enum from QueueItemStage
+
+        Returns:
+        -----------
+        The queue size from WorkQueue for the given stage.
+        """
+        return await self._call_queue(self._queue.size, queue_item_stage)
+
+    async def push_next_jobs(self, n_jobs=None):
+        """Sends jobs from Queue.
+
+        Parameters:
+        -----------
+        n_jobs: int (default=None)
+            Number of jobs to send.
+
+        Returns:
+        -----------
+        Returns the jobs selected from Queue.
+        """
+        if n_jobs is None:
+            n_jobs = 1
+
+        if self._lease_sec is None:
+            next_items = await self._call_queue(self._queue.get, n_jobs)
+        else:
+            next_items = await self._call_queue(
+                self._queue.get,
+                n_jobs,
+                lease_owner=self._lease_owner,
+                lease_sec=self._lease_sec
+            )
+        await self._send_jobs(next_items)
+
+        return next_items
+
+    async def push_jobs(self, item_ids):
+        """Sends the given WAITING jobs from Queue, wherever they are in the
+        Queue. Items that are no longer WAITING are skipped.
+
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of the jobs to send.
+
+        Returns:
+        -----------
+        Returns the jobs selected from Queue.
+        """
+        if self._lease_sec is None:
+            items = await self._call_queue(self._queue.get_items, item_ids)
+        else:
+            items = await self._call_queue(
+                self._queue.get_items,
+                item_ids,
+                lease_owner=self._lease_owner,
+                lease_sec=self._lease_sec
+            )
+        await self._send_jobs(items)
+
+        return items
+
+    async def _send_jobs(self, next_items):
+        """Sends jobs that were moved to PROCESSING to the worker interface
+        concurrently, failing the ones that cannot be submitted.
+
+        Parameters:
+        -----------
+        next_items: List[Tuple[str, Any]]
+            (queue_item_id, queue_item_body) of the jobs to send.
+        """
+        errors = await send_jobs_concurrently(
+            self._interface, next_items, self._max_concurrency
+        )
+
+        started_items = []
+        for (queue_item_id, queue_item_body), error in zip(next_items, errors):
+            if error is None:
+                started_items.append((queue_item_id, queue_item_body))
+            else:
+                # Error in submission -> fail
+                logger.warning("Item %s failed on submission", queue_item_id)
+                logger.warning("Moving %s to failed", queue_item_id)
+                await self._call_queue(self._queue.fail, queue_item_id)
+
+        if started_items:
+            self._set_deadlines(started_items)
+            for callback in self._jobs_started_callbacks:
+                callback(started_items)
+
+    def _set_deadlines(self, started_items):
+        """Records the deadlines of jobs that were sent.
+
+        Parameters:
+        -----------
+        started_items: List[Tuple[str, Any]]
+            (queue_item_id, queue_item_body) of the jobs sent.
+        """
+        now = self._clock()
+        for queue_item_id, queue_item_body in started_items:
+            timeout_sec = self._default_timeout_sec
+            if isinstance(queue_item_body, dict) \
+                and queue_item_body.get(self._timeout_key) is not None:
+                timeout_sec = queue_item_body[self._timeout_key]
+            if timeout_sec is None:
+                self._deadlines.pop(queue_item_id, None)
+                continue
+            deadline = now + float(timeout_sec)
+            self._deadlines[queue_item_id] = deadline
+            heapq.heappush(self._deadline_heap, (deadline, queue_item_id))
+
+    async def _seed_deadlines(self, processing_items, statuses):
+        """Records the deadlines of the jobs that were already running in the
+        worker interface when this work queue started, counted from now.
+
+        Parameters:
+        -----------
+        processing_items: [str]
+            IDs of the PROCESSING items.
+        statuses: Dict[str, QueueItemStage]
+            Statuses returned by the worker interface.
+        """
+        self._deadlines_seeded = True
+        running_ids = [
+            queue_item_id for queue_item_id in processing_items
+            if statuses.get(queue_item_id) == QueueItemStage.PROCESSING
+            and queue_item_id not in self._deadlines
+        ]
+        running_items = []
+        for queue_item_id in running_ids:
+            try:
+                item = await self._call_queue(
+                    self._queue.lookup_item, queue_item_id
+                )
+            except KeyError:
+                continue
+            running_items.append((queue_item_id, item["item_body"]))
+        self._set_deadlines(running_items)
+
+    def _pop_timed_out_jobs(self):
+        """Removes the jobs whose deadline has passed from the deadline heap.
+
+        Returns:
+        -----------
+        Returns the set of queue item ids that timed out.
+        """
+        now = self._clock()
+        timed_out_ids = set()
+        while self._deadline_heap and self._deadline_heap[0][0] <= now:
+            deadline, queue_item_id = heapq.heappop(self._deadline_heap)
+            if self._deadlines.get(queue_item_id) == deadline:
+                del self._deadlines[queue_item_id]
+                timed_out_ids.add(queue_item_id)
+        return timed_out_ids
+
+    async def update_job_status(self):
+        """Updates job statuses in Queue.
+
+        Returns:
+        -----------
+        Returns dictionary of all statuses as Dict[Any, QueueItemStage]
+        """
+        statuses = await self._interface.poll_all_status()
+
+        logger.info("Processing new statuses from worker interface")
+
+        processing_items = await self._call_queue(
+            self._queue.lookup_state, QueueItemStage.PROCESSING
+        )
+        if not self._deadlines_seeded:
+            await self._seed_deadlines(processing_items, statuses)
+        succeeded_ids, failed_ids, missing_ids = self._sort_finished_jobs(
+            processing_items, statuses, self._pop_timed_out_jobs()
+        )
+        await self._finish_jobs(succeeded_ids, failed_ids, missing_ids)
+
+        finished_ids = succeeded_ids + failed_ids + missing_ids
+        if self._lease_sec is not None:
+            await self._renew_leases(processing_items, finished_ids)
+        for queue_item_id in finished_ids:
+            self._deadlines.pop(queue_item_id, None)
+        if finished_ids:
+            for callback in self._jobs_finished_callbacks:
+                callback(finished_ids)
+
+        return statuses
+
+    def _sort_finished_jobs(self, processing_items, statuses, timed_out_ids):
+        """Sorts the PROCESSING items that finished by how they finished.
+
+        Parameters:
+        -----------
+        processing_items: List[str]
+            IDs of the items in PROCESSING.
+        statuses: Dict[Any, QueueItemStage]
+            Statuses polled from the worker interface.
+        timed_out_ids: Set[str]
+            IDs of the jobs past their deadline.
+
+        Returns:
+        -----------
+        Returns the lists of succeeded, failed and missing item IDs. Jobs
+        that timed out are failed.
+        """
+        succeeded_ids = []
+        failed_ids = []
+        missing_ids = []
+
+        # update all items in processing
+        for queue_item_id in processing_items:
+            # default to None if the item id is not in the list of statuses
+            # returned by the queue worker. This prevents jobs that were
+            # deleted externally from getting stuck in `PROCESSING` eternally.
+            status = statuses.get(queue_item_id, None)
+
+            if status is None:
+                # no need to delete here, because this case is only reached
+                # when the item has already been deleted.
+                missing_ids.append(queue_item_id)
+            elif status == QueueItemStage.SUCCESS:
+                succeeded_ids.append(queue_item_id)
+            elif status == QueueItemStage.FAIL:
+                failed_ids.append(queue_item_id)
+            elif queue_item_id in timed_out_ids:
+                # The job is deleted with the failed ones, which stops it.
+                logger.warning("Item %s timed out, moving it to failed",
+                               queue_item_id)
+                failed_ids.append(queue_item_id)
+        return succeeded_ids, failed_ids, missing_ids
+
+    # Pylint disabled because a failed delete is logged and must not stop the
+    # update
+    # pylint: disable=broad-exception-caught
+    async def _finish_jobs(self, succeeded_ids, failed_ids, missing_ids):
+        """Moves the finished items to SUCCESS or FAIL and deletes their jobs
+        from the worker interface.
+
+        Parameters:
+        -----------
+        succeeded_ids: List[str]
+            IDs of the items whose job succeeded.
+        failed_ids: List[str]
+            IDs of the items whose job failed or timed out.
+        missing_ids: List[str]
+            IDs of the items whose job is gone from the worker interface.
+        """
+        # Move the finished items in bulk so backends that support it only
+        # need one round-trip per stage.
+        if succeeded_ids:
+            await self._call_queue(self._queue.success_many, succeeded_ids)
+        if failed_ids or missing_ids:
+            await self._call_queue(
+                self._queue.fail_many, failed_ids + missing_ids
+            )
+
+        if succeeded_ids or failed_ids:
+            # The items have already moved, so a failed delete must not skip
+            # the lease and callback bookkeeping. The jobs are left in the
+            # worker interface.
+            try:
+                await self._interface.delete_jobs(succeeded_ids + failed_ids)
+            except Exception as e:
+                logger.error("Couldn't delete finished jobs: %s", e)
+
+    async def _renew_leases(self, processing_items, finished_ids):
+        """Extends the lease of the PROCESSING items that are still running.
+
+        Parameters:
+        -----------
+        processing_items: List[str]
+            IDs of the items in PROCESSING.
+        finished_ids: List[str]
+            IDs of the items that just left PROCESSING.
+        """
+        finished_set = set(finished_ids)
+        running_ids = [
+            queue_item_id for queue_item_id in processing_items
+            if queue_item_id not in finished_set
+        ]
+        if running_ids:
+            await self._call_queue(
+                self._queue.extend_lease,
+                running_ids,
+                self._lease_owner,
+                self._lease_sec
+            )
@@ -0,0 +1,122 @@
+"""Wherein is contained the ChildExitWatcher class, which notices child
+processes exiting without a thread per child.
+"""
+import os
+import select
+import threading
+
+from task_queue import logger
+
+
+# The wake pipe is two attributes, one per end.
+# pylint: disable=too-many-instance-attributes
+class ChildExitWatcher:
+    """Notifies a wakeup trigger when watched child processes exit.
+
+    On Linux every child is watched from a single thread through a pidfd,
+    which becomes readable when the process exits. Elsewhere each child is
+    waited on by its own thread. The watcher never reaps the children, that
+    is left to `Popen.poll`.
+    """
+
+    def __init__(self, wakeup_trigger):
+        """Initializes ChildExitWatcher.
+
+        Parameters:
+        -----------
+        wakeup_trigger: WakeupTrigger
+            Trigger notified when a watched child exits.
+        """
+        self.wakeup_trigger = wakeup_trigger
+        self._use_pidfd = hasattr(os, "pidfd_open")
+        self._lock = threading.Lock()
+        self._pending = []
+        self._closing = threading.Event()
+        self._thread = None
+        if self._use_pidfd:
+            self._wake_read, self._wake_write = os.pipe()
+            self._thread = threading.Thread(
+                target=self._watch_loop,
+                name="child-exit-watcher",
+                daemon=True
+            )
+            self._thread.start()
+
+    def watch(self, item_id, process):
+        """Starts watching a child process.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job, for logging.
+        process: subprocess.Popen
+            The child process.
+        """
+        if not self._use_pidfd:
+            threading.Thread(
+                target=self._wait_for,
+                args=(item_id, process,),
+                daemon=True
+            ).start()
+            return
+
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except ProcessLookupError:
+            # Already exited and reaped.
+            self.wakeup_trigger.notify(f"process for {item_id} exited")
+            return
+        with self._lock:
+            if self._closing.is_set():
+                os.close(pidfd)
+                raise RuntimeError("ChildExitWatcher is closed")
+            self._pending.append((pidfd, item_id))
+            os.write(self._wake_write, b"\0")
+
+    def close(self):
+        """Stops the watcher thread and closes its pipe and pidfds. The
+        children are not notified about afterwards.
+        """
+        if self._thread is None:
+            return
+        with self._lock:
+            self._closing.set()
+            os.write(self._wake_write, b"\0")
+        self._thread.join()
+        self._thread = None
+        os.close(self._wake_write)
+
+    def _wait_for(self, item_id, process):
+        """Waits for one child to exit, then notifies the trigger.
+        """
+        process.wait()
+        self.wakeup_trigger.notify(f"process for {item_id} exited")
+
+    def _watch_loop(self):
+        """Waits on the pidfds of every watched child, notifying the trigger
+        when any exits.
+        """
+        poller = select.poll()
+        poller.register(self._wake_read, select.POLLIN)
+        watched = {}
+        while True:
+            for fd, _ in poller.poll():
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                    with self._lock:
+                        pending, self._pending = self._pending, []
+                    for pidfd, item_id in pending:
+                        watched[pidfd] = item_id
+                        poller.register(pidfd, select.POLLIN)
+                    if self._closing.is_set():
+                        for pidfd in watched:
+                            os.close(pidfd)
+                        os.close(self._wake_read)
+                        return
+                    continue
+
+                item_id = watched.pop(fd)
+                poller.unregister(fd)
+                os.close(fd)
+                logger.debug("Process for %s exited", item_id)
+                self.wakeup_trigger.notify(f"process for {item_id} exited")
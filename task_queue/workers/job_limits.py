@@ -0,0 +1,204 @@
+"""Wherein are contained the helpers ProcessQueueWorker uses to enforce the
+declared resources of its jobs: pinning jobs to disjoint sets of cores and
+limiting their memory, through cgroup v2 when available.
+"""
+from dataclasses import dataclass
+import math
+import os
+import resource
+import threading
+from typing import Optional
+
+from task_queue import logger
+
+
+# Keys of a queue item's `resources` read by ProcessQueueWorker.
+CPU_RESOURCE = "cpu"
+MEMORY_RESOURCE = "memory_mb"
+
+CGROUP_CPU_PERIOD_USEC = 100000
+
+
+@dataclass
+class JobLimits:
+    """Limits applied to the process of one job.
+
+    cores: Cores the job is pinned to, or None to leave it unpinned.
+    memory_bytes: Address space limit, applied with setrlimit when the job
+        has no cgroup.
+    cgroup_path: cgroup v2 directory the job joins, or None.
+    """
+    cores: Optional[frozenset] = None
+    memory_bytes: Optional[int] = None
+    cgroup_path: Optional[str] = None
+
+
+def apply_job_limits(limits):
+    """Applies job limits to the current process. Runs in the job's process
+    before the script starts, so the script and its children inherit them.
+
+    Parameters:
+    -----------
+    limits: JobLimits
+        Limits of the job.
+    """
+    if limits.cgroup_path is not None:
+        with open(os.path.join(limits.cgroup_path, "cgroup.procs"), "w",
+                  encoding="utf-8") as procs:
+            procs.write(str(os.getpid()))
+    elif limits.memory_bytes is not None:
+        resource.setrlimit(
+            resource.RLIMIT_AS, (limits.memory_bytes, limits.memory_bytes)
+        )
+    if limits.cores is not None:
+        os.sched_setaffinity(0, limits.cores)
+
+
+def cgroup_v2_available(cgroup_root):
+    """Checks that a directory is a cgroup v2 group this process may create
+    job groups in.
+
+    Parameters:
+    -----------
+    cgroup_root: str
+        Path of the cgroup, e.g. a group delegated to the service.
+
+    Returns:
+    -----------
+    Returns True if job cgroups can be created under it.
+    """
+    return os.path.isfile(os.path.join(cgroup_root, "cgroup.controllers")) \
+        and os.access(cgroup_root, os.W_OK)
+
+
+def enable_cgroup_controllers(cgroup_root):
+    """Enables the cpu and memory controllers for the children of a cgroup.
+    The cgroup itself must not hold any process.
+
+    Parameters:
+    -----------
+    cgroup_root: str
+        Path of the cgroup.
+    """
+    with open(os.path.join(cgroup_root, "cgroup.subtree_control"), "w",
+              encoding="utf-8") as subtree_control:
+        subtree_control.write("+cpu +memory")
+
+
+def create_job_cgroup(cgroup_root, name, cpu=None, memory_bytes=None):
+    """Creates the cgroup of one job and sets its limits.
+
+    Parameters:
+    -----------
+    cgroup_root: str
+        Path of the parent cgroup.
+    name: str
+        Name of the job's cgroup.
+    cpu: float (default=None)
+        Number of CPUs the job may use, set as its `cpu.max` quota.
+    memory_bytes: int (default=None)
+        Memory the job may use, set as its `memory.max`.
+
+    Returns:
+    -----------
+    Returns the path of the new cgroup.
+    """
+    path = os.path.join(cgroup_root, name)
+    os.makedirs(path, exist_ok=True)
+    if cpu is not None:
+        quota = max(int(cpu * CGROUP_CPU_PERIOD_USEC), 1000)
+        with open(os.path.join(path, "cpu.max"), "w",
+                  encoding="utf-8") as cpu_max:
+            cpu_max.write(f"{quota} {CGROUP_CPU_PERIOD_USEC}")
+    if memory_bytes is not None:
+        with open(os.path.join(path, "memory.max"), "w",
+                  encoding="utf-8") as memory_max:
+            memory_max.write(str(memory_bytes))
+    return path
+
+
+def remove_job_cgroup(path):
+    """Removes the cgroup of a finished job.
+
+    Parameters:
+    -----------
+    path: str
+        Path of the job's cgroup.
+    """
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        logger.warning("Couldn't remove cgroup %s: %s", path, e)
+
+
+def cores_needed(cpu):
+    """Returns the number of whole cores to pin a job declaring `cpu` CPUs
+    to.
+
+    Parameters:
+    -----------
+    cpu: float
+        CPUs declared by the job.
+
+    Returns:
+    -----------
+    Returns an int of at least 1.
+    """
+    return max(math.ceil(cpu), 1)
+
+
+class CoreAllocator:
+    """Hands out disjoint sets of cores to jobs.
+    """
+
+    def __init__(self, cores=None):
+        """Initializes CoreAllocator.
+
+        Parameters:
+        -----------
+        cores: Iterable[int] (default=None)
+            Cores to hand out. Defaults to the cores this process may run
+            on.
+        """
+        if cores is None:
+            cores = os.sched_getaffinity(0)
+        self.cores = frozenset(cores)
+        self._free = set(self.cores)
+        self._lock = threading.Lock()
+
+    @property
+    def free_cores(self):
+        """Cores not allocated to any job.
+        """
+        with self._lock:
+            return frozenset(self._free)
+
+    def allocate(self, n_cores):
+        """Reserves cores for a job, lowest numbered first.
+
+        Parameters:
+        -----------
+        n_cores: int
+            Number of cores needed.
+
+        Returns:
+        -----------
+        Returns a frozenset of cores, or None if not enough are free.
+        """
+        with self._lock:
+            if n_cores > len(self._free):
+                return None
+            cores = frozenset(sorted(self._free)[:n_cores])
+            self._free -= cores
+            return cores
+
+    def release(self, cores):
+        """Returns a job's cores.
+
+        Parameters:
+        -----------
+        cores: Iterable[int]
+            Cores returned by `allocate`.
+        """
+        with self._lock:
+            self._free |= set(cores) & self.cores
@@ -0,0 +1,305 @@
+"""Wherein are contained the LogArchiver class, which saves the logs of
+finished jobs in background threads, and the sinks it writes them to.
+"""
+import io
+import os
+import queue
+import re
+import threading
+from abc import ABC, abstractmethod
+from pprint import pformat
+
+from task_queue import logger
+
+# A sink only has to open logs, so the sinks have one public method.
+# pylint: disable=too-few-public-methods
+
+
+class LogSink(ABC):
+    """Abstract destination for the logs of finished jobs.
+    """
+
+    @abstractmethod
+    def open_log(self, item_id, container):
+        """Opens the log of one container of a job for writing.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        container: str
+            Name of the container the log came from.
+
+        Returns:
+        -----------
+        Returns a binary file-like object, used as a context manager.
+        """
+
+
+class _LoggerLogFile(io.BytesIO):
+    """Buffers a log and writes it to the task queue logger when closed.
+    """
+
+    def __init__(self, item_id, container):
+        super().__init__()
+        self.item_id = item_id
+        self.container = container
+
+    def close(self):
+        if not self.closed:
+            logger.info("Item: %s Container: %s: %s", self.item_id,
+                        self.container,
+                        pformat(self.getvalue().decode(errors="replace")))
+        super().close()
+
+
+class LoggerLogSink(LogSink):
+    """Writes logs to the task queue logger.
+    """
+
+    def open_log(self, item_id, container):
+        """Opens a buffer that is logged when closed.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        container: str
+            Name of the container the log came from.
+
+        Returns:
+        -----------
+        Returns a binary file-like object, used as a context manager.
+        """
+        return _LoggerLogFile(item_id, container)
+
+
+def safe_file_name(name):
+    """Makes a file name out of an item ID or container name, which may
+    come from users, by replacing every character other than letters,
+    digits, ".", "_" and "-" with "_". "." and ".." are prefixed with "_".
+
+    Parameters:
+    -----------
+    name: str
+        Name to make safe.
+
+    Returns:
+    -----------
+    Returns a name that stays in the directory it is joined to.
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", str(name))
+    if name in ("", ".", ".."):
+        name = "_" + name
+    return name
+
+
+class DirectoryLogSink(LogSink):
+    """Writes logs to `<path>/<item_id>/<container>.log` files, with the
+    item ID and container name made safe by `safe_file_name`.
+    """
+
+    def __init__(self, path):
+        """Initializes DirectoryLogSink.
+
+        Parameters:
+        -----------
+        path: str
+            Directory to write the logs to.
+        """
+        self.path = path
+
+    def open_log(self, item_id, container):
+        """Opens the log file, creating its directory.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        container: str
+            Name of the container the log came from.
+
+        Returns:
+        -----------
+        Returns a binary file object.
+        """
+        root = os.path.realpath(self.path)
+        item_dir = os.path.join(root, safe_file_name(item_id))
+        log_path = os.path.realpath(
+            os.path.join(item_dir, f"{safe_file_name(container)}.log")
+        )
+        # A symlink in the directory could still lead elsewhere.
+        if os.path.commonpath([root, log_path]) != root:
+            raise ValueError(
+                f"Log of {item_id} {container} resolves to {log_path}, "
+                f"outside of {root}"
+            )
+        os.makedirs(item_dir, exist_ok=True)
+        return open(log_path, "wb")
+
+
+class S3LogSink(LogSink):
+    """Writes logs to `<base_path>/<item_id>/<container>.log` objects in S3.
+    """
+
+    def __init__(self, base_path):
+        """Initializes S3LogSink.
+
+        Parameters:
+        -----------
+        base_path: str
+            S3 path to write the logs under.
+        """
+        # s3fs is optional, and only imported when an S3 sink is used
+        # pylint: disable=import-outside-toplevel,import-error
+        import s3fs
+        self.base_path = base_path.rstrip("/")
+        self.fs = s3fs.S3FileSystem()
+
+    def open_log(self, item_id, container):
+        """Opens the log object for a streaming upload.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        container: str
+            Name of the container the log came from.
+
+        Returns:
+        -----------
+        Returns a binary file object.
+        """
+        return self.fs.open(
+            f"{self.base_path}/{item_id}/{container}.log", "wb"
+        )
+
+
+class LogArchiver:
+    """Saves the logs of finished jobs to a sink in background threads, so
+    the work queue does not wait for log downloads.
+
+    Jobs wait in a bounded queue. When it is full, `submit` refuses the job
+    instead of blocking.
+    """
+
+    def __init__(self,
+                 sink:LogSink,
+                 n_workers=4,
+                 max_pending=1000,
+                 max_log_bytes=10 * 1024 * 1024):
+        """Initializes LogArchiver and starts its threads.
+
+        Parameters:
+        -----------
+        sink: LogSink
+            Destination of the logs.
+        n_workers: int (default=4)
+            Number of logs downloaded at once.
+        max_pending: int (default=1000)
+            Number of jobs that can wait to be archived.
+        max_log_bytes: int (default=10 MiB)
+            Maximum size kept of each container log. Longer logs are cut
+            and end with a truncation notice.
+        """
+        self.sink = sink
+        self.max_log_bytes = max_log_bytes
+        self._jobs = queue.Queue(maxsize=max_pending)
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                name=f"log-archiver-{i}",
+                daemon=True
+            )
+            for i in range(n_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item_id, fetch_logs, on_done=None):
+        """Queues the logs of a job to be archived.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        fetch_logs: Callable[[], Iterable[Tuple[str, Iterable[bytes]]]]
+            Returns (container, chunks of the log) for each container of
+            the job. Chunks are written as they are read.
+        on_done: Callable[[], None] (default=None)
+            Called once the logs are archived, even if that failed.
+
+        Returns:
+        -----------
+        Returns False if the queue is full and the job was not queued.
+        """
+        try:
+            self._jobs.put_nowait((item_id, fetch_logs, on_done))
+        except queue.Full:
+            return False
+        return True
+
+    def join(self):
+        """Waits until every queued job is archived.
+        """
+        self._jobs.join()
+
+    def close(self):
+        """Archives the queued jobs, then stops the threads.
+        """
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    # Pylint disabled because a failed archive must not stop the thread
+    # pylint: disable=broad-exception-caught
+    def _work(self):
+        """Archives jobs from the queue until given None.
+        """
+        while True:
+            job = self._jobs.get()
+            try:
+                if job is None:
+                    return
+                item_id, fetch_logs, on_done = job
+                try:
+                    self.archive(item_id, fetch_logs)
+                except Exception as e:
+                    logger.error("Couldn't archive logs of %s: %s",
+                                 item_id, e)
+                if on_done is not None:
+                    try:
+                        on_done()
+                    except Exception as e:
+                        logger.error("Error after archiving logs of %s: %s",
+                                     item_id, e)
+            finally:
+                self._jobs.task_done()
+
+    def archive(self, item_id, fetch_logs):
+        """Writes the logs of a job to the sink, chunk by chunk, keeping at
+        most `max_log_bytes` of each container log.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID of the job.
+        fetch_logs: Callable[[], Iterable[Tuple[str, Iterable[bytes]]]]
+            Returns (container, chunks of the log) for each container of
+            the job.
+        """
+        for container, chunks in fetch_logs():
+            written = 0
+            with self.sink.open_log(item_id, container) as log_file:
+                for chunk in chunks:
+                    remaining = self.max_log_bytes - written
+                    if len(chunk) > remaining:
+                        log_file.write(chunk[:remaining])
+                        log_file.write(
+                            f"\n[log truncated at {self.max_log_bytes} "
+                            "bytes]\n".encode()
+                        )
+                        break
+                    log_file.write(chunk)
+                    written += len(chunk)
@@ -1,29 +1,397 @@
 """Wherein is contained the class for the Process Queue Worker.
 """
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout, redirect_stderr
+from functools import partial
+import importlib.util
+import io
+import multiprocessing
 from multiprocessing import Process
-from subprocess import run
+from multiprocessing.connection import wait
+import os
+import signal
+from subprocess import run, Popen, DEVNULL
+import tempfile
+import threading
 from pydantic import validate_call
 
 from task_queue.workers.queue_worker_interface import QueueWorkerInterface
+from task_queue.workers.child_watcher import ChildExitWatcher
+from task_queue.workers.job_limits import (
+    CPU_RESOURCE,
+    MEMORY_RESOURCE,
+    CoreAllocator,
+    JobLimits,
+    apply_job_limits,
+    cgroup_v2_available,
+    cores_needed,
+    create_job_cgroup,
+    enable_cgroup_controllers,
+    remove_job_cgroup
+)
 from task_queue.queues.queue_base import QueueItemStage
 from task_queue import logger
 from task_queue.queue_pydantic_models import ProcessWorkerModel
 
 
+PROCESS_MODES = ("process", "pool", "popen")
+
+# Scripts imported by this pool worker process, by (path, modification time).
+_LOADED_SCRIPTS = {}
+
+def run_script_entry_point(filepath, args):
+    """Runs the `run(args)` function of a python script in the current
+    process, importing the script on first use. Used by the pool workers of
+    ProcessQueueWorker, which keep imported scripts between jobs.
+
+    Parameters:
+    -----------
+    filepath: str
+        Path of the script.
+    args: [str]
+        Arguments passed to `run`.
+
+    Returns:
+    -----------
+    Returns the (stdout, stderr) text written by the job. Raises the
+    exception raised by the job, or a RuntimeError if it exited with a
+    non-zero code.
+    """
+    key = (filepath, os.stat(filepath).st_mtime_ns)
+    module = _LOADED_SCRIPTS.get(key)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(
+            f"task_queue_job_{len(_LOADED_SCRIPTS)}", filepath
+        )
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not callable(getattr(module, "run", None)):
+            raise AttributeError(f"{filepath} has no run(args) function")
+        _LOADED_SCRIPTS[key] = module
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            module.run(list(args))
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                raise RuntimeError(
+                    f"{filepath} exited with code {e.code}\n"
+                    f"{stderr.getvalue()}"
+                ) from None
+    return stdout.getvalue(), stderr.getvalue()
+
+
+class CoresUnavailableError(RuntimeError):
+    """Raised when the cores a job needs are held by other jobs.
+    """
+
+
+def run_script(item_id, filepath, args, limits=None):
+    """Runs a python script in a new interpreter and waits for it, raising a
+    RuntimeError if it writes to stderr.
+
+    Parameters:
+    -----------
+    item_id: str
+        Queue Item ID, for logging.
+    filepath: str
+        Path of the script.
+    args: [str]
+        Arguments passed to the script.
+    limits: JobLimits (default=None)
+        Limits applied to the script's process.
+    """
+    try:
+        # Run python script found at filepath with 0+ args
+        command = ['python3', filepath] + list(args)
+        # Pylint disabled because the limits must be applied in the
+        # child before the script starts
+        # pylint: disable=subprocess-popen-preexec-fn
+        result = run(
+            command,
+            capture_output=True,
+            text=True,
+            check=False,
+            preexec_fn=partial(apply_job_limits, limits) if limits
+                else None
+        )
+        if result.stdout:
+            logger.info(result.stdout)
+        # Catch error that occured when running script
+        if len(result.stderr) > 0:
+            logger.error(result.stderr)
+            raise RuntimeError(
+                f"Error occured while running {filepath} for queue item: "
+                f"{item_id}\nError: {result.stderr}"
+            )
+    except Exception as e:
+        logger.error(e)
+        raise e
+
+def run_script_process(item_id, filepath, args, limits=None):
+    """Target of the job processes of ProcessQueueWorker in "process" mode.
+    The process leads a new process group, so `delete_job` can stop it
+    together with the script it runs. Only the job's arguments are sent to
+    the process, so it can be started with any multiprocessing method.
+
+    Parameters:
+    -----------
+    item_id: str
+        Queue Item ID, for logging.
+    filepath: str
+        Path of the script.
+    args: [str]
+        Arguments passed to the script.
+    limits: JobLimits (default=None)
+        Limits applied to the script's process.
+    """
+    os.setpgid(0, 0)
+    run_script(item_id, filepath, args, limits)
+
+
+# The modes, the resource enforcement and the bookkeeping of running jobs
+# each keep their own state.
+# pylint: disable=too-many-instance-attributes
 class ProcessQueueWorker(QueueWorkerInterface):
     """Process Queue Worker Class
 
     Jobs are completed using processes, steps to be completed for each job are
     stored in python scripts outside of the task-queue package.
+
+    In "process" mode every job runs its script in a new python interpreter.
+    In "pool" mode jobs run in a fixed pool of long-lived interpreters, which
+    import each script once and call its `run(args)` function, so short jobs
+    do not pay for interpreter startup and imports.
+    In "popen" mode each script is started directly as a child process, with
+    its output streamed to log files, so a running job costs one process.
+
+    With `enforce_resources`, the `resources` declared by a job are enforced
+    in "process" and "popen" modes: a job declaring `cpu` is pinned to that
+    many cores, rounded up, that no other pinned job uses, and a job
+    declaring `memory_mb` is limited to that much memory. A job whose cores
+    are held by other jobs waits in the worker, reported as PROCESSING,
+    until they are freed. Under a cgroup v2
+    `cgroup_root` each job gets its own cgroup with `cpu.max` and
+    `memory.max` set; otherwise memory is limited with setrlimit.
     """
 
-    def __init__(self, path_to_scripts):
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
+    def __init__(self, path_to_scripts, *, wakeup_trigger=None,
+                 mode="process", pool_size=None, log_dir=None,
+                 enforce_resources=False, cgroup_root=None,
+                 log_retention=None):
         """Initializes ProcessQueueWorker.
+
+        Parameters:
+        -----------
+        path_to_scripts: str
+            Directory holding the scripts named by the queue items.
+        wakeup_trigger: WakeupTrigger (default=None)
+            Trigger notified whenever a job process exits.
+        mode: str (default="process")
+            One of PROCESS_MODES.
+        pool_size: int (default=None)
+            Number of interpreters in "pool" mode. Defaults to the number of
+            CPUs.
+        log_dir: str (default=None)
+            Directory of the `<item_id>.stdout.log` and `<item_id>.stderr.log`
+            files written in "popen" mode. Defaults to a new temporary
+            directory.
+        log_retention: int (default=None)
+            Number of deleted "popen" jobs whose log files are kept in
+            `log_dir`. The files of older jobs are removed. None keeps them
+            all.
+        enforce_resources: bool (default=False)
+            Pin jobs to disjoint cores and limit their memory, from the
+            `cpu` and `memory_mb` entries of their `resources`. Not
+            available in "pool" mode.
+        cgroup_root: str (default=None)
+            A cgroup v2 group, delegated to this process and holding no
+            process, to create the cgroups of jobs in. When it is not
+            usable, memory is limited with setrlimit instead.
         """
+        if mode not in PROCESS_MODES:
+            raise ValueError(
+                f"mode must be one of {PROCESS_MODES}, got {mode}"
+            )
+        if enforce_resources and mode == "pool":
+            raise ValueError(
+                "Resources cannot be enforced in 'pool' mode, whose "
+                "interpreters are shared by jobs"
+            )
         self.path_to_scripts = path_to_scripts
+        self.wakeup_trigger = wakeup_trigger
+        self.mode = mode
         self._active_processes = {}
+        self._pool_size = pool_size
+        self._pool = None
+        # (filepath, args) of each job sent to the pool, to send it again
+        # when the pool is restarted under it.
+        self._pool_jobs = {}
+        if mode == "pool":
+            self._pool = self._new_pool()
+
+        self.log_dir = log_dir
+        self.log_retention = log_retention
+        self._retained_logs = deque()
+        self._finished_statuses = {}
+        self._child_watcher = None
+        if mode == "popen":
+            if self.log_dir is None:
+                self.log_dir = tempfile.mkdtemp(prefix="task_queue_jobs_")
+            os.makedirs(self.log_dir, exist_ok=True)
+            if wakeup_trigger is not None:
+                self._child_watcher = ChildExitWatcher(wakeup_trigger)
+
+        self._job_limits = {}
+        # Jobs waiting for cores, in the order they were sent, and jobs that
+        # failed to start after waiting.
+        self._waiting_jobs = {}
+        self._start_errors = set()
+        self._core_allocator = None
+        self._cgroup_root = None
+        if enforce_resources:
+            self._core_allocator = CoreAllocator()
+            if cgroup_root is not None:
+                self._cgroup_root = self._setup_cgroup_root(cgroup_root)
+
+    @staticmethod
+    def _setup_cgroup_root(cgroup_root):
+        """Prepares the cgroup jobs get their cgroups in.
+
+        Parameters:
+        -----------
+        cgroup_root: str
+            Path of the cgroup.
+
+        Returns:
+        -----------
+        Returns the path, or None if cgroups cannot be used there.
+        """
+        if not cgroup_v2_available(cgroup_root):
+            logger.warning("%s is not a writable cgroup v2 group, limiting "
+                           "job memory with setrlimit", cgroup_root)
+            return None
+        try:
+            enable_cgroup_controllers(cgroup_root)
+        except OSError as e:
+            logger.warning("Couldn't enable the cpu and memory controllers "
+                           "of %s, limiting job memory with setrlimit: %s",
+                           cgroup_root, e)
+            return None
+        return cgroup_root
+
+    def _reserve_limits(self, item_id, queue_item_body):
+        """Reserves the cores and creates the cgroup of a job from its
+        declared resources.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: ProcessWorkerModel
+            Body of the job.
+
+        Returns:
+        -----------
+        Returns the JobLimits of the job, or None when there is nothing to
+        enforce. Raises a CoresUnavailableError if the cores it needs are
+        taken, or a RuntimeError if the worker does not have that many.
+        """
+        if self._core_allocator is None or not queue_item_body.resources:
+            return None
+        cpu = queue_item_body.resources.get(CPU_RESOURCE)
+        memory_mb = queue_item_body.resources.get(MEMORY_RESOURCE)
+        limits = JobLimits()
+        if memory_mb is not None:
+            limits.memory_bytes = int(memory_mb * 1024 * 1024)
+        if cpu is not None:
+            n_cores = cores_needed(cpu)
+            if n_cores > len(self._core_allocator.cores):
+                raise RuntimeError(
+                    f"Queue item {item_id} needs {n_cores} cores but the "
+                    f"worker only has {len(self._core_allocator.cores)}"
+                )
+            limits.cores = self._core_allocator.allocate(n_cores)
+            if limits.cores is None:
+                raise CoresUnavailableError(
+                    f"Queue item {item_id} needs {n_cores} cores but only "
+                    f"{len(self._core_allocator.free_cores)} are free"
+                )
+        if self._cgroup_root is not None:
+            try:
+                limits.cgroup_path = create_job_cgroup(
+                    self._cgroup_root,
+                    "task-queue-" + str(item_id).replace(os.sep, "_"),
+                    cpu=cpu,
+                    memory_bytes=limits.memory_bytes
+                )
+            except OSError:
+                if limits.cores is not None:
+                    self._core_allocator.release(limits.cores)
+                raise
+        self._job_limits[item_id] = limits
+        return limits
+
+    def _release_limits(self, item_id):
+        """Frees the cores and removes the cgroup of a finished job. Does
+        nothing if they were already released.
 
-    def start_job(self, item_id, queue_item_body):
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        """
+        limits = self._job_limits.pop(item_id, None)
+        if limits is None:
+            return
+        if limits.cores is not None:
+            self._core_allocator.release(limits.cores)
+        if limits.cgroup_path is not None:
+            remove_job_cgroup(limits.cgroup_path)
+
+    def _new_pool(self):
+        """Creates the interpreter pool used in "pool" mode.
+
+        Returns:
+        -----------
+        Returns a ProcessPoolExecutor.
+        """
+        # Spawned interpreters do not inherit the threads of this one.
+        return ProcessPoolExecutor(
+            max_workers=self._pool_size,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def _restart_pool(self):
+        """Kills the interpreters of the pool and starts a new pool. The
+        other jobs that were running or waiting in the old pool are sent to
+        the new pool, so they run again from the start instead of failing.
+        """
+        unfinished_ids = [
+            item_id for item_id, future in self._active_processes.items()
+            if not future.done()
+        ]
+        # Their old futures fail once the interpreters are killed.
+        for item_id in unfinished_ids:
+            del self._active_processes[item_id]
+        # ProcessPoolExecutor has no public way to stop a running job.
+        # pylint: disable=protected-access
+        processes = list((self._pool._processes or {}).values())
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+        self._pool = self._new_pool()
+        for item_id in unfinished_ids:
+            logger.info("Sending job %s to the new process pool", item_id)
+            self._submit_pool_job(item_id)
+
+    def start_job(self, item_id, queue_item_body, limits=None):
         """Target function to run python script specified in queue item body.
 
         Parameters:
@@ -37,31 +405,11 @@ class ProcessQueueWorker(QueueWorkerInterface):
                 "file_name": 'name_of_script.py'
                 "args": ['list','of','args'] or None
             }
+        limits: JobLimits (default=None)
+            Limits applied to the script's process.
         """
         filepath = f"{self.path_to_scripts}/{queue_item_body.file_name}"
-        try:
-            # Run python script found at filepath with 0+ args
-            command = ['python3', filepath]
-            if queue_item_body.args:
-                command += (queue_item_body.args)
-            result = run(
-                command,
-                capture_output=True,
-                text=True,
-                check=False
-            )
-            if result.stdout:
-                logger.info(result.stdout)
-            # Catch error that occured when running script
-            if len(result.stderr) > 0:
-                logger.error(result.stderr)
-                raise RuntimeError(
-                    f"Error occured while running {filepath} for queue item: "
-                    f"{item_id}\nError: {result.stderr}"
-                )
-        except Exception as e:
-            logger.error(e)
-            raise e
+        run_script(item_id, filepath, queue_item_body.args or [], limits)
 
     @validate_call
     def send_job(self, item_id, queue_item_body:ProcessWorkerModel):
@@ -78,34 +426,422 @@ class ProcessQueueWorker(QueueWorkerInterface):
                 "args": ['list','of','args'] or None
             }
         """
-        p = Process(target=self.start_job, args=(item_id,queue_item_body,))
-        self._active_processes[item_id] = p
-        p.start()
+        if self._pool is not None:
+            self._submit_to_pool(item_id, queue_item_body)
+            return
+
+        # A job sent again must not keep the limits of its previous run.
+        self._release_limits(item_id)
+        self._start_errors.discard(item_id)
+        try:
+            limits = self._reserve_limits(item_id, queue_item_body)
+        except CoresUnavailableError as e:
+            logger.info("%s, waiting for them to be freed", e)
+            self._waiting_jobs[item_id] = queue_item_body
+            return
+        self._start_job(item_id, queue_item_body, limits)
+
+    def _start_job(self, item_id, queue_item_body, limits):
+        """Starts a job in "process" or "popen" mode with the limits reserved
+        for it.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: ProcessWorkerModel
+            File name and arguments of the job.
+        limits: JobLimits
+            Limits applied to the job's process, or None.
+        """
+        try:
+            if self.mode == "popen":
+                self._start_popen(item_id, queue_item_body, limits)
+                return
+
+            filepath = f"{self.path_to_scripts}/{queue_item_body.file_name}"
+            p = Process(target=run_script_process,
+                        args=(item_id, filepath, queue_item_body.args or [],
+                              limits,))
+            self._active_processes[item_id] = p
+            p.start()
+        except Exception:
+            self._active_processes.pop(item_id, None)
+            self._release_limits(item_id)
+            raise
+        if self.wakeup_trigger is not None:
+            threading.Thread(
+                target=self._notify_on_exit,
+                args=(item_id, p,),
+                daemon=True
+            ).start()
+
+    # Disabled pylint because a job that cannot start is reported as failed,
+    # the others still start.
+    # pylint: disable=broad-exception-caught
+    def _start_waiting_jobs(self):
+        """Starts the jobs waiting for cores whose cores are free, in the
+        order they were sent. A job needing fewer cores may start before an
+        earlier one needing more.
+
+        Returns:
+        -----------
+        Returns the list of IDs of the jobs started, or that failed to.
+        """
+        started_ids = []
+        for item_id, queue_item_body in list(self._waiting_jobs.items()):
+            try:
+                limits = self._reserve_limits(item_id, queue_item_body)
+            except CoresUnavailableError:
+                continue
+            except Exception as e:
+                logger.error("Couldn't start queue item %s: %s", item_id, e)
+                self._start_errors.add(item_id)
+            else:
+                try:
+                    self._start_job(item_id, queue_item_body, limits)
+                except Exception as e:
+                    logger.error("Couldn't start queue item %s: %s",
+                                 item_id, e)
+                    self._start_errors.add(item_id)
+            del self._waiting_jobs[item_id]
+            started_ids.append(item_id)
+        return started_ids
+
+    def _log_paths(self, item_id):
+        """Returns the paths of the stdout and stderr log files of a job in
+        "popen" mode.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+
+        Returns:
+        -----------
+        Tuple of the stdout and stderr log file paths.
+        """
+        name = str(item_id).replace(os.sep, "_")
+        return (
+            os.path.join(self.log_dir, f"{name}.stdout.log"),
+            os.path.join(self.log_dir, f"{name}.stderr.log")
+        )
+
+    def _start_popen(self, item_id, queue_item_body, limits=None):
+        """Starts a job as a direct child process, streaming its output to
+        log files.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: ProcessWorkerModel
+            File name and arguments of the job.
+        limits: JobLimits (default=None)
+            Limits applied to the job's process.
+        """
+        filepath = f"{self.path_to_scripts}/{queue_item_body.file_name}"
+        command = ['python3', filepath]
+        if queue_item_body.args:
+            command += queue_item_body.args
+
+        stdout_path, stderr_path = self._log_paths(item_id)
+        # The child keeps its own copies of the file descriptors.
+        with open(stdout_path, "wb") as stdout, \
+            open(stderr_path, "wb") as stderr:
+            # Pylint disabled because the limits must be applied in the
+            # child before the script starts, and the process outlives this
+            # call: it is reaped by `poll_all_status` or `delete_job`
+            # pylint: disable=subprocess-popen-preexec-fn
+            # pylint: disable=consider-using-with
+            process = Popen(
+                command, stdin=DEVNULL, stdout=stdout, stderr=stderr,
+                start_new_session=True,
+                preexec_fn=partial(apply_job_limits, limits) if limits
+                    else None
+            )
+        self._finished_statuses.pop(item_id, None)
+        self._active_processes[item_id] = process
+        if self._child_watcher is not None:
+            self._child_watcher.watch(item_id, process)
+
+    def _popen_job_status(self, item_id, process):
+        """Converts the state of a "popen" job into a QueueItemStage from its
+        exit code: a non-zero exit code is a failure. Output on stderr is
+        only logged, as the job may write warnings there. Does not block.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        process: subprocess.Popen
+            The job's process.
+
+        Returns:
+        -----------
+        Returns the QueueItemStage of the job.
+        """
+        status = self._finished_statuses.get(item_id)
+        if status is not None:
+            return status
+        if process.poll() is None:
+            return QueueItemStage.PROCESSING
+        self._release_limits(item_id)
+
+        _, stderr_path = self._log_paths(item_id)
+        if process.returncode == 0:
+            status = QueueItemStage.SUCCESS
+        else:
+            status = QueueItemStage.FAIL
+            logger.error("Error occured while running queue item: %s, exit "
+                         "code %s, see %s", item_id, process.returncode,
+                         stderr_path)
+        self._finished_statuses[item_id] = status
+        return status
+
+    def _submit_to_pool(self, item_id, queue_item_body):
+        """Starts a job in the interpreter pool.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        queue_item_body: ProcessWorkerModel
+            File name and arguments of the job.
+        """
+        filepath = f"{self.path_to_scripts}/{queue_item_body.file_name}"
+        self._pool_jobs[item_id] = (filepath, queue_item_body.args or [])
+        self._submit_pool_job(item_id)
+
+    def _submit_pool_job(self, item_id):
+        """Submits a job recorded in `_pool_jobs` to the interpreter pool.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        """
+        filepath, args = self._pool_jobs[item_id]
+        try:
+            future = self._pool.submit(run_script_entry_point, filepath, args)
+        except BrokenProcessPool:
+            # An interpreter died abruptly, which fails its running jobs and
+            # breaks the pool. Start a new one for this and later jobs.
+            logger.warning("Process pool is broken, starting a new one")
+            self._pool.shutdown(wait=False)
+            self._pool = self._new_pool()
+            future = self._pool.submit(run_script_entry_point, filepath, args)
+        self._active_processes[item_id] = future
+        future.add_done_callback(
+            lambda f: self._pool_job_done(item_id, f)
+        )
+
+    def _pool_job_done(self, item_id, future):
+        """Logs the output of a finished pool job and notifies the wakeup
+        trigger.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        future: concurrent.futures.Future
+            Future of the job.
+        """
+        if self._active_processes.get(item_id) is not future:
+            # The job was deleted, or sent to a new pool after a restart.
+            return
+        if future.cancelled():
+            logger.warning("Job %s was cancelled", item_id)
+        elif future.exception() is not None:
+            logger.error("Error occured while running queue item: %s\n"
+                         "Error: %s", item_id, future.exception())
+        else:
+            stdout, stderr = future.result()
+            if stdout:
+                logger.info(stdout)
+            if stderr:
+                logger.error(stderr)
+        if self.wakeup_trigger is not None:
+            self.wakeup_trigger.notify(f"job {item_id} finished")
+
+    def _notify_on_exit(self, item_id, p):
+        """Waits for a job process to exit, then notifies the wakeup trigger.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        p: multiprocessing.Process
+            Process running the job.
+        """
+        try:
+            wait([p.sentinel])
+        except (OSError, ValueError):
+            # The process was closed by delete_job, so it already exited.
+            pass
+        self.wakeup_trigger.notify(f"process for {item_id} exited")
 
     def delete_job(self, queue_item_id):
-        """Clears up any remaining resources being used by that process.
+        """Clears up any remaining resources being used by that process,
+        killing it if it is still running.
+
+        A running "pool" job cannot be killed on its own, so the pool is
+        restarted, and the other jobs running in it start again from the
+        beginning in the new pool.
 
         Parameters:
         -----------
         queue_item_id: str
             Queue Item ID to delete from dictionary of active processes
         """
+        if queue_item_id in self._waiting_jobs:
+            del self._waiting_jobs[queue_item_id]
+            return
+        if queue_item_id in self._start_errors:
+            self._start_errors.discard(queue_item_id)
+            return
         p = self._active_processes.pop(queue_item_id)
-        p.close()
+        if self._pool is not None:
+            self._pool_jobs.pop(queue_item_id, None)
+            if not p.cancel() and not p.done():
+                logger.warning("Killing running job %s, restarting the "
+                               "process pool", queue_item_id)
+                self._restart_pool()
+            return
+        if self.mode == "popen":
+            if p.poll() is None:
+                logger.warning("Killing running job %s", queue_item_id)
+                self._kill_process_group(p.pid)
+                p.wait()
+            self._finished_statuses.pop(queue_item_id, None)
+            logger.info("Logs of %s are in %s", queue_item_id,
+                        " and ".join(self._log_paths(queue_item_id)))
+            self._retain_logs(queue_item_id)
+        else:
+            if p.exitcode is None:
+                logger.warning("Killing running job %s", queue_item_id)
+                self._kill_process_group(p.pid)
+                # The process may not lead its group yet.
+                p.kill()
+                p.join()
+            p.close()
+        self._release_limits(queue_item_id)
+
+    def _retain_logs(self, item_id):
+        """Records that the logs of a deleted "popen" job are kept, removing
+        the log files of the oldest jobs past `log_retention`.
+
+        Parameters:
+        -----------
+        item_id: str
+            Queue Item ID
+        """
+        if self.log_retention is None:
+            return
+        # A job sent again overwrote its earlier logs.
+        if item_id in self._retained_logs:
+            self._retained_logs.remove(item_id)
+        self._retained_logs.append(item_id)
+        while len(self._retained_logs) > self.log_retention:
+            old_item_id = self._retained_logs.popleft()
+            if old_item_id in self._active_processes:
+                continue
+            for log_path in self._log_paths(old_item_id):
+                try:
+                    os.remove(log_path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _kill_process_group(pid):
+        """Kills the process group led by a job's process, which holds the
+        job and the processes it started.
+
+        Parameters:
+        -----------
+        pid: int
+            Process ID of the group leader.
+        """
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
 
     def poll_all_status(self):
-        """Poll status of all jobs sent by the worker interface.
+        """Poll status of all jobs sent by the worker interface, then starts
+        the jobs waiting for cores that were freed.
+
+        Returns:
+        -----------
+        Returns Dict[item_id, QueueItemStage] of job statuses.
+        """
+        statuses = self._poll_active_jobs()
+        # Started jobs are reported as PROCESSING until the next poll.
+        for item_id in self._start_waiting_jobs():
+            statuses[item_id] = QueueItemStage.PROCESSING
+        for item_id in self._waiting_jobs:
+            statuses[item_id] = QueueItemStage.PROCESSING
+        for item_id in self._start_errors:
+            statuses[item_id] = QueueItemStage.FAIL
+        return statuses
+
+    def _poll_active_jobs(self):
+        """Polls the status of the jobs that were started.
 
         Returns:
         -----------
         Returns Dict[item_id, QueueItemStage] of job statuses.
         """
         statuses = {}
+        if self._pool is not None:
+            for id_, future in self._active_processes.items():
+                statuses[id_] = self._pool_job_status(future)
+            return statuses
+        if self.mode == "popen":
+            for id_, process in self._active_processes.items():
+                statuses[id_] = self._popen_job_status(id_, process)
+            return statuses
+
         for id_,p in self._active_processes.items():
             if p.exitcode is None:
                 statuses[id_] = QueueItemStage.PROCESSING
-            elif p.exitcode == 0:
+                continue
+            self._release_limits(id_)
+            if p.exitcode == 0:
                 statuses[id_] = QueueItemStage.SUCCESS
             else:
                 statuses[id_] = QueueItemStage.FAIL
         return statuses
+
+    def _pool_job_status(self, future):
+        """Converts the future of a pool job into a QueueItemStage, the same
+        way process exit codes are: output on stderr or an error is a
+        failure.
+
+        Parameters:
+        -----------
+        future: concurrent.futures.Future
+            Future of the job.
+
+        Returns:
+        -----------
+        Returns the QueueItemStage of the job.
+        """
+        if not future.done():
+            return QueueItemStage.PROCESSING
+        if future.cancelled() or future.exception() is not None:
+            return QueueItemStage.FAIL
+        _, stderr = future.result()
+        if stderr:
+            return QueueItemStage.FAIL
+        return QueueItemStage.SUCCESS
+
+    def close(self):
+        """Shuts down the interpreter pool, waiting for running jobs, and
+        stops watching "popen" jobs.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        if self._child_watcher is not None:
+            self._child_watcher.close()
+            self._child_watcher = None
@@ -7,7 +7,11 @@ from ..queues.queue_base import QueueItemStage
 
 class QueueWorkerInterface(ABC):
     """Abstract Queue Worker Interface Class.
+
+    Interfaces whose `send_job` and `delete_job` may be called from several
+    threads at once set `thread_safe` to True.
     """
+    thread_safe = False
 
     @abstractmethod
     def send_job(self, item_id, queue_item_body):
@@ -26,7 +30,8 @@ class QueueWorkerInterface(ABC):
     @abstractmethod
     def delete_job(self, queue_item_id):
         """Sends a delete request to argo workflows to delete a specific
-        workflow.
+        workflow. Jobs that are still running, such as jobs that timed out,
+        are stopped.
 
         Parameters:
         -----------
@@ -34,6 +39,17 @@ class QueueWorkerInterface(ABC):
             Queue Item ID
         """
 
+    def delete_jobs(self, queue_item_ids):
+        """Deletes several finished jobs. Deletes one job at a time unless
+        the worker interface has a faster way.
+
+        Parameters:
+        -----------
+        queue_item_ids: [str]
+            Queue Item IDs
+        """
+        for queue_item_id in queue_item_ids:
+            self.delete_job(queue_item_id)
 
     @abstractmethod
     def poll_all_status(self):
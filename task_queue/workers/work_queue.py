@@ -1,23 +1,158 @@
 """Wherein is contained the WorkQueue class.
 """
-from task_queue.queues.queue_base import QueueItemStage, QueueBase
-from task_queue import logger
+import asyncio
+import threading
+import time
+
+from task_queue.queues.queue_base import QueueBase
+from task_queue.workers.async_work_queue import AsyncWorkQueue
+from task_queue.workers.async_queue_worker_interface import (
+    AsyncQueueWorkerInterface, DirectAsyncWorkerInterface
+)
+
+
+def run_without_loop(coroutine):
+    """Runs a coroutine that never suspends to completion in the calling
+    thread, without an event loop.
+
+    Parameters:
+    -----------
+    coroutine: Coroutine
+        Coroutine to run.
+
+    Returns:
+    -----------
+    Returns the result of the coroutine.
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coroutine.close()
+    raise RuntimeError("The coroutine suspended, so it needs an event loop")
+
+
+class _DirectWorkQueue(AsyncWorkQueue):
+    """AsyncWorkQueue that calls the queue and a synchronous worker interface
+    directly, one job at a time, so its coroutines never suspend.
+    """
+
+    def __init__(self, queue, interface, **kwargs):
+        super().__init__(queue, interface, max_concurrency=1, **kwargs)
+        self._interface = DirectAsyncWorkerInterface(interface)
+
+    async def _call_queue(self, method, *args, **kwargs):
+        """Calls a method of the queue in the calling thread.
+        """
+        return method(*args, **kwargs)
 
 
 class WorkQueue():
-    """Class for the WorkQueue initialization and supporting functions.
+    """Synchronous facade over AsyncWorkQueue, for callers such as the job
+    release strategies and the CLI.
+
+    With a synchronous interface and a `send_concurrency` of 1, every call
+    to the queue and the interface is made in the calling thread. Otherwise
+    the AsyncWorkQueue coroutines run on an event loop in a dedicated
+    thread, started on first use and stopped by `close`. Either way, the
+    methods can be called while an event loop is running.
     """
-    def __init__(self, queue:QueueBase, interface):
+    # Pylint does not like more than 5 parameters
+    # pylint: disable=too-many-arguments
+    def __init__(self, queue:QueueBase, interface, *, send_concurrency=1,
+                 default_timeout_sec=None, timeout_key="timeout_sec",
+                 lease_owner=None, lease_sec=None, clock=time.monotonic):
         """Initializes Work Queue.
 
         Parameters:
         -----------
         queue: QueueBase
-        interface: QueueWorkerInterface
+        interface: QueueWorkerInterface or AsyncQueueWorkerInterface
+        send_concurrency: int (default=1)
+            Maximum number of jobs sent to the worker interface at once. Above
+            1, a synchronous interface must be `thread_safe`, as its
+            `send_job` is called from several threads at once.
+        default_timeout_sec: float (default=None)
+            Seconds a job may stay PROCESSING before it is deleted from the
+            worker interface and moved to FAIL, for items that do not set
+            their own. None means no timeout.
+        timeout_key: str (default="timeout_sec")
+            Key of the item body holding the item's own timeout in seconds.
+        lease_owner: str (default=None)
+            Name this work queue leases items under. See AsyncWorkQueue.
+        lease_sec: float (default=None)
+            Lease taken on the items this work queue sends, renewed by every
+            `update_job_status`. See AsyncWorkQueue.
+        clock: Callable[[], float] (default=time.monotonic)
+            Returns the current time in seconds, for job deadlines.
         """
+        if send_concurrency < 1:
+            raise ValueError("send_concurrency must be at least 1")
+        is_async = isinstance(interface, AsyncQueueWorkerInterface)
+        if send_concurrency > 1 and not is_async \
+                and not getattr(interface, "thread_safe", False):
+            raise ValueError(
+                f"{type(interface).__name__} is not thread-safe, so "
+                "send_concurrency must be 1"
+            )
         self._queue = queue
         self._interface = interface
-        self._cached_statuses = {}
+        self._loop = None
+        self._loop_thread = None
+        kwargs = {
+            "default_timeout_sec": default_timeout_sec,
+            "timeout_key": timeout_key,
+            "lease_owner": lease_owner,
+            "lease_sec": lease_sec,
+            "clock": clock
+        }
+        self._direct = send_concurrency == 1 and not is_async
+        if self._direct:
+            self._async_work_queue = _DirectWorkQueue(
+                queue, interface, **kwargs
+            )
+        else:
+            self._async_work_queue = AsyncWorkQueue(
+                queue, interface, max_concurrency=send_concurrency, **kwargs
+            )
+
+    def _run(self, coroutine):
+        """Runs an AsyncWorkQueue coroutine to completion.
+
+        Parameters:
+        -----------
+        coroutine: Coroutine
+            Coroutine to run.
+
+        Returns:
+        -----------
+        Returns the result of the coroutine.
+        """
+        if self._direct:
+            return run_without_loop(coroutine)
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._loop_thread = threading.Thread(
+                target=self._loop.run_forever,
+                name="work-queue-loop",
+                daemon=True
+            )
+            self._loop_thread.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        """Stops the event loop thread, if one was started.
+        """
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(
+            self._loop.shutdown_default_executor(), self._loop
+        ).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._loop = None
+        self._loop_thread = None
 
     @property
     def queue(self):
@@ -25,6 +160,29 @@ class WorkQueue():
         """
         return self._queue
 
+    def add_jobs_started_callback(self, callback):
+        """Registers a function called with the jobs this work queue sends to
+        the worker interface.
+
+        Parameters:
+        -----------
+        callback: Callable[[List[Tuple[str, Any]]], None]
+            Called with the list of (queue_item_id, queue_item_body) of the
+            jobs that were sent.
+        """
+        self._async_work_queue.add_jobs_started_callback(callback)
+
+    def add_jobs_finished_callback(self, callback):
+        """Registers a function called with the jobs this work queue moves out
+        of PROCESSING, whether they succeeded or failed.
+
+        Parameters:
+        -----------
+        callback: Callable[[List[str]], None]
+            Called with the list of queue item ids that finished.
+        """
+        self._async_work_queue.add_jobs_finished_callback(callback)
+
     def get_queue_size(self, queue_item_stage):
         """Gets the queue size for the given QueueItemStage stage.
 
@@ -37,11 +195,8 @@ class WorkQueue():
         -----------
         The queue size from WorkQueue for the given stage.
         """
-        queue_size = self._queue.size(queue_item_stage)
-        return queue_size
+        return self._queue.size(queue_item_stage)
 
-    # Pylint disabled because any except is used to call the queue fail
-    # pylint: disable=broad-exception-caught
     def push_next_jobs(self, n_jobs=None):
         """Sends jobs from Queue.
 
@@ -54,22 +209,22 @@ class WorkQueue():
         -----------
         Returns the jobs selected from Queue.
         """
-        if n_jobs is None:
-            n_jobs = 1
-
-        next_items = self._queue.get(n_jobs)
+        return self._run(self._async_work_queue.push_next_jobs(n_jobs))
 
-        for queue_item_id, queue_item_body in next_items:
-            try:
-                self._interface.send_job(queue_item_id, queue_item_body)
-            except Exception:
-                # Error in submission -> fail
-                logger.warning("Item %s failed on submission", queue_item_id)
-                logger.warning("Moving %s to failed", queue_item_id)
-                self._queue.fail(queue_item_id)
+    def push_jobs(self, item_ids):
+        """Sends the given WAITING jobs from Queue, wherever they are in the
+        Queue. Items that are no longer WAITING are skipped.
 
-        return next_items
+        Parameters:
+        -----------
+        item_ids: [str]
+            IDs of the jobs to send.
 
+        Returns:
+        -----------
+        Returns the jobs selected from Queue.
+        """
+        return self._run(self._async_work_queue.push_jobs(item_ids))
 
     def update_job_status(self):
         """Updates job statuses in Queue.
@@ -78,28 +233,4 @@ class WorkQueue():
         -----------
         Returns dictionary of all statuses as Dict[Any, QueueItemStage]
         """
-        statuses = self._interface.poll_all_status()
-
-        logger.info("Processing new statuses from worker interface")
-
-        processing_items = self._queue.lookup_state(QueueItemStage.PROCESSING)
-
-        # update all items in processing
-        for queue_item_id in processing_items:
-            # default to None if the item id is not in the list of statuses
-            # returned by the queue worker. This prevents jobs that were
-            # deleted externally from getting stuck in `PROCESSING` eternally.
-            status = statuses.get(queue_item_id, None)
-
-            if status is None:
-                # no need to delete here, because this case is only reached
-                # when the item has already been deleted.
-                self._queue.fail(queue_item_id)
-            elif status == QueueItemStage.SUCCESS:
-                self._queue.success(queue_item_id)
-                self._interface.delete_job(queue_item_id)
-            elif status == QueueItemStage.FAIL:
-                self._queue.fail(queue_item_id)
-                self._interface.delete_job(queue_item_id)
-
-        return statuses
+        return self._run(self._async_work_queue.update_job_status())
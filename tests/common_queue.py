@@ -1,6 +1,7 @@
 """Pytests for the common queue functionalities.
 """
 import random
+import time
 import warnings
 
 import pytest
@@ -10,6 +11,36 @@ import task_queue.queues.queue_base as qb
 
 pytestmark = pytest.mark.skip()
 
+# Backoff of the queues given to test_retry_policy. Queues without a
+# FakeClock really wait for it, so it is long enough for the checks made
+# before it runs out not to depend on timing.
+RETRY_BACKOFF_SEC = 2
+
+class FakeClock:
+    """Clock for queues and work queues that only moves when told to, so
+    tests of retry delays, leases and timeouts do not depend on timing.
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        """Moves the clock `seconds` forward."""
+        self.now += seconds
+
+def wait(queue, seconds):
+    """Lets `seconds` pass for a queue: advances its clock when it is a
+    FakeClock, and sleeps otherwise.
+    """
+    # QueueWithEvents keeps the queue it wraps in `queue`.
+    clock = getattr(getattr(queue, "queue", queue), "clock", None)
+    if isinstance(clock, FakeClock):
+        clock.advance(seconds)
+    else:
+        time.sleep(seconds)
+
 def random_item():
     """Creates random item for tests.
 
@@ -103,6 +134,28 @@ def test_mixed_duplicates(queue):
     queue.put(default_items)
     assert queue.size(qb.QueueItemStage.WAITING) == len(default_items)
 
+def test_put_duplicate_warnings(queue):
+    """Tests that put warns once for every item that is already in the queue.
+    """
+    half = len(default_items) // 2
+    half_items = dict(list(default_items.items())[half:])
+    queue.put(half_items)
+
+    # Move some of the items out of WAITING, they are still duplicates.
+    queue.get(2)
+
+    with warnings.catch_warnings(record=True) as warn:
+        warnings.simplefilter("always")
+        queue.put(default_items)
+
+    warned_ids = [
+        w.message.args[0].split("'")[1]
+        for w in warn
+        if "already in queue" in str(w.message)
+    ]
+    assert sorted(warned_ids) == sorted(half_items)
+    assert queue.size(qb.QueueItemStage.WAITING) == len(default_items) - 2
+
 def test_get_empty_queue(queue):
     """Tests the results of calling get on an empty queue.
     """
@@ -178,6 +231,29 @@ def test_queue_size(queue):
     fail_size = queue.size(qb.QueueItemStage.FAIL)
     assert fail_size == move_amount
 
+def test_queue_sizes(queue: qb.QueueBase):
+    """Test that sizes agrees with size for every stage.
+    """
+    assert queue.sizes() == {
+        "WAITING": 0, "PROCESSING": 0, "SUCCESS": 0, "FAIL": 0
+    }
+
+    queue.put(default_items)
+    item_ids = [item_id for item_id, _ in queue.get(6)]
+    queue.success_many(item_ids[:2])
+    queue.fail_many(item_ids[2:4])
+    queue.requeue(item_ids[3])
+
+    sizes = queue.sizes()
+    assert sizes == {
+        "WAITING": len(default_items) - 5,
+        "PROCESSING": 2,
+        "SUCCESS": 2,
+        "FAIL": 1
+    }
+    for stage in qb.QueueItemStage:
+        assert queue.size(stage) == sizes[stage.name]
+
 def test_lookup(queue: qb.QueueBase):
     """Tests that lookup_status works as expected.
     """
@@ -194,6 +270,86 @@ def test_lookup(queue: qb.QueueBase):
     assert queue.lookup_status(succ[0]) == qb.QueueItemStage.SUCCESS
     assert queue.lookup_status(fail[0]) == qb.QueueItemStage.FAIL
 
+def test_get_items(queue: qb.QueueBase):
+    """Tests that get_items claims WAITING items by ID, in the requested
+    order, and skips items that are not WAITING.
+    """
+    queue.put(default_items)
+    item_ids = list(default_items)
+    processing_id, _ = queue.get(1)[0]
+    requested = [item_ids[5], processing_id, item_ids[2], "does-not-exist"]
+
+    claimed = queue.get_items(requested)
+
+    assert claimed == [
+        (item_ids[5], default_items[item_ids[5]]),
+        (item_ids[2], default_items[item_ids[2]])
+    ]
+    assert queue.lookup_status(item_ids[5]) == qb.QueueItemStage.PROCESSING
+    assert queue.size(qb.QueueItemStage.PROCESSING) == 3
+    assert queue.get_items([item_ids[5]]) == []
+    assert queue.get_items([]) == []
+
+    # Items claimed with a lease can be renewed by their owner only.
+    assert queue.get_items(
+        [item_ids[6]], lease_owner="owner_1", lease_sec=60
+    ) == [(item_ids[6], default_items[item_ids[6]])]
+    assert queue.extend_lease([item_ids[6], item_ids[5]], "owner_2", 60) \
+        == []
+    assert queue.extend_lease([item_ids[6], item_ids[5]], "owner_1", 60) \
+        == [item_ids[6]]
+
+def test_sum_resources(queue: qb.QueueBase):
+    """Tests that sum_resources totals the resources of the items in a stage.
+    """
+    assert queue.sum_resources(qb.QueueItemStage.PROCESSING) == {}
+
+    queue.put(default_items)
+    queue.put({"no-resources": {"data": []}, "other-key": {"gpu": {"a": 1}}})
+    queue.put({"bad-values": {"gpu": {"a": "two", "b": None, "c": True}}})
+    queue.put({"bad-resources": {"gpu": "a"}})
+    queue.get(4)
+
+    assert queue.sum_resources(qb.QueueItemStage.PROCESSING) == {
+        "resource_a": 4, "resource_b": 40, "resource_c": 8
+    }
+    assert queue.sum_resources(qb.QueueItemStage.WAITING, "gpu") == {"a": 1}
+    assert queue.sum_resources(qb.QueueItemStage.FAIL) == {}
+
+def test_iter_state(queue: qb.QueueBase):
+    """Tests that lookup_state_page and iter_state page through a stage in
+    ascending order of item id.
+    """
+    queue.put(default_items)
+    processing_ids = sorted(item_id for item_id, _ in queue.get(7))
+    waiting_ids = sorted(set(default_items) - set(processing_ids))
+
+    first_page, after = queue.lookup_state_page(
+        qb.QueueItemStage.PROCESSING, page_size=3
+    )
+    assert first_page == processing_ids[:3]
+    assert after == processing_ids[2]
+
+    second_page, after = queue.lookup_state_page(
+        qb.QueueItemStage.PROCESSING, page_size=3, after=after
+    )
+    assert second_page == processing_ids[3:6]
+
+    last_page, after = queue.lookup_state_page(
+        qb.QueueItemStage.PROCESSING, page_size=3, after=after
+    )
+    assert last_page == processing_ids[6:]
+    assert after is None
+
+    assert list(queue.iter_state(qb.QueueItemStage.PROCESSING, 3)) == \
+        processing_ids
+    assert list(queue.iter_state(qb.QueueItemStage.WAITING, 13)) == \
+        waiting_ids
+    assert list(queue.iter_state(qb.QueueItemStage.FAIL)) == []
+
+    with pytest.raises(ValueError):
+        queue.lookup_state_page(qb.QueueItemStage.WAITING, page_size=0)
+
 def test_lookup_fail(queue: qb.QueueBase):
     """Test that proper error is thrown when lookup_status fails.
     """
@@ -281,6 +437,158 @@ def test_requeue_invalid_ids(queue):
     for requeue_id in requeue_ids:
         assert queue.lookup_status(requeue_id) == qb.QueueItemStage.WAITING
 
+def test_success_fail_many(queue: qb.QueueBase):
+    """Tests that success_many and fail_many move every given item.
+    """
+    queue.put(default_items)
+    item_ids = [item_id for item_id, _ in queue.get(6)]
+    success_ids = item_ids[:3]
+    fail_ids = item_ids[3:]
+
+    assert sorted(queue.success_many(success_ids + ["BAD_ID"])) == \
+        sorted(success_ids)
+    failed_ids, retried_ids = queue.fail_many(fail_ids + success_ids)
+    assert sorted(failed_ids) == sorted(fail_ids)
+    assert retried_ids == []
+
+    assert queue.size(qb.QueueItemStage.PROCESSING) == 0
+    assert sorted(queue.lookup_state(qb.QueueItemStage.SUCCESS)) == \
+        sorted(success_ids)
+    assert sorted(queue.lookup_state(qb.QueueItemStage.FAIL)) == \
+        sorted(fail_ids)
+
+def test_success_fail_not_processing(queue: qb.QueueBase):
+    """Tests that success and fail raise KeyError for items that are not
+    PROCESSING, and leave them where they are.
+    """
+    queue.put({"item_a": {"data": 1}, "item_b": {"data": 2}})
+    with pytest.raises(KeyError):
+        queue.success("item_a")
+    with pytest.raises(KeyError):
+        queue.fail("BAD_ID")
+
+    assert queue.get(1) == [("item_a", {"data": 1})]
+    queue.success("item_a")
+    with pytest.raises(KeyError):
+        queue.fail("item_a")
+
+    assert queue.lookup_status("item_a") == qb.QueueItemStage.SUCCESS
+    assert queue.lookup_status("item_b") == qb.QueueItemStage.WAITING
+
+def test_put_priorities(queue: qb.QueueBase):
+    """Tests that put honours priorities on queues that support them, and
+    otherwise rejects non-zero priorities without adding any item.
+    """
+    items = {"low": {"data": 1}, "high": {"data": 2}}
+    if queue.supports_priorities:
+        queue.put(items, priorities={"high": 1})
+        assert queue.get(1) == [("high", {"data": 2})]
+        return
+
+    with pytest.raises(ValueError):
+        queue.put(items, priorities={"high": 1})
+    assert queue.size(qb.QueueItemStage.WAITING) == 0
+
+    queue.put(items, priorities={"high": 0})
+    assert queue.get(1) == [("low", {"data": 1})]
+
+def test_requeue_many(queue: qb.QueueBase):
+    """Tests that requeue_many moves failed items and skips the others.
+    """
+    queue.put(default_items)
+    fail_ids = [fail_id for fail_id, _ in queue.get(5)]
+    queue.fail_many(fail_ids)
+
+    requeue_ids = fail_ids[:3]
+    with warnings.catch_warnings(record=True) as warn:
+        queue.requeue_many(requeue_ids + ["BAD_ID"])
+
+    assert len(warn) == 1
+    assert queue.size(qb.QueueItemStage.FAIL) == len(fail_ids) - 3
+    for requeue_id in requeue_ids:
+        assert queue.lookup_status(requeue_id) == qb.QueueItemStage.WAITING
+
+def test_retry_policy(queue: qb.QueueBase):
+    """Tests that failed items are retried after their backoff until they
+    run out of attempts, and that requeue resets their attempts. The queue
+    must retry 3 times with a RETRY_BACKOFF_SEC backoff and no jitter.
+    """
+    queue.put({"item_a": {"data": 1}, "item_b": {"data": 2}})
+    assert len(queue.get(2)) == 2
+
+    assert queue.fail("item_a")
+    assert queue.fail_many(["item_b"]) == ([], ["item_b"])
+    assert queue.lookup_status("item_a") == qb.QueueItemStage.WAITING
+    assert queue.size(qb.QueueItemStage.WAITING) == 2
+    assert sorted(queue.lookup_state(qb.QueueItemStage.WAITING)) == \
+        ["item_a", "item_b"]
+    assert queue.lookup_item("item_b")["item_body"] == {"data": 2}
+    # Not due yet.
+    assert queue.peek(2) == []
+    assert queue.get(2) == []
+    assert queue.get_items(["item_a"]) == []
+
+    wait(queue, RETRY_BACKOFF_SEC + 0.5)
+    assert len(queue.peek(2)) == 2
+    assert sorted(queue.get(2)) == \
+        [("item_a", {"data": 1}), ("item_b", {"data": 2})]
+    assert queue.fail_many(["item_a", "item_b"]) == \
+        ([], ["item_a", "item_b"])
+
+    wait(queue, RETRY_BACKOFF_SEC + 0.5)
+    assert len(queue.get(2)) == 2
+    assert queue.fail_many(["item_a"]) == (["item_a"], [])
+    assert not queue.fail("item_b")
+    assert queue.size(qb.QueueItemStage.FAIL) == 2
+
+    queue.requeue(["item_a"])
+    assert queue.get(1) == [("item_a", {"data": 1})]
+    assert queue.fail("item_a")
+
+def test_leases(queue: qb.QueueBase):
+    """Tests that leased items can be extended, acknowledged and released
+    by their owner only, and go back to WAITING when the lease expires.
+    """
+    queue.put({"item_a": 1, "item_b": 2, "item_c": 3, "item_d": 4})
+    assert len(queue.get(3, lease_owner="owner_1", lease_sec=2)) == 3
+    assert queue.get(1) == [("item_d", 4)]
+    assert queue.expire_leases() == []
+
+    # Only the owner's PROCESSING leases are touched.
+    assert queue.extend_lease(["item_a", "item_d"], "owner_2", 60) == []
+    assert queue.extend_lease(["item_a", "item_d"], "owner_1", 60) == \
+        ["item_a"]
+    assert queue.ack_lease(["item_b"], "owner_2") == []
+    assert queue.ack_lease(["item_b"], "owner_1") == ["item_b"]
+    assert queue.lookup_status("item_b") == qb.QueueItemStage.SUCCESS
+    assert queue.ack_lease(["item_b"], "owner_1") == []
+
+    wait(queue, 2.5)
+    # item_c's lease expired, item_a's was extended and item_d is not
+    # leased.
+    assert queue.expire_leases() == ["item_c"]
+    assert queue.lookup_status("item_c") == qb.QueueItemStage.WAITING
+    assert queue.lookup_status("item_a") == qb.QueueItemStage.PROCESSING
+    assert queue.lookup_status("item_d") == qb.QueueItemStage.PROCESSING
+    assert queue.ack_lease(["item_c"], "owner_1") == []
+    assert queue.size(qb.QueueItemStage.WAITING) == 1
+    assert queue.size(qb.QueueItemStage.PROCESSING) == 2
+
+    assert queue.release_lease(["item_a"], "owner_1") == ["item_a"]
+    assert queue.lookup_status("item_a") == qb.QueueItemStage.WAITING
+    # A new get without a lease leaves the items unleased.
+    assert sorted(queue.get(2)) == [("item_a", 1), ("item_c", 3)]
+    assert queue.extend_lease(["item_a", "item_c"], "owner_1", 60) == []
+
+    # Finishing an item ends its lease.
+    queue.put({"item_e": 5})
+    assert queue.get(1, lease_owner="owner_1", lease_sec=0.1) == \
+        [("item_e", 5)]
+    queue.fail("item_e")
+    wait(queue, 0.2)
+    assert queue.expire_leases() == []
+    assert queue.lookup_status("item_e") == qb.QueueItemStage.FAIL
+
 def test_lookup_state(queue: qb.QueueBase):
     """Tests that lookup_state works as expected with status-based lookup.
     """
@@ -1,7 +1,11 @@
+from unittest import mock
+
 import pytest
 
 from task_queue.job_release_strategy import ResourceLimit
-from task_queue.queues import QueueItemStage
+from task_queue.queues import QueueItemStage, memory_queue
+from task_queue.workers.work_queue import WorkQueue
+from task_queue.workers.queue_worker_interface import DummyWorkerInterface
 
 @pytest.mark.unit
 def test_resource_limit(default_work_queue):
@@ -113,3 +117,148 @@ def test_resource_limit_terminates_when_complete(default_work_queue):
     )
 
     processing_limit_strategy.release_next_jobs(default_work_queue)
+
+
+@pytest.mark.unit
+def test_resource_limit_ledger(default_work_queue):
+    """
+    Test that the resource limit only counts the processing resources from
+    the queue when seeding and reconciling the ledger, and tracks started and
+    finished jobs in between.
+    """
+    processing_limit_strategy = ResourceLimit(
+        {"resource_b": 20},
+        reconcile_interval=3
+    )
+    queue = default_work_queue.queue
+    with mock.patch.object(
+        queue, "sum_resources", wraps=queue.sum_resources
+    ) as sum_resources:
+        processing_limit_strategy.release_next_jobs(default_work_queue)
+        assert sum_resources.call_count == 1
+        assert default_work_queue.get_queue_size(
+            QueueItemStage.PROCESSING
+        ) == 2
+
+        # Finishing a job through the work queue frees its resources without
+        # recounting.
+        item_to_succeed = queue.lookup_state(QueueItemStage.PROCESSING)[0]
+        default_work_queue._interface.mock_success(item_to_succeed)
+        default_work_queue.update_job_status()
+        processing_limit_strategy.release_next_jobs(default_work_queue)
+        assert sum_resources.call_count == 1
+        assert default_work_queue.get_queue_size(
+            QueueItemStage.PROCESSING
+        ) == 2
+
+        # A job finished behind the work queue's back is only noticed when
+        # the ledger is reconciled.
+        queue.success(queue.lookup_state(QueueItemStage.PROCESSING)[0])
+        processing_limit_strategy.release_next_jobs(default_work_queue)
+        assert sum_resources.call_count == 1
+        assert default_work_queue.get_queue_size(
+            QueueItemStage.PROCESSING
+        ) == 1
+
+        processing_limit_strategy.release_next_jobs(default_work_queue)
+        assert sum_resources.call_count == 2
+        assert default_work_queue.get_queue_size(
+            QueueItemStage.PROCESSING
+        ) == 2
+
+
+def mixed_size_work_queue():
+    """Work queue whose head item needs the whole GPU budget, followed by
+    small items.
+    """
+    queue = memory_queue()
+    queue.put({"big": {"resources": {"gpu": 8}}})
+    queue.put({f"small-{i}": {"resources": {"gpu": 1}} for i in range(6)})
+    queue.put({"too-big": {"resources": {"gpu": 9}}})
+    queue.put({"small-6": {"resources": {"gpu": 1}}})
+    return WorkQueue(queue, DummyWorkerInterface())
+
+def processing_ids(work_queue):
+    """Sorted ids of the PROCESSING items.
+    """
+    return sorted(work_queue.queue.lookup_state(QueueItemStage.PROCESSING))
+
+@pytest.mark.unit
+def test_resource_limit_best_fit():
+    """
+    Test that best-fit admission starts the small jobs that fit while the
+    large job at the head of the queue cannot, and never starts a job larger
+    than the limits.
+    """
+    work_queue = mixed_size_work_queue()
+    work_queue.queue.get_items(["small-0"])
+    strategy = ResourceLimit({"gpu": 8}, admission="best-fit")
+
+    # FIFO would start nothing, because "big" does not fit next to "small-0".
+    strategy.release_next_jobs(work_queue)
+    assert processing_ids(work_queue) == \
+        [f"small-{i}" for i in range(7)]
+    assert work_queue.queue.lookup_status("too-big") == \
+        QueueItemStage.WAITING
+
+@pytest.mark.unit
+def test_resource_limit_best_fit_prefers_large_jobs():
+    """
+    Test that best-fit admission packs the largest jobs first.
+    """
+    work_queue = WorkQueue(memory_queue(), DummyWorkerInterface())
+    work_queue.queue.put({
+        "one": {"resources": {"gpu": 1}},
+        "two": {"resources": {"gpu": 2}},
+        "three": {"resources": {"gpu": 3}},
+    })
+    strategy = ResourceLimit({"gpu": 5}, admission="best-fit")
+
+    strategy.release_next_jobs(work_queue)
+
+    assert processing_ids(work_queue) == ["three", "two"]
+
+@pytest.mark.unit
+def test_resource_limit_best_fit_aging():
+    """
+    Test that a job passed over `max_skips` times stops other jobs from
+    starting until it fits.
+    """
+    work_queue = mixed_size_work_queue()
+    work_queue.queue.get_items(["small-0"])
+    strategy = ResourceLimit({"gpu": 8}, admission="best-fit", max_skips=2)
+
+    # "big" is skipped for the first time.
+    strategy.release_next_jobs(work_queue)
+    work_queue.queue.success("small-0")
+    for item_id in processing_ids(work_queue):
+        work_queue._interface.mock_success(item_id)
+    work_queue.update_job_status()
+
+    # "small-7" holds back one GPU so "big" still does not fit, and "big" is
+    # skipped a second time when "small-8" starts.
+    work_queue.queue.put({"small-7": {"resources": {"gpu": 1}}})
+    work_queue.queue.get_items(["small-7"])
+    work_queue.queue.put({"small-8": {"resources": {"gpu": 1}}})
+    strategy.release_next_jobs(work_queue)
+    assert processing_ids(work_queue) == ["small-7", "small-8"]
+
+    # From now on "big" blocks the jobs behind it.
+    work_queue.queue.put({"small-9": {"resources": {"gpu": 1}}})
+    strategy.release_next_jobs(work_queue)
+    assert processing_ids(work_queue) == ["small-7", "small-8"]
+
+    work_queue.queue.success("small-7")
+    work_queue._interface.mock_success("small-8")
+    work_queue.update_job_status()
+    strategy.reconcile()
+    strategy.release_next_jobs(work_queue)
+    assert processing_ids(work_queue) == ["big"]
+
+@pytest.mark.unit
+def test_resource_limit_bad_admission():
+    """
+    Test that an unknown admission mode is rejected.
+    """
+    with pytest.raises(ValueError):
+        ResourceLimit({"gpu": 8}, admission="random")
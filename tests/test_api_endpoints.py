@@ -2,6 +2,7 @@
 """
 import pytest
 import os
+import time
 
 from fastapi.testclient import TestClient
 
@@ -45,6 +46,7 @@ def clean_queue():
             queue.memory_queue.waiting,
             item
         )
+    queue.memory_queue.leases.clear()
 
 @pytest.mark.unit
 @pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
@@ -192,6 +194,43 @@ def test_v1_queue_lookup_state_fail():
     assert response.status_code == 400
     assert response.json() == {"detail": "bad-stage not a Queue Item Stage"}
 
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+def test_v1_queue_lookup_state_page():
+    """Tests that the lookup_state page endpoint pages through a stage.
+    """
+    queue.put(default_items)
+    waiting_ids = sorted(queue.lookup_state(QueueItemStage.WAITING))
+
+    item_ids = []
+    params = {"page_size": 6}
+    while True:
+        response = client.get(
+            "/api/v1/queue/lookup_state/WAITING/page", params=params
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["item_ids"]) <= 6
+        item_ids += page["item_ids"]
+        if page["next_after"] is None:
+            break
+        params["after"] = page["next_after"]
+
+    assert item_ids == waiting_ids
+
+@pytest.mark.unit
+def test_v1_queue_lookup_state_page_fail():
+    """Tests the lookup_state page endpoint failures.
+    """
+    response = client.get("/api/v1/queue/lookup_state/bad-stage/page")
+    assert response.status_code == 400
+    assert response.json() == {"detail": "bad-stage not a Queue Item Stage"}
+
+    response = client.get(
+        "/api/v1/queue/lookup_state/WAITING/page", params={"page_size": 0}
+    )
+    assert response.status_code == 422
+
 @pytest.mark.unit
 @pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
 def test_v1_queue_requeue_list():
@@ -280,6 +319,123 @@ def test_get_success():
     assert len(response.json()) == n
     assert n == processing
 
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+def test_success_fail():
+    """Test moving PROCESSING items to SUCCESS and FAIL, and that items in
+    other stages get a 404.
+    """
+    queue.put(default_items)
+    item_ids = [item_id for item_id, _ in queue.get(2)]
+
+    response = client.post(f"/api/v1/queue/success/{item_ids[0]}")
+    assert response.status_code == 200
+    assert queue.lookup_status(item_ids[0]) == QueueItemStage.SUCCESS
+    response = client.post(f"/api/v1/queue/fail/{item_ids[1]}")
+    assert response.status_code == 200
+    retried = response.json()
+    assert queue.lookup_status(item_ids[1]) == (
+        QueueItemStage.WAITING if retried else QueueItemStage.FAIL
+    )
+
+    response = client.post(f"/api/v1/queue/success/{item_ids[0]}")
+    assert response.status_code == 404
+    assert response.json() == \
+        {"detail": f"{item_ids[0]} not in PROCESSING"}
+    response = client.post("/api/v1/queue/fail/bad-item-id")
+    assert response.status_code == 404
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+def test_get_with_lease():
+    """Test leasing items through get, then extending, acknowledging and
+    releasing their leases.
+    """
+    queue.put(default_items)
+    response = client.get(
+        "/api/v1/queue/get/3",
+        params={"lease_owner": "consumer", "lease_sec": 60}
+    )
+    assert response.status_code == 200
+    leased_ids = [item_id for item_id, _ in response.json()]
+
+    lease = {"item_ids": leased_ids, "lease_owner": "other"}
+    response = client.post("/api/v1/queue/lease/ack", json=lease)
+    assert response.status_code == 200
+    assert response.json() == []
+
+    lease = {"item_ids": leased_ids, "lease_owner": "consumer"}
+    response = client.post(
+        "/api/v1/queue/lease/extend", json={**lease, "lease_sec": 120}
+    )
+    assert response.json() == leased_ids
+
+    lease["item_ids"] = leased_ids[:1]
+    response = client.post("/api/v1/queue/lease/ack", json=lease)
+    assert response.json() == leased_ids[:1]
+    assert queue.lookup_status(leased_ids[0]) == QueueItemStage.SUCCESS
+
+    lease["item_ids"] = leased_ids[1:]
+    response = client.post("/api/v1/queue/lease/release", json=lease)
+    assert response.json() == leased_ids[1:]
+    assert queue.size(QueueItemStage.PROCESSING) == 0
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+def test_expire_leases():
+    """Test that expired leases are sent back to WAITING.
+    """
+    queue.put(default_items)
+    response = client.get(
+        "/api/v1/queue/get/1",
+        params={"lease_owner": "consumer", "lease_sec": 0.01}
+    )
+    leased_ids = [item_id for item_id, _ in response.json()]
+    time.sleep(0.02)
+
+    response = client.post("/api/v1/queue/lease/expire")
+    assert response.status_code == 200
+    assert response.json() == leased_ids
+    assert queue.size(QueueItemStage.PROCESSING) == 0
+
+@pytest.mark.unit
+@pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+def test_get_items():
+    """Test getting WAITING items by ID.
+    """
+    queue.put(default_items)
+    item_ids = list(default_items)[:2]
+    response = client.post("/api/v1/queue/get_items",
+                           json=item_ids + ["bad-item-id"])
+    assert response.status_code == 200
+    assert [item_id for item_id, _ in response.json()] == item_ids
+    assert queue.size(QueueItemStage.PROCESSING) == 2
+
+    leased_id = list(default_items)[2]
+    response = client.post("/api/v1/queue/get_items", json=[leased_id],
+                           params={"lease_owner": "consumer", "lease_sec": 60})
+    assert response.status_code == 200
+    assert queue.extend_lease([leased_id], "consumer", 60) == [leased_id]
+
+    response = client.post("/api/v1/queue/get_items", json=[],
+                           params={"lease_sec": 60})
+    assert response.status_code == 400
+
+@pytest.mark.unit
+def test_get_with_lease_fail():
+    """Test that a lease needs an owner and a positive duration.
+    """
+    response = client.get("/api/v1/queue/get/1", params={"lease_sec": 60})
+    assert response.status_code == 400
+    assert response.json() == \
+        {"detail": "lease_owner is required with lease_sec"}
+
+    response = client.post(
+        "/api/v1/queue/lease/extend",
+        json={"item_ids": [], "lease_owner": "consumer", "lease_sec": 0}
+    )
+    assert response.status_code == 422
+
 @pytest.mark.unit
 @pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
 def test_put_valid_items():
@@ -287,6 +443,29 @@ def test_put_valid_items():
     assert queue.size(QueueItemStage.WAITING) == len(default_items)
     assert response.status_code == 200
 
+@pytest.mark.unit
+def test_put_with_priorities():
+    """Test that the in-memory queue behind the API rejects priorities.
+    """
+    new_items = dict([qtest.random_item() for _ in range(2)])
+    total_items_before = queue.size(QueueItemStage.WAITING)
+    response = client.post(
+        "/api/v1/queue/put/priorities",
+        json={"items": new_items,
+              "priorities": {next(iter(new_items)): 1}}
+    )
+    assert response.status_code == 400
+    assert response.json() == \
+        {"detail": "InMemoryQueue does not support priorities."}
+    assert queue.size(QueueItemStage.WAITING) == total_items_before
+
+    response = client.post(
+        "/api/v1/queue/put/priorities",
+        json={"items": new_items, "priorities": {}}
+    )
+    assert response.status_code == 200
+    assert queue.size(QueueItemStage.WAITING) == total_items_before + 2
+
 @pytest.mark.unit
 def test_put_invalid_items():
     total_items_before = queue.size(QueueItemStage.WAITING)
@@ -1,7 +1,11 @@
 """Pytests for argo workflow queue worker.
 """
+import io
+import json
 import random
+import threading
 import time
+from unittest import mock
 import requests
 
 import pytest
@@ -9,6 +13,8 @@ import pytest
 from task_queue.workers.argo_workflows_queue_worker import (
                                                     ArgoWorkflowsQueueWorker)
 from task_queue.queues.queue_base import QueueItemStage
+from task_queue.wakeup import WakeupTrigger
+from task_queue.workers.log_archiver import LogArchiver, LogSink
 from .test_config import TaskQueueTestSettings
 
 run_argo_tests = TaskQueueTestSettings().run_argo_tests
@@ -265,3 +271,396 @@ def test_argo_worker_get_name_with_other_workflows(execution_number):
     submit_non_queue_workflow(worker)
 
     worker._get_workflow_name(queue_item_id)
+
+def watch_event(event_type, completed):
+    """Creates a workflow event stream line.
+    """
+    return json.dumps({
+        "result": {
+            "type": event_type,
+            "object": {
+                "metadata": {
+                    "labels": {
+                        "workflows.argoproj.io/completed": completed
+                    }
+                }
+            }
+        }
+    }).encode()
+
+@pytest.mark.unit
+def test_argo_worker_watch_wakes_on_completion():
+    """Tests that the event watch only wakes the trigger for workflows that
+    have completed.
+    """
+    worker = port_forwarded_worker()
+    trigger = WakeupTrigger(debounce_sec=0)
+
+    def stream(lines):
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_lines.return_value = lines
+        return response
+
+    responses = [
+        stream([
+            watch_event("ADDED", "false"),
+            b"",
+            watch_event("MODIFIED", "false"),
+        ]),
+        stream([watch_event("MODIFIED", "true")]),
+    ]
+    with mock.patch.object(
+        worker._session,
+        "get",
+        side_effect=lambda *args, **kwargs: responses.pop(0)
+    ) as get:
+        worker.start_watch(trigger, reconnect_sec=0.5)
+        assert trigger.wait(10)
+        worker.stop_watch()
+
+    assert get.call_count == 2
+    assert get.call_args.kwargs["stream"]
+    assert "workflow-events" in get.call_args.args[0]
+
+@pytest.mark.unit
+def test_argo_worker_session_retries():
+    """Tests that the worker reuses a pooled session that retries reads and
+    deletes but not submissions.
+    """
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker",
+        "http://localhost:2746",
+        "pivot",
+        pool_size=4,
+        max_retries=5,
+        retry_backoff=0.1
+    )
+
+    adapter = worker._session.get_adapter("http://localhost:2746")
+    assert adapter._pool_maxsize == 4
+    retry = adapter.max_retries
+    assert retry.total == 5
+    assert retry.backoff_factor == 0.1
+    assert 503 in retry.status_forcelist
+    assert retry.is_retry("GET", 503)
+    assert retry.is_retry("DELETE", 429)
+    assert not retry.is_retry("POST", 503)
+
+def listed_workflow(worker, item_id, name, created, completed="true"):
+    """Creates a workflow as returned by the workflow list endpoint.
+    """
+    return {
+        "metadata": {
+            "name": name,
+            "creationTimestamp": created,
+            "labels": {
+                worker.WORK_QUEUE_ID_LABEL: worker._worker_interface_id,
+                worker.WORK_QUEUE_ITEM_ID_LABEL: item_id,
+                "workflows.argoproj.io/completed": completed,
+                "workflows.argoproj.io/phase": "Succeeded",
+            }
+        }
+    }
+
+@pytest.mark.unit
+def test_argo_worker_delete_uses_cached_name():
+    """Tests that polling caches the newest workflow name of each item, and
+    that deleting a job then makes no lookup request.
+    """
+    worker = port_forwarded_worker()
+    poll_response = mock.MagicMock()
+    poll_response.json.return_value = {"items": [
+        listed_workflow(worker, "item-a", "wf-old", "2024-01-01T00:00:00Z"),
+        listed_workflow(worker, "item-a", "wf-new", "2024-01-02T00:00:00Z"),
+        listed_workflow(worker, "item-b", "wf-b", "2024-01-01T00:00:00Z",
+                        completed="false"),
+    ]}
+
+    with mock.patch.object(worker._session, "get") as get, \
+        mock.patch.object(worker._session, "delete") as delete:
+        get.return_value = poll_response
+        assert worker.poll_all_status() == {
+            "item-a": QueueItemStage.SUCCESS,
+            "item-b": QueueItemStage.PROCESSING,
+        }
+
+        get.reset_mock()
+        get.return_value = mock.MagicMock(text="log")
+        worker.delete_job("item-a")
+
+    # Only the three log requests, no workflow lookups.
+    assert get.call_count == 3
+    assert all("wf-new" in call.args[0] for call in get.call_args_list)
+    assert delete.call_args.args[0].endswith("/wf-new")
+    assert worker._workflow_names == {"item-b": "wf-b"}
+
+def workflow_event(event_type, workflow, resource_version):
+    """Creates a workflow event stream line carrying a listed workflow.
+    """
+    workflow["metadata"]["resourceVersion"] = resource_version
+    return json.dumps(
+        {"result": {"type": event_type, "object": workflow}}
+    ).encode()
+
+@pytest.mark.unit
+def test_argo_worker_incremental_poll():
+    """Tests that the incremental poll lists the workflows in pages once,
+    then updates the statuses from the event stream, and lists again when
+    the stream reports the resourceVersion expired.
+    """
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker",
+        "http://localhost:2746",
+        "pivot",
+        incremental_poll=True,
+        list_page_size=1
+    )
+    trigger = WakeupTrigger(debounce_sec=0)
+    worker.start_watch(trigger, reconnect_sec=0.1)
+
+    first_page = mock.MagicMock(status_code=200)
+    first_page.json.return_value = {
+        "items": [listed_workflow(
+            worker, "item-a", "wf-a", "2024-01-01T00:00:00Z",
+            completed="false"
+        )],
+        "metadata": {"continue": "token"}
+    }
+    second_page = mock.MagicMock(status_code=200)
+    second_page.json.return_value = {
+        "items": [listed_workflow(
+            worker, "item-b", "wf-b", "2024-01-01T00:00:00Z",
+            completed="false"
+        )],
+        "metadata": {"resourceVersion": "10"}
+    }
+    events = mock.MagicMock(status_code=200)
+    events.__enter__.return_value = events
+    events_sent = threading.Event()
+    events_read = threading.Event()
+    def event_lines():
+        events_sent.wait(10)
+        yield workflow_event("MODIFIED", listed_workflow(
+            worker, "item-a", "wf-a", "2024-01-01T00:00:00Z"
+        ), "11")
+        yield workflow_event("DELETED", listed_workflow(
+            worker, "item-b", "wf-b", "2024-01-01T00:00:00Z"
+        ), "12")
+        events_read.set()
+        yield json.dumps({"error": {"http_code": 410}}).encode()
+    events.iter_lines.return_value = event_lines()
+    relist = mock.MagicMock(status_code=200)
+    relist.json.return_value = {
+        "items": [], "metadata": {"resourceVersion": "20"}
+    }
+    expired = mock.MagicMock(status_code=410)
+    expired.__enter__.return_value = expired
+
+    responses = [first_page, second_page, events, relist, expired]
+    with mock.patch.object(
+        worker._session,
+        "get",
+        side_effect=lambda *args, **kwargs: responses.pop(0)
+    ) as get:
+        assert worker.poll_all_status() == {
+            "item-a": QueueItemStage.PROCESSING,
+            "item-b": QueueItemStage.PROCESSING,
+        }
+        assert get.call_args_list[1].kwargs["params"][
+            "listOptions.continue"
+        ] == "token"
+
+        events_sent.set()
+        assert events_read.wait(10)
+        assert trigger.wait(10)
+        worker._cache_thread.join(10)
+        assert get.call_args_list[2].kwargs["params"][
+            "listOptions.resourceVersion"
+        ] == "10"
+        assert worker._cached_workflows.keys() == {"wf-a"}
+
+        # The stream error expired the cache, so the next poll relists.
+        assert worker.poll_all_status() == {}
+        worker._cache_thread.join(10)
+        assert get.call_args_list[4].kwargs["params"][
+            "listOptions.resourceVersion"
+        ] == "20"
+        worker.stop_watch()
+
+@pytest.mark.unit
+def test_argo_worker_incremental_poll_stale():
+    """Tests that the event stream has a finite timeout, that a failed
+    stream marks the cache stale so the next poll lists every workflow, and
+    that the cache is listed again once it is CACHE_RELIST_SEC old.
+    """
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker",
+        "http://localhost:2746",
+        "pivot",
+        incremental_poll=True
+    )
+
+    def listing(resource_version):
+        response = mock.MagicMock(status_code=200)
+        response.json.return_value = {
+            "items": [listed_workflow(
+                worker, "item-a", "wf-a", "2024-01-01T00:00:00Z"
+            )],
+            "metadata": {"resourceVersion": resource_version}
+        }
+        return response
+
+    expired = mock.MagicMock(status_code=410)
+    expired.__enter__.return_value = expired
+    responses = [
+        listing("10"),
+        requests.exceptions.ReadTimeout("stream stalled"),
+        listing("20"),
+        expired,
+        listing("30"),
+        expired,
+    ]
+
+    def get(*args, **kwargs):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    with mock.patch.object(worker._session, "get", side_effect=get) as mget:
+        assert worker.poll_all_status() == {
+            "item-a": QueueItemStage.SUCCESS
+        }
+        worker._cache_thread.join(10)
+        watch_call = mget.call_args_list[1]
+        assert watch_call.kwargs["timeout"] == \
+            (10, worker.WATCH_READ_TIMEOUT_SEC)
+        assert watch_call.kwargs["params"][
+            "listOptions.timeoutSeconds"
+        ] == str(worker.WATCH_TIMEOUT_SEC)
+        assert worker._resource_version is None
+
+        # The failed stream made the cache stale, so the poll relists.
+        worker.poll_all_status()
+        worker._cache_thread.join(10)
+        assert mget.call_count == 4
+        assert mget.call_args_list[3].kwargs["params"][
+            "listOptions.resourceVersion"
+        ] == "20"
+
+        # An old cache is relisted even if the stream is healthy.
+        worker._resource_version = "20"
+        worker._cache_listed_at -= worker.CACHE_RELIST_SEC + 1
+        worker.poll_all_status()
+        worker._cache_thread.join(10)
+        assert mget.call_count == 6
+        assert mget.call_args_list[5].kwargs["params"][
+            "listOptions.resourceVersion"
+        ] == "30"
+        worker.stop_watch()
+
+class MemoryLogSink(LogSink):
+    """Keeps archived logs in a dictionary.
+    """
+    def __init__(self):
+        self.logs = {}
+
+    def open_log(self, item_id, container):
+        sink = self
+
+        class MemoryLogFile(io.BytesIO):
+            def close(self):
+                sink.logs[(item_id, container)] = self.getvalue()
+                super().close()
+
+        return MemoryLogFile()
+
+@pytest.mark.unit
+def test_argo_worker_archives_logs_in_background():
+    """Tests that delete_job returns without downloading logs, and that the
+    archiver streams them to its sink before deleting the workflow.
+    """
+    sink = MemoryLogSink()
+    archiver = LogArchiver(sink, n_workers=1)
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker", "http://localhost:2746", "pivot",
+        log_archiver=archiver
+    )
+    worker._workflow_names["item-a"] = "wf-a"
+
+    downloads = threading.Event()
+    def log_response(url, **kwargs):
+        assert kwargs["stream"]
+        downloads.wait(10)
+        response = mock.MagicMock()
+        response.__enter__.return_value = response
+        response.iter_content.return_value = [b"log of ", url.encode()]
+        return response
+
+    with mock.patch.object(worker._session, "get",
+                           side_effect=log_response), \
+        mock.patch.object(worker._session, "delete") as delete:
+        worker.delete_job("item-a")
+        assert not delete.called
+
+        downloads.set()
+        archiver.join()
+        delete.assert_called_once()
+
+    assert delete.call_args.args[0].endswith("/wf-a")
+    assert sorted(container for _, container in sink.logs) == \
+        ["init", "main", "wait"]
+    assert sink.logs[("item-a", "main")].startswith(b"log of ")
+    archiver.close()
+
+@pytest.mark.unit
+def test_argo_worker_delete_jobs_concurrently():
+    """Tests that delete_jobs deletes workflows concurrently, attempts every
+    job and raises the first error afterwards.
+    """
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker", "http://localhost:2746", "pivot", pool_size=4
+    )
+    item_ids = [f"item-{i}" for i in range(8)]
+    for item_id in item_ids:
+        worker._workflow_names[item_id] = f"wf-{item_id}"
+
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    def delete(url, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        response = mock.MagicMock()
+        if url.endswith("wf-item-3"):
+            response.raise_for_status.side_effect = requests.HTTPError()
+        return response
+
+    with mock.patch.object(worker._session, "get",
+                           return_value=mock.MagicMock(text="log")), \
+        mock.patch.object(worker._session, "delete",
+                          side_effect=delete) as delete_mock:
+        with pytest.raises(requests.HTTPError):
+            worker.delete_jobs(item_ids)
+
+    assert delete_mock.call_count == 8
+    assert 1 < in_flight[1] <= 4
+    assert worker._workflow_names == {"item-3": "wf-item-3"}
+
+@pytest.mark.unit
+def test_argo_worker_close_closes_archiver():
+    """Tests that closing the worker stops the watch and waits for the log
+    archiver to save the logs it was given.
+    """
+    archiver = mock.MagicMock(spec=LogArchiver)
+    worker = ArgoWorkflowsQueueWorker(
+        "test-worker", "http://localhost:2746", "pivot",
+        log_archiver=archiver
+    )
+    worker.close()
+    assert worker._watch_stop.is_set()
+    archiver.close.assert_called_once_with()
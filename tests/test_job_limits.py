@@ -0,0 +1,54 @@
+"""Pytests for the process worker job limits.
+"""
+import pytest
+
+from task_queue.workers.job_limits import (
+    CoreAllocator,
+    cores_needed,
+    create_job_cgroup,
+    remove_job_cgroup
+)
+
+
+@pytest.mark.unit
+def test_core_allocator_disjoint():
+    """Tests that allocated core sets do not overlap and come back when
+    released.
+    """
+    allocator = CoreAllocator(cores=range(4))
+
+    first = allocator.allocate(2)
+    second = allocator.allocate(2)
+    assert first == {0, 1}
+    assert second == {2, 3}
+    assert allocator.allocate(1) is None
+
+    allocator.release(first)
+    assert allocator.free_cores == {0, 1}
+    assert allocator.allocate(3) is None
+    assert allocator.allocate(1) == {0}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("cpu, expected", [(0.25, 1), (1, 1), (2.5, 3)])
+def test_cores_needed(cpu, expected):
+    """Tests that fractional CPUs round up to whole cores.
+    """
+    assert cores_needed(cpu) == expected
+
+
+@pytest.mark.unit
+def test_create_job_cgroup(tmp_path):
+    """Tests the limits written to a job's cgroup. A plain directory stands
+    in for the cgroup filesystem.
+    """
+    path = create_job_cgroup(str(tmp_path), "job-1", cpu=1.5,
+                             memory_bytes=1024)
+
+    assert (tmp_path / "job-1" / "cpu.max").read_text() == "150000 100000"
+    assert (tmp_path / "job-1" / "memory.max").read_text() == "1024"
+
+    for name in ("cpu.max", "memory.max"):
+        (tmp_path / "job-1" / name).unlink()
+    remove_job_cgroup(path)
+    assert not (tmp_path / "job-1").exists()
@@ -0,0 +1,67 @@
+"""Pytests for the lease sweeper.
+"""
+import threading
+import time
+
+import pytest
+
+from task_queue.queues import LeaseSweeper, QueueItemStage, memory_queue
+
+
+@pytest.mark.unit
+def test_lease_sweeper():
+    """Tests that the sweeper thread returns items with expired leases to
+    WAITING, and stops when asked.
+    """
+    queue = memory_queue()
+    queue.put({"item": {"data": 1}})
+    queue.get(1, lease_owner="consumer", lease_sec=0.1)
+
+    sweeper = LeaseSweeper(queue, interval_sec=0.05)
+    sweeper.start()
+    try:
+        deadline = time.monotonic() + 2
+        while queue.lookup_status("item") != QueueItemStage.WAITING:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+    finally:
+        sweeper.stop()
+
+@pytest.mark.unit
+def test_in_memory_queue_lock():
+    """Tests that the in-memory queue waits for its lock, so a sweep does not
+    run in the middle of another call.
+    """
+    queue = memory_queue()
+    queue.put({"item": {"data": 1}})
+
+    with queue.lock:
+        getter = threading.Thread(target=queue.get, args=(1,))
+        getter.start()
+        getter.join(0.1)
+        assert getter.is_alive()
+        assert queue.lookup_status("item") == QueueItemStage.WAITING
+    getter.join()
+    assert queue.lookup_status("item") == QueueItemStage.PROCESSING
+
+@pytest.mark.unit
+def test_lease_sweeper_survives_errors():
+    """Tests that a failed sweep does not stop the thread.
+    """
+    class FlakyQueue:
+        """Queue whose first sweep fails."""
+        def __init__(self):
+            self.calls = 0
+
+        def expire_leases(self):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("database unavailable")
+            return []
+
+    queue = FlakyQueue()
+    sweeper = LeaseSweeper(queue, interval_sec=0.02)
+    sweeper.start()
+    time.sleep(0.2)
+    sweeper.stop()
+    assert queue.calls > 1
@@ -0,0 +1,99 @@
+"""Pytests for the log archiver.
+"""
+import os
+import threading
+
+import pytest
+
+from task_queue.workers.log_archiver import (
+    LogArchiver,
+    LoggerLogSink,
+    DirectoryLogSink,
+    safe_file_name
+)
+
+
+@pytest.mark.unit
+def test_log_archiver_directory_sink(tmp_path):
+    """Test that logs are written to one file per container, cut at the
+    size cap, and that on_done runs after they are written.
+    """
+    archiver = LogArchiver(
+        DirectoryLogSink(str(tmp_path)), n_workers=2, max_log_bytes=10
+    )
+    done = []
+
+    def fetch_logs():
+        yield "main", [b"12345", b"67890", b"abcde"]
+        yield "init", iter([b"short"])
+
+    assert archiver.submit(
+        "item/1",
+        fetch_logs,
+        on_done=lambda: done.append((tmp_path / "item_1" / "init.log")
+                                    .read_bytes())
+    )
+    archiver.join()
+
+    main_log = (tmp_path / "item_1" / "main.log").read_bytes()
+    assert main_log.startswith(b"1234567890\n[log truncated at 10 bytes]")
+    assert done == [b"short"]
+    archiver.close()
+
+@pytest.mark.unit
+def test_directory_sink_stays_in_directory(tmp_path):
+    """Test that item IDs and container names cannot lead the directory
+    sink out of its directory, even through a symlink.
+    """
+    log_dir = tmp_path / "logs"
+    sink = DirectoryLogSink(str(log_dir))
+    assert safe_file_name("..") == "_.."
+    assert safe_file_name("../../etc") == ".._.._etc"
+
+    with sink.open_log("..", "../main") as log_file:
+        log_file.write(b"log")
+    assert (log_dir / "_.." / ".._main.log").read_bytes() == b"log"
+    assert list(tmp_path.iterdir()) == [log_dir]
+
+    os.symlink(tmp_path, log_dir / "linked")
+    with pytest.raises(ValueError):
+        sink.open_log("linked", "..")
+
+@pytest.mark.unit
+def test_log_archiver_logger_sink(caplog):
+    """Test that the logger sink logs each container log.
+    """
+    archiver = LogArchiver(LoggerLogSink(), n_workers=1)
+    archiver.submit("item-1", lambda: [("main", [b"hello ", b"world"])])
+    archiver.close()
+
+    assert "Container: main: 'hello world'" in caplog.text
+
+@pytest.mark.unit
+def test_log_archiver_full_and_errors():
+    """Test that submit refuses jobs when the queue is full, and that a
+    failed archive still calls on_done.
+    """
+    release = threading.Event()
+    archiver = LogArchiver(LoggerLogSink(), n_workers=1, max_pending=1)
+    done = []
+
+    def slow_logs():
+        release.wait(10)
+        return []
+
+    def broken_logs():
+        raise RuntimeError("Logs are gone")
+
+    assert archiver.submit("slow", slow_logs)
+    # Wait for the worker to take the slow job, freeing the queue.
+    while archiver._jobs.qsize():
+        release.wait(0.01)
+    assert archiver.submit(
+        "broken", broken_logs, on_done=lambda: done.append(1)
+    )
+    assert not archiver.submit("refused", slow_logs)
+
+    release.set()
+    archiver.close()
+    assert done == [1]
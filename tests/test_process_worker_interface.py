@@ -1,12 +1,18 @@
 """Pytests for process queue worker.
 """
+import multiprocessing
+import os
 import random
 import pytest
 import time
 from pydantic import ValidationError
 
-from task_queue.workers.process_queue_worker import ProcessQueueWorker
+from task_queue.workers.process_queue_worker import (
+    ProcessQueueWorker,
+    run_script_process
+)
 from task_queue.queues.queue_base import QueueItemStage
+from task_queue.wakeup import WakeupTrigger
 
 @pytest.fixture(scope="module")
 def temp_dir(tmp_path_factory):
@@ -199,3 +205,370 @@ def test_process_worker_end_to_end_concurrent(
     assert sum(s == QueueItemStage.SUCCESS for s in statuses) == \
         n_processes - n_fail
     assert sum(s == QueueItemStage.FAIL for s in statuses) == n_fail
+
+@pytest.mark.unit
+def test_process_worker_wakeup_on_exit(temp_dir, temp_script_good):
+    """Tests that the wakeup trigger is notified when a job process exits.
+    """
+    trigger = WakeupTrigger(debounce_sec=0)
+    worker = ProcessQueueWorker(temp_dir, wakeup_trigger=trigger)
+
+    queue_item_id, queue_item_body = make_queue_item()
+    worker.send_job(queue_item_id, queue_item_body)
+
+    assert trigger.wait(30)
+    assert wait_for_finish(worker, queue_item_id) == QueueItemStage.SUCCESS
+
+@pytest.fixture(scope="module")
+def temp_script_entry_point(temp_dir):
+    """Create python script with a run(args) entry point, counting how many
+    times it was imported in the current interpreter.
+    """
+    temp_file = temp_dir / "my_entry_point.py"
+    temp_file.write_text(
+        "import os\n"
+        "import sys\n"
+        "IMPORTS = int(os.environ.get('TEST_IMPORTS', '0')) + 1\n"
+        "os.environ['TEST_IMPORTS'] = str(IMPORTS)\n"
+        "def run(args):\n"
+        "    print('imports', IMPORTS)\n"
+        "    if args and args[0] == 'exit':\n"
+        "        sys.exit(3)\n"
+        "    if args and args[0] == 'stderr':\n"
+        "        print('warning', file=sys.stderr)\n"
+        "    if args and args[0] == 'raise':\n"
+        "        raise ValueError('bad input')\n"
+    )
+    return temp_file
+
+@pytest.fixture(scope="module")
+def pool_worker(temp_dir):
+    """Creates process worker interface in pool mode used for testing."""
+    worker = ProcessQueueWorker(temp_dir, mode="pool", pool_size=1)
+    yield worker
+    worker.close()
+
+@pytest.mark.unit
+@pytest.mark.parametrize("args, expected", [
+    ([], QueueItemStage.SUCCESS),
+    (["exit"], QueueItemStage.FAIL),
+    (["stderr"], QueueItemStage.FAIL),
+    (["raise"], QueueItemStage.FAIL),
+])
+def test_process_worker_pool(pool_worker, temp_script_entry_point,
+                             args, expected):
+    """Test that pool jobs map to SUCCESS and FAIL like process jobs.
+    """
+    queue_item_id = f"test-item-{random.randint(0, 9999999)}"
+    pool_worker.send_job(
+        queue_item_id,
+        {"file_name": "my_entry_point.py", "args": args}
+    )
+
+    assert wait_for_finish(pool_worker, queue_item_id) == expected
+
+@pytest.mark.unit
+def test_process_worker_pool_imports_once(pool_worker,
+                                          temp_script_entry_point, caplog):
+    """Test that the pool interpreter imports a script once for many jobs.
+    """
+    item_ids = [f"test-item-{random.randint(0, 9999999)}" for _ in range(3)]
+    for queue_item_id in item_ids:
+        pool_worker.send_job(
+            queue_item_id,
+            {"file_name": "my_entry_point.py", "args": None}
+        )
+    for queue_item_id in item_ids:
+        assert wait_for_finish(pool_worker, queue_item_id) == \
+            QueueItemStage.SUCCESS
+
+    assert "imports 1" in caplog.text
+    assert "imports 2" not in caplog.text
+
+@pytest.mark.unit
+def test_process_worker_bad_mode(temp_dir):
+    """Test that unknown modes are rejected.
+    """
+    with pytest.raises(ValueError):
+        ProcessQueueWorker(temp_dir, mode="threads")
+
+@pytest.mark.unit
+def test_process_worker_popen(temp_dir, tmp_path, temp_script_good,
+                              temp_script_bad):
+    """Test that popen jobs run as direct children, write their output to
+    log files and map to SUCCESS and FAIL like process jobs.
+    """
+    trigger = WakeupTrigger(debounce_sec=0)
+    worker = ProcessQueueWorker(
+        temp_dir, wakeup_trigger=trigger, mode="popen", log_dir=str(tmp_path)
+    )
+
+    good_id, good_body = make_queue_item()
+    bad_id, bad_body = make_queue_item(fail=True)
+    worker.send_job(good_id, good_body)
+    worker.send_job(bad_id, bad_body)
+
+    assert trigger.wait(30)
+    assert wait_for_finish(worker, good_id) == QueueItemStage.SUCCESS
+    assert wait_for_finish(worker, bad_id) == QueueItemStage.FAIL
+    assert worker.poll_all_status() == {}
+
+    assert (tmp_path / f"{bad_id}.stderr.log").read_text() != ""
+    assert (tmp_path / f"{good_id}.stderr.log").read_text() == ""
+
+@pytest.mark.unit
+def test_process_worker_popen_exit_code(temp_dir, tmp_path,
+                                        temp_script_good):
+    """Test that a popen job exiting with a non-zero code fails.
+    """
+    worker = ProcessQueueWorker(temp_dir, mode="popen", log_dir=str(tmp_path))
+
+    queue_item_id, _ = make_queue_item()
+    worker.send_job(
+        queue_item_id, {"file_name": "my_script.py", "args": ["other"]}
+    )
+
+    assert wait_for_finish(worker, queue_item_id) == QueueItemStage.FAIL
+
+@pytest.mark.unit
+def test_process_worker_popen_stderr(temp_dir, tmp_path):
+    """Test that a popen job writing to stderr and exiting with 0 succeeds.
+    """
+    (temp_dir / "warn_script.py").write_text(
+        "import sys\nprint('warning', file=sys.stderr)\n"
+    )
+    worker = ProcessQueueWorker(temp_dir, mode="popen", log_dir=str(tmp_path))
+
+    queue_item_id, _ = make_queue_item()
+    worker.send_job(queue_item_id, {"file_name": "warn_script.py"})
+
+    assert wait_for_finish(worker, queue_item_id) == QueueItemStage.SUCCESS
+    assert (tmp_path / f"{queue_item_id}.stderr.log").read_text() == \
+        "warning\n"
+
+@pytest.mark.unit
+def test_process_worker_popen_log_retention(temp_dir, tmp_path,
+                                            temp_script_good):
+    """Test that only the log files of the last deleted popen jobs are kept.
+    """
+    worker = ProcessQueueWorker(
+        temp_dir, mode="popen", log_dir=str(tmp_path), log_retention=2
+    )
+
+    item_ids = [f"test-item-{i}" for i in range(3)]
+    for queue_item_id in item_ids:
+        worker.send_job(queue_item_id, make_queue_item()[1])
+        assert wait_for_finish(worker, queue_item_id) == \
+            QueueItemStage.SUCCESS
+
+    assert sorted(os.listdir(tmp_path)) == [
+        f"{queue_item_id}.{stream}.log"
+        for queue_item_id in item_ids[1:]
+        for stream in ("stderr", "stdout")
+    ]
+
+@pytest.mark.unit
+def test_process_worker_close_stops_watcher(temp_dir, tmp_path):
+    """Test that closing a popen worker stops its child watcher thread.
+    """
+    worker = ProcessQueueWorker(
+        temp_dir, wakeup_trigger=WakeupTrigger(debounce_sec=0),
+        mode="popen", log_dir=str(tmp_path)
+    )
+    # pylint: disable=protected-access
+    watcher = worker._child_watcher
+    thread = watcher._thread
+
+    worker.close()
+    assert worker._child_watcher is None
+    assert thread is None or not thread.is_alive()
+    worker.close()
+
+@pytest.mark.unit
+def test_run_script_process_spawn(temp_dir, temp_script_good):
+    """Test that the process target runs under the spawn start method,
+    which pickles the target and its arguments.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    p = ctx.Process(
+        target=run_script_process,
+        args=("test-item", str(temp_script_good), ["arg1"], None)
+    )
+    p.start()
+    p.join(60)
+    assert p.exitcode == 0
+
+@pytest.fixture(scope="module")
+def temp_script_resources(temp_dir):
+    """Create a script that prints its cores and allocates the megabytes
+    given as its argument."""
+    temp_file = temp_dir / "resource_script.py"
+    temp_file.write_text(
+        "import os, sys\n"
+        "print(sorted(os.sched_getaffinity(0)))\n"
+        "data = bytearray(int(sys.argv[1]) * 1024 * 1024)\n"
+    )
+    return temp_file
+
+@pytest.mark.unit
+@pytest.mark.parametrize("mode", ["process", "popen"])
+def test_process_worker_memory_limit(temp_dir, tmp_path,
+                                     temp_script_resources, mode):
+    """Test that a job allocating more than its memory_mb fails, and one
+    staying under it succeeds.
+    """
+    worker = ProcessQueueWorker(temp_dir, mode=mode, log_dir=str(tmp_path),
+                                enforce_resources=True)
+
+    small_id, _ = make_queue_item()
+    large_id, _ = make_queue_item()
+    worker.send_job(small_id, {"file_name": "resource_script.py",
+                               "args": ["10"],
+                               "resources": {"memory_mb": 200}})
+    worker.send_job(large_id, {"file_name": "resource_script.py",
+                               "args": ["1000"],
+                               "resources": {"memory_mb": 200}})
+
+    assert wait_for_finish(worker, small_id) == QueueItemStage.SUCCESS
+    assert wait_for_finish(worker, large_id) == QueueItemStage.FAIL
+
+@pytest.mark.unit
+def test_process_worker_pins_cores(temp_dir, tmp_path,
+                                   temp_script_resources):
+    """Test that a job declaring cpu runs on cores no other job holds, that
+    the cores are freed when it finishes, and that a job whose cores are
+    held waits for them.
+    """
+    worker = ProcessQueueWorker(temp_dir, mode="popen", log_dir=str(tmp_path),
+                                enforce_resources=True)
+    all_cores = worker._core_allocator.free_cores
+
+    queue_item_id, _ = make_queue_item()
+    worker.send_job(queue_item_id, {"file_name": "resource_script.py",
+                                    "args": ["1"],
+                                    "resources": {"cpu": 0.5}})
+    held = all_cores - worker._core_allocator.free_cores
+    assert len(held) == 1
+
+    # A job needing more cores than are free waits for them.
+    worker.send_job("waiting", {"file_name": "resource_script.py",
+                                "args": ["1"],
+                                "resources": {"cpu": len(all_cores)}})
+    assert worker.poll_all_status()["waiting"] == QueueItemStage.PROCESSING
+    # A job needing more cores than the worker has can never start.
+    with pytest.raises(RuntimeError):
+        worker.send_job("too-big", {"file_name": "resource_script.py",
+                                    "args": ["1"],
+                                    "resources": {"cpu": len(all_cores) + 1}})
+
+    assert wait_for_finish(worker, queue_item_id) == QueueItemStage.SUCCESS
+    assert (tmp_path / f"{queue_item_id}.stdout.log").read_text() \
+        == f"{sorted(held)}\n"
+    assert wait_for_finish(worker, "waiting") == QueueItemStage.SUCCESS
+    assert worker._core_allocator.free_cores == all_cores
+    assert (tmp_path / "waiting.stdout.log").read_text() \
+        == f"{sorted(all_cores)}\n"
+
+@pytest.mark.unit
+def test_process_worker_enforce_resources_pool(temp_dir):
+    """Test that resources cannot be enforced on the shared pool.
+    """
+    with pytest.raises(ValueError):
+        ProcessQueueWorker(temp_dir, mode="pool", enforce_resources=True)
+
+@pytest.mark.unit
+@pytest.mark.parametrize("mode", ["process", "popen"])
+def test_process_worker_delete_kills_running_job(temp_dir, tmp_path, mode):
+    """Test that deleting a running job kills it and the processes it
+    started.
+    """
+    marker = tmp_path / "still-running"
+    (temp_dir / "hang_script.py").write_text(
+        "import subprocess, sys, time\n"
+        "subprocess.Popen([sys.executable, '-c', 'import time, sys; "
+        "time.sleep(2); open(sys.argv[1], \"w\").close()', sys.argv[1]])\n"
+        "time.sleep(60)\n"
+    )
+    worker = ProcessQueueWorker(temp_dir, mode=mode, log_dir=str(tmp_path))
+
+    queue_item_id, _ = make_queue_item()
+    worker.send_job(queue_item_id, {"file_name": "hang_script.py",
+                                    "args": [str(marker)]})
+    time.sleep(1)
+    assert worker.poll_all_status()[queue_item_id] == \
+        QueueItemStage.PROCESSING
+
+    start = time.monotonic()
+    worker.delete_job(queue_item_id)
+    assert time.monotonic() - start < 5
+    assert worker.poll_all_status() == {}
+
+    time.sleep(2)
+    assert not marker.exists()
+
+@pytest.mark.unit
+def test_process_worker_pool_delete_kills_running_job(temp_dir, tmp_path,
+                                                      temp_script_entry_point):
+    """Test that deleting a running pool job restarts the pool, so the job
+    stops and later jobs still run.
+    """
+    marker = tmp_path / "still-running"
+    (temp_dir / "hang_entry_point.py").write_text(
+        "import time\n"
+        "def run(args):\n"
+        "    time.sleep(2)\n"
+        "    open(args[0], 'w').close()\n"
+    )
+    worker = ProcessQueueWorker(temp_dir, mode="pool", pool_size=1)
+    try:
+        queue_item_id, _ = make_queue_item()
+        worker.send_job(queue_item_id, {"file_name": "hang_entry_point.py",
+                                        "args": [str(marker)]})
+        time.sleep(1)
+        assert worker.poll_all_status()[queue_item_id] == \
+            QueueItemStage.PROCESSING
+
+        worker.delete_job(queue_item_id)
+        assert worker.poll_all_status() == {}
+
+        next_item_id, _ = make_queue_item()
+        worker.send_job(next_item_id, {"file_name": "my_entry_point.py",
+                                       "args": None})
+        assert wait_for_finish(worker, next_item_id) == \
+            QueueItemStage.SUCCESS
+        time.sleep(1.5)
+        assert not marker.exists()
+    finally:
+        worker.close()
+
+@pytest.mark.unit
+def test_process_worker_pool_restart_resends_jobs(temp_dir, tmp_path):
+    """Test that deleting a running pool job sends the other jobs running in
+    the pool to the new pool instead of failing them.
+    """
+    (temp_dir / "slow_entry_point.py").write_text(
+        "import time\n"
+        "def run(args):\n"
+        "    with open(args[0], 'a') as f:\n"
+        "        f.write('started\\n')\n"
+        "    time.sleep(float(args[1]))\n"
+    )
+    starts = tmp_path / "starts"
+    worker = ProcessQueueWorker(temp_dir, mode="pool", pool_size=2)
+    try:
+        hung_id, _ = make_queue_item()
+        other_id, _ = make_queue_item()
+        worker.send_job(hung_id, {"file_name": "slow_entry_point.py",
+                                  "args": [str(tmp_path / "hung"), "60"]})
+        worker.send_job(other_id, {"file_name": "slow_entry_point.py",
+                                   "args": [str(starts), "1"]})
+        deadline = time.monotonic() + 30
+        while not (starts.exists() and (tmp_path / "hung").exists()):
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+
+        worker.delete_job(hung_id)
+        assert wait_for_finish(worker, other_id) == QueueItemStage.SUCCESS
+        assert starts.read_text().count("started") == 2
+    finally:
+        worker.close()
@@ -1,18 +1,23 @@
 """Pytests for queue functionality.
 """
+import json
 import random
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 
 from task_queue.queues import memory_queue
 from task_queue.queues import event_queue
+from task_queue.queues import RetryPolicy
 from task_queue.queues import json_sql_queue
 from task_queue.queues import json_s3_queue
 from task_queue.events import InMemoryEventStore
+from task_queue.wakeup import WakeupTrigger
 import tests.common_queue as qtest
 from .test_config import TaskQueueTestSettings
-from task_queue.queues.queue_base import QueueItemStage
+from task_queue.queues.queue_base import QueueBase, QueueItemStage
 
 
 UNIT_TEST_QUEUE_BASE = TaskQueueTestSettings().UNIT_TEST_QUEUE_BASE
@@ -21,14 +26,26 @@ ALL_QUEUE_TYPES = [
     pytest.param("memory", marks=pytest.mark.unit),
     pytest.param("with_events", marks=pytest.mark.unit)
 ]
+SQL_QUEUE_TYPES = []
 try:
     import sqlalchemy as sqla
+    from task_queue.queues.sql_listener import SQLQueueListener
+    from task_queue.queues.sql_migrations import (
+        migrate_sql_queue, convert_legacy_json_data
+    )
     from .utils import PytestSqlEngine
     param = pytest.param(
         "sql",
         marks=[pytest.mark.integration, pytest.mark.uses_sql]
     )
     ALL_QUEUE_TYPES.append(param)
+    SQL_QUEUE_TYPES.append(param)
+    param = pytest.param(
+        "sql_cached_sizes",
+        marks=[pytest.mark.integration, pytest.mark.uses_sql]
+    )
+    ALL_QUEUE_TYPES.append(param)
+    SQL_QUEUE_TYPES.append(param)
 except ModuleNotFoundError:
     pass
 
@@ -42,7 +59,6 @@ try:
 except ModuleNotFoundError:
     pass
 
-
 @pytest.fixture(scope="session")
 def setup_s3_bucket():
     """Create a 'integration-tests' S3 bucket for testing purposes.
@@ -63,12 +79,14 @@ def cleanup_bucket(test_bucket_name, fs):
     if fs.exists(test_bucket_name):
         fs.rm(test_bucket_name)
 
-def new_s3_queue(request):
+def new_s3_queue(request, retry_policy=None):
     """Creates a new s3 queue for tests and prints results.
     """
     queue_base = os.path.join(UNIT_TEST_QUEUE_BASE,
                               str(random.randint(0, 9999999)))
-    yield json_s3_queue(queue_base)
+    yield json_s3_queue(
+        queue_base, retry_policy=retry_policy, release_interval_sec=0
+    )
     fs = s3fs.S3FileSystem()
 
     # If the test passes
@@ -80,16 +98,16 @@ def new_s3_queue(request):
     elif request.node.rep_call.failed:
         print(f"Failed results at {queue_base}")
 
-def new_in_memory_queue():
-    """Returns an in-memory queue.
+def new_in_memory_queue(retry_policy=None):
+    """Returns an in-memory queue with a fake clock.
     """
-    return memory_queue()
+    return memory_queue(retry_policy=retry_policy, clock=qtest.FakeClock())
 
 @pytest.fixture(scope="session")
 def cleanup_sql_queue():
     """"""
 
-def new_sql_queue():
+def new_sql_queue(cache_sizes=False, retry_policy=None):
     """Returns a SQL queue.
     """
     queue_name = "TEST_QUEUE_" + str(random.randint(0, 9999999999))
@@ -98,7 +116,9 @@ def new_sql_queue():
         test_sql_engine.test_sql_engine,
         queue_name,
         table_name="test_sql_queue",
-        constraint_name="_test_queue_name_index_key_uc"
+        constraint_name="_test_queue_name_index_key_uc",
+        cache_sizes=cache_sizes,
+        retry_policy=retry_policy
     )
 
 @pytest.fixture(scope="session")
@@ -114,6 +134,9 @@ def setup_fixture(request):
         test_sql_engine = PytestSqlEngine()
         with test_sql_engine.test_sql_engine.connect() as connection:
             connection.execute(sqla.text(f"DROP TABLE IF EXISTS {tablename};"))
+            connection.execute(
+                sqla.text(f"DROP TABLE IF EXISTS {tablename}_sizes;")
+            )
             connection.commit()
     elif uses_s3_marker is not None:
         fs = s3fs.S3FileSystem()
@@ -138,6 +161,8 @@ def new_empty_queue(request, setup_fixture):
     """
     if request.param == "sql":
         yield new_sql_queue()
+    elif request.param == "sql_cached_sizes":
+        yield new_sql_queue(cache_sizes=True)
     elif request.param == "s3":
         yield from new_s3_queue(request)
     elif request.param == "memory":
@@ -147,6 +172,28 @@ def new_empty_queue(request, setup_fixture):
         queue = new_in_memory_queue()
         yield event_queue(queue, store, "TEST_EVENT_QUEUE")
 
+@pytest.fixture
+def new_retry_queue(request, setup_fixture):
+    """Fixture to create an empty queue of one given type that retries
+    failed items 3 times with a qtest.RETRY_BACKOFF_SEC backoff.
+    """
+    retry_policy = RetryPolicy(
+        max_attempts=3, backoff_sec=qtest.RETRY_BACKOFF_SEC,
+        backoff_multiplier=1, jitter=0
+    )
+    if request.param == "sql":
+        yield new_sql_queue(retry_policy=retry_policy)
+    elif request.param == "sql_cached_sizes":
+        yield new_sql_queue(cache_sizes=True, retry_policy=retry_policy)
+    elif request.param == "s3":
+        yield from new_s3_queue(request, retry_policy=retry_policy)
+    elif request.param == "memory":
+        yield new_in_memory_queue(retry_policy=retry_policy)
+    elif request.param == "with_events":
+        store = InMemoryEventStore()
+        queue = new_in_memory_queue(retry_policy=retry_policy)
+        yield event_queue(queue, store, "TEST_EVENT_QUEUE")
+
 @pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
 def test_put_get(new_empty_queue):
     """Tests put and get function as expected.
@@ -167,6 +214,12 @@ def test_add_to_queue_no_duplicates(new_empty_queue):
     """
     qtest.test_add_to_queue_no_duplicates(new_empty_queue)
 
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_put_duplicate_warnings(new_empty_queue):
+    """Tests that put warns once for every item already in the queue.
+    """
+    qtest.test_put_duplicate_warnings(new_empty_queue)
+
 @pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
 def test_get_empty_queue(new_empty_queue):
     """Tests the results of calling get on an empty queue.
@@ -187,6 +240,30 @@ def test_queue_size(new_empty_queue):
     qtest.test_queue_size(new_empty_queue)
 
 @pytest.mark.filterwarnings("ignore:Item .* already in queue. Skipping.")
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_queue_sizes(new_empty_queue):
+    """Test that sizes agrees with size for every stage.
+    """
+    qtest.test_queue_sizes(new_empty_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_get_items(new_empty_queue):
+    """Test that get_items claims WAITING items by ID.
+    """
+    qtest.test_get_items(new_empty_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_sum_resources(new_empty_queue):
+    """Test that sum_resources totals the resources of a stage.
+    """
+    qtest.test_sum_resources(new_empty_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_iter_state(new_empty_queue):
+    """Test that lookup_state_page and iter_state page through a stage.
+    """
+    qtest.test_iter_state(new_empty_queue)
+
 @pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
 def test_out_of_order(new_empty_queue):
     """Tests out of order.
@@ -247,6 +324,64 @@ def test_requeue_invalid_ids(new_empty_queue):
     """
     qtest.test_requeue_invalid_ids(new_empty_queue)
 
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_success_fail_many(new_empty_queue):
+    """Tests that success_many and fail_many move every given item.
+    """
+    qtest.test_success_fail_many(new_empty_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_put_priorities(new_empty_queue):
+    """Tests that put honours or rejects priorities.
+    """
+    qtest.test_put_priorities(new_empty_queue)
+
+@pytest.mark.unit
+def test_queue_base_optional_methods():
+    """Tests that a queue implementing only the required methods can be
+    created, and that get_items and the lease methods raise
+    NotImplementedError on it.
+    """
+    class MinimalQueue(QueueBase):
+        """Queue implementing only the abstract methods of QueueBase."""
+        put = get = peek = success = fail = size = lookup_status = \
+            lookup_state = lookup_item = description = requeue = \
+            lambda self, *args, **kwargs: None
+
+    queue = MinimalQueue()
+    with pytest.raises(NotImplementedError):
+        queue.get_items(["item"])
+    with pytest.raises(NotImplementedError):
+        queue.extend_lease(["item"], "owner", 60)
+    with pytest.raises(NotImplementedError):
+        queue.expire_leases()
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_success_fail_not_processing(new_empty_queue):
+    """Tests that success and fail raise KeyError for items that are not
+    PROCESSING.
+    """
+    qtest.test_success_fail_not_processing(new_empty_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_requeue_many(new_empty_queue):
+    """Tests that requeue_many moves failed items and skips the others.
+    """
+    qtest.test_requeue_many(new_empty_queue)
+
+@pytest.mark.parametrize("new_retry_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_retry_policy(new_retry_queue):
+    """Tests that failed items are retried after a backoff.
+    """
+    qtest.test_retry_policy(new_retry_queue)
+
+@pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
+def test_leases(new_empty_queue):
+    """Tests that leased items can be extended, acknowledged and released
+    by their owner only, and go back to WAITING when the lease expires.
+    """
+    qtest.test_leases(new_empty_queue)
+
 @pytest.mark.parametrize("new_empty_queue", ALL_QUEUE_TYPES, indirect=True)
 def test_lookup_state(new_empty_queue):
     """Tests that lookup_state works as expected.
@@ -295,3 +430,292 @@ def test_peek_items_same_as_get(new_empty_queue):
     items_get = new_empty_queue.get(NUM_PEEK)
 
     assert items_peek == items_get
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_concurrent_get_no_overlap(new_empty_queue):
+    """Tests that concurrent `get` calls against the same SQL queue never
+    claim the same item twice.
+    """
+    new_empty_queue.put(qtest.default_items)
+    other_queue = json_sql_queue(
+        new_empty_queue.engine,
+        new_empty_queue.queue_name,
+        table_name="test_sql_queue",
+        constraint_name="_test_queue_name_index_key_uc",
+        cache_sizes=new_empty_queue.sql_queue_sizes is not None
+    )
+
+    n_gets = 8
+    with ThreadPoolExecutor(max_workers=n_gets) as executor:
+        futures = [
+            executor.submit(q.get, 3)
+            for q in [new_empty_queue, other_queue] * (n_gets // 2)
+        ]
+        claimed_ids = [
+            item_id
+            for future in futures
+            for item_id, _ in future.result()
+        ]
+
+    assert len(claimed_ids) == len(set(claimed_ids))
+    assert len(claimed_ids) == min(3 * n_gets, len(qtest.default_items))
+    assert new_empty_queue.size(QueueItemStage.PROCESSING) == \
+        len(claimed_ids)
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_refresh_size_counts(new_empty_queue):
+    """Tests that cached sizes are rebuilt from the queue table.
+    """
+    new_empty_queue.put(qtest.default_items)
+    new_empty_queue.get(5)
+    expected = new_empty_queue.sizes()
+
+    cached_queue = json_sql_queue(
+        new_empty_queue.engine,
+        new_empty_queue.queue_name,
+        table_name="test_sql_queue",
+        constraint_name="_test_queue_name_index_key_uc",
+        cache_sizes=True
+    )
+
+    assert cached_queue.sizes() == expected
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_queue_indexes(new_empty_queue):
+    """Tests that an outdated queue table is refused unless migrated, that
+    the migration adds the missing columns and indexes, and that migrating
+    again is a no-op.
+    """
+    engine = new_empty_queue.engine
+    with engine.connect() as connection:
+        connection.execute(sqla.text(
+            "DROP INDEX IF EXISTS test_sql_queue_queue_stage_priority_id_idx;"
+        ))
+        connection.execute(sqla.text(
+            "DROP INDEX IF EXISTS test_sql_queue_active_stage_priority_id_idx;"
+        ))
+        connection.execute(sqla.text(
+            "ALTER TABLE test_sql_queue DROP COLUMN IF EXISTS priority;"
+        ))
+        connection.execute(sqla.text(
+            "ALTER TABLE test_sql_queue DROP COLUMN IF EXISTS attempts, "
+            "DROP COLUMN IF EXISTS not_before, "
+            "DROP COLUMN IF EXISTS lease_owner, "
+            "DROP COLUMN IF EXISTS lease_expires;"
+        ))
+        connection.commit()
+
+    with pytest.raises(ValueError, match="SQL_QUEUE_MIGRATE"):
+        json_sql_queue(
+            engine,
+            new_empty_queue.queue_name,
+            table_name="test_sql_queue",
+            constraint_name="_test_queue_name_index_key_uc"
+        )
+
+    json_sql_queue(
+        engine,
+        new_empty_queue.queue_name,
+        table_name="test_sql_queue",
+        constraint_name="_test_queue_name_index_key_uc",
+        partial_index=True,
+        migrate=True
+    )
+    migrate_sql_queue(engine, "test_sql_queue", partial_index=True)
+
+    indexes = {
+        index["name"]: index["column_names"]
+        for index in sqla.inspect(engine).get_indexes("test_sql_queue")
+    }
+    assert indexes["test_sql_queue_queue_stage_priority_id_idx"] == \
+        ["queue_name", "queue_item_stage", "priority", "id"]
+    assert indexes["test_sql_queue_active_stage_priority_id_idx"] == \
+        ["queue_name", "queue_item_stage", "priority", "id"]
+    assert indexes["test_sql_queue_queue_not_before_idx"] == \
+        ["queue_name", "not_before"]
+    assert indexes["test_sql_queue_queue_lease_expires_idx"] == \
+        ["queue_name", "lease_expires"]
+
+@pytest.mark.parametrize("new_retry_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_release_due_items_bounded(new_retry_queue):
+    """Tests that get only releases as many due retries as it claims.
+    """
+    new_retry_queue.put({"item_a": {}, "item_b": {}, "item_c": {}})
+    new_retry_queue.get(3)
+    new_retry_queue.fail_many(["item_a", "item_b", "item_c"])
+
+    time.sleep(qtest.RETRY_BACKOFF_SEC + 0.5)
+    assert len(new_retry_queue.get(1)) == 1
+    sql_queue = new_retry_queue.sql_queue
+    with sqla.orm.Session(new_retry_queue.engine) as session:
+        n_delayed = session.scalar(
+            sqla.select(sqla.func.count()).where(
+                (sql_queue.queue_name == new_retry_queue.queue_name) &
+                sql_queue.not_before.is_not(None)
+            )
+        )
+    assert n_delayed == 2
+    assert len(new_retry_queue.get(3)) == 2
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_get_priority_order(new_empty_queue):
+    """Tests that higher priority items are claimed first, and that items of
+    equal priority are claimed in the order they were added.
+    """
+    new_empty_queue.put({"first": {}, "second": {}, "third": {}})
+    new_empty_queue.put(
+        {"urgent": {}, "high": {}, "fourth": {}, "third": {}},
+        priorities={"urgent": 10, "high": 5, "third": 100}
+    )
+
+    expected = ["urgent", "high", "first", "second"]
+    assert [item_id for item_id, _ in new_empty_queue.peek(4)] == expected
+    assert [item_id for item_id, _ in new_empty_queue.get(2)] == expected[:2]
+    # "third" was already queued, so its later priority is ignored.
+    assert [item_id for item_id, _ in new_empty_queue.get(3)] == \
+        ["first", "second", "third"]
+    assert [item_id for item_id, _ in new_empty_queue.get(1)] == ["fourth"]
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_event_queue_put_priorities(new_empty_queue):
+    """Tests that the event queue passes priorities to the wrapped queue.
+    """
+    queue = event_queue(
+        new_empty_queue, InMemoryEventStore(), "TEST_EVENT_QUEUE"
+    )
+    queue.put({"first": {}, "urgent": {}}, priorities={"urgent": 1})
+
+    assert [item_id for item_id, _ in queue.get(2)] == ["urgent", "first"]
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_json_data_native_and_legacy(new_empty_queue):
+    """Tests that item bodies are stored as JSONB values, and that rows
+    written as JSON strings by older versions are still read correctly and
+    can be converted.
+    """
+    new_empty_queue.put({"native": {"a": [1, 2]}, "text": "[1]"})
+    legacy_bodies = {"legacy": {"b": 3}, "legacy_text": "plain"}
+    with new_empty_queue.engine.connect() as connection:
+        for item_id, body in legacy_bodies.items():
+            connection.execute(
+                sqla.text(
+                    "INSERT INTO test_sql_queue "
+                    "(queue_item_stage, json_data, index_key, queue_name) "
+                    "VALUES (0, to_jsonb(CAST(:body AS TEXT)), :item_id, "
+                    ":queue_name)"
+                ),
+                {
+                    "body": json.dumps(body),
+                    "item_id": item_id,
+                    "queue_name": new_empty_queue.queue_name
+                }
+            )
+        connection.commit()
+
+    def json_types():
+        with new_empty_queue.engine.connect() as connection:
+            return dict(connection.execute(
+                sqla.text(
+                    "SELECT index_key, jsonb_typeof(json_data) "
+                    "FROM test_sql_queue WHERE queue_name = :queue_name"
+                ),
+                {"queue_name": new_empty_queue.queue_name}
+            ).all())
+
+    assert json_types() == {
+        "native": "object",
+        "text": "string",
+        "legacy": "string",
+        "legacy_text": "string"
+    }
+
+    expected = [
+        ("native", {"a": [1, 2]}),
+        ("text", "[1]"),
+        ("legacy", {"b": 3}),
+        ("legacy_text", "plain")
+    ]
+    assert new_empty_queue.peek(4) == expected
+    assert new_empty_queue.lookup_item("legacy")["item_body"] == {"b": 3}
+
+    # Other queues in the table may also hold legacy rows.
+    assert convert_legacy_json_data(
+        new_empty_queue.engine, "test_sql_queue", batch_size=1
+    ) >= 2
+    assert json_types()["legacy"] == "object"
+    assert new_empty_queue.get(4) == expected
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_sum_resources_legacy_rows(new_empty_queue):
+    """Tests that sum_resources also reads rows stored as JSON strings by
+    older versions, and skips resource values that are not dictionaries.
+    """
+    new_empty_queue.put({
+        "native": {"resources": {"cpu": 2, "gpu": 1}},
+        "scalar": {"resources": 3},
+        "text": "resources"
+    })
+    with new_empty_queue.engine.connect() as connection:
+        connection.execute(
+            sqla.text(
+                "INSERT INTO test_sql_queue "
+                "(queue_item_stage, json_data, index_key, queue_name) "
+                "VALUES (0, to_jsonb(CAST(:body AS TEXT)), 'legacy', "
+                ":queue_name)"
+            ),
+            {
+                "body": json.dumps({"resources": {"cpu": 0.5}}),
+                "queue_name": new_empty_queue.queue_name
+            }
+        )
+        connection.commit()
+
+    assert new_empty_queue.sum_resources(QueueItemStage.WAITING) == \
+        {"cpu": 2.5, "gpu": 1}
+
+@pytest.mark.parametrize("new_empty_queue", SQL_QUEUE_TYPES, indirect=True)
+def test_sql_queue_notify_listener(new_empty_queue):
+    """Tests that a listener is woken by puts and stage moves of a queue
+    created with notify, but not by items being claimed.
+    """
+    queue = json_sql_queue(
+        new_empty_queue.engine,
+        new_empty_queue.queue_name,
+        table_name="test_sql_queue",
+        constraint_name="_test_queue_name_index_key_uc",
+        cache_sizes=new_empty_queue.sql_queue_sizes is not None,
+        notify=True
+    )
+    trigger = WakeupTrigger(debounce_sec=0)
+    listener = SQLQueueListener(
+        queue.engine,
+        queue.queue_name,
+        trigger,
+        tablename="test_sql_queue"
+    )
+    listener.start()
+    try:
+        # The listener wakes once when it connects.
+        assert trigger.wait(10)
+
+        queue.put({"a": {}, "b": {}})
+        assert trigger.wait(10)
+
+        queue.get(2)
+        assert not trigger.wait(1.5)
+
+        queue.success("a")
+        assert trigger.wait(10)
+
+        # Other queues in the table do not wake the listener.
+        other_queue = json_sql_queue(
+            new_empty_queue.engine,
+            f"{new_empty_queue.queue_name}_other",
+            table_name="test_sql_queue",
+            constraint_name="_test_queue_name_index_key_uc",
+            notify=True
+        )
+        other_queue.put({"d": {}})
+        assert not trigger.wait(1.5)
+    finally:
+        listener.stop()
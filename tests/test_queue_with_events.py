@@ -1,6 +1,7 @@
 """Pytests for the queue_with_events.py functionality.
 """
 import random
+from unittest import mock
 
 import pytest
 
@@ -103,3 +104,60 @@ def test_event_queue_lifecycle(queue_with_events_fixture):
         if e.stage_to != QueueItemStage.PROCESSING:
             # If this item was moved, make sure it is in the proper spot now
             assert e.stage_to == eq.lookup_status(e.queue_index_key)
+
+@pytest.mark.unit
+def test_event_queue_sizes(queue_with_events_fixture):
+    """Test that sizes uses the wrapped queue's sizes instead of one size
+    call per stage.
+    """
+    q, _, eq = queue_with_events_fixture
+    counts = {"WAITING": 3, "PROCESSING": 2, "SUCCESS": 1, "FAIL": 0}
+
+    with mock.patch.object(q, "size") as size, \
+        mock.patch.object(q, "sizes", return_value=counts) as sizes:
+        assert eq.sizes() == counts
+    sizes.assert_called_once_with()
+    size.assert_not_called()
+
+@pytest.mark.unit
+def test_event_queue_put_priorities_unsupported(queue_with_events_fixture):
+    """Test that priorities the wrapped queue does not support are rejected
+    before any Event is recorded.
+    """
+    _, s, eq = queue_with_events_fixture
+
+    with pytest.raises(ValueError):
+        eq.put(default_items, priorities={next(iter(default_items)): 1})
+    assert s.get(ADD_EVENT_NAME) == []
+    assert eq.size(QueueItemStage.WAITING) == 0
+
+@pytest.mark.unit
+def test_event_queue_many_moved_only(queue_with_events_fixture):
+    """Test that success_many and fail_many only record Events for the items
+    that actually moved.
+    """
+    _, s, eq = queue_with_events_fixture
+
+    eq.put(default_items)
+    item_ids = [k for k, _ in eq.get(2)]
+    waiting_id = eq.peek(1)[0][0]
+
+    assert eq.success_many([item_ids[0], waiting_id, "BAD_ID"]) == \
+        [item_ids[0]]
+    assert eq.fail_many([item_ids[1], waiting_id]) == ([item_ids[1]], [])
+    with pytest.raises(KeyError):
+        eq.success(waiting_id)
+
+    moved = [
+        (e.queue_index_key, e.stage_to)
+        for e in map(lambda e: QueueMoveEventData(**e.data),
+                     s.get(MOVE_EVENT_NAME))
+        if e.stage_to != QueueItemStage.PROCESSING
+    ]
+    assert sorted(moved, key=lambda m: m[0]) == sorted(
+        [
+            (item_ids[0], QueueItemStage.SUCCESS),
+            (item_ids[1], QueueItemStage.FAIL)
+        ],
+        key=lambda m: m[0]
+    )
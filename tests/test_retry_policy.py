@@ -0,0 +1,60 @@
+"""Pytests for the retry policy.
+"""
+import pytest
+
+from task_queue.config import config
+from task_queue.queues.retry_policy import (
+    RetryPolicy,
+    retry_policy_from_settings
+)
+
+
+@pytest.mark.unit
+def test_retry_policy_attempts():
+    """Tests that items are retried until they were tried max_attempts
+    times.
+    """
+    policy = RetryPolicy(max_attempts=3)
+
+    assert policy.should_retry(1)
+    assert policy.should_retry(2)
+    assert not policy.should_retry(3)
+
+
+@pytest.mark.unit
+def test_retry_policy_backoff():
+    """Tests the exponential backoff, its cap and the jitter range.
+    """
+    policy = RetryPolicy(backoff_sec=10, backoff_multiplier=3,
+                         max_backoff_sec=60, jitter=0)
+    assert [policy.delay(n) for n in range(1, 5)] == [10, 30, 60, 60]
+
+    policy = RetryPolicy(backoff_sec=10, jitter=0.5)
+    delays = [policy.delay(1) for _ in range(100)]
+    assert all(5 <= delay <= 10 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("kwargs", [{"max_attempts": 0}, {"jitter": 1.5}])
+def test_retry_policy_invalid(kwargs):
+    """Tests that invalid policies are rejected.
+    """
+    with pytest.raises(ValueError):
+        RetryPolicy(**kwargs)
+
+
+@pytest.mark.unit
+def test_retry_policy_from_settings():
+    """Tests that the settings only create a policy for more than one
+    attempt.
+    """
+    settings = config.TaskQueueRetrySettings()
+    assert retry_policy_from_settings(settings) is None
+
+    settings = config.TaskQueueRetrySettings(
+        RETRY_MAX_ATTEMPTS=4, RETRY_BACKOFF_SECONDS=5
+    )
+    policy = retry_policy_from_settings(settings)
+    assert policy.max_attempts == 4
+    assert policy.backoff_sec == 5
@@ -0,0 +1,68 @@
+"""Test the shared SQL engine factory.
+"""
+import pytest
+
+from task_queue import config
+
+try:
+    import sqlalchemy as sqla
+    from task_queue.sql_engine import (
+        get_sql_engine, sql_engine_from_settings, dispose_sql_engines
+    )
+except ModuleNotFoundError:
+    pass
+
+
+def connection_string_from_env():
+    """Builds the connection string of the integration test database.
+    """
+    settings = config.TaskQueueSqlSettings()
+    if settings.SQL_QUEUE_CONNECTION_STRING is not None:
+        return settings.SQL_QUEUE_CONNECTION_STRING
+    return sqla.engine.url.URL(
+        drivername="postgresql",
+        username=settings.SQL_QUEUE_POSTGRES_USER,
+        password=settings.SQL_QUEUE_POSTGRES_PASSWORD,
+        host=settings.SQL_QUEUE_POSTGRES_HOSTNAME,
+        database=settings.SQL_QUEUE_POSTGRES_DATABASE,
+        query={},
+        port=settings.SQL_QUEUE_POSTGRES_PORT,
+    ).render_as_string(hide_password=False)
+
+@pytest.mark.integration
+def test_get_sql_engine_is_shared():
+    """Tests that the same arguments return the same engine, and different
+    pool configurations return different engines.
+    """
+    connection_string = connection_string_from_env()
+
+    engine = get_sql_engine(connection_string)
+    assert get_sql_engine(connection_string) is engine
+    assert get_sql_engine(connection_string, pool_size=2) is not engine
+    assert engine.pool.size() == 5
+
+    dispose_sql_engines()
+    assert get_sql_engine(connection_string) is not engine
+    dispose_sql_engines()
+
+@pytest.mark.integration
+def test_sql_engine_from_settings():
+    """Tests that the engine is configured from TaskQueueSqlSettings.
+    """
+    settings = config.TaskQueueSqlSettings(
+        SQL_QUEUE_POOL_SIZE=3,
+        SQL_QUEUE_POOL_MAX_OVERFLOW=0,
+        SQL_QUEUE_STATEMENT_TIMEOUT_MS=1500
+    )
+    engine = sql_engine_from_settings(connection_string_from_env(), settings)
+
+    assert engine.pool.size() == 3
+    # pylint: disable=protected-access
+    assert engine.pool._max_overflow == 0
+    with engine.connect() as connection:
+        timeout = connection.execute(
+            sqla.text("SHOW statement_timeout")
+        ).scalar()
+    assert timeout == "1500ms"
+
+    dispose_sql_engines()
@@ -456,4 +456,85 @@ def test_validate_args_process_missing_path():
     success, error_string = validate_args(args_dict)
     assert not success
     assert f'worker-interface is set to {PROCESS_INTERFACE_CLI_CHOICE}'\
-           in error_string
\ No newline at end of file
+           in error_string
+
+@pytest.mark.unit
+def test_validate_args_log_sink_missing_path():
+    """Ensure log_path is provided when log_sink writes to files.
+    """
+    args_dict = {'worker_interface': 'argo-workflows',
+            'queue_implementation': 's3-json',
+            'event_store_implementation': 'none',
+            'with_queue_events': False,
+            'worker_interface_id': 'dummy-id',
+            'endpoint': 'dummy-endpoint',
+            'namespace': 'dummy-namespace',
+            'connection_string': None,
+            'queue_name': None,
+            's3_base_path': 'dummypath',
+            'add_to_queue_event_name': None,
+            'move_queue_event_name': None,
+            'log_sink': 'directory',
+            'log_path': None,
+            'logger_level': None}
+    success, error_string = validate_args(args_dict)
+    assert not success
+    assert 'when log-sink is set to directory' in error_string
+
+    args_dict['log_path'] = '/tmp/logs'
+    success, error_string = validate_args(args_dict)
+    assert success
+    assert error_string == ''
+
+@pytest.mark.unit
+def test_validate_args_lease_shorter_than_period():
+    """Ensure lease_seconds is longer than periodic_seconds.
+    """
+    args_dict = {'worker_interface': 'argo-workflows',
+            'queue_implementation': 's3-json',
+            'event_store_implementation': 'none',
+            'with_queue_events': False,
+            'worker_interface_id': 'dummy-id',
+            'endpoint': 'dummy-endpoint',
+            'namespace': 'dummy-namespace',
+            'connection_string': None,
+            'queue_name': None,
+            's3_base_path': 'dummypath',
+            'add_to_queue_event_name': None,
+            'move_queue_event_name': None,
+            'lease_seconds': 10,
+            'lease_owner': 'service-a',
+            'periodic_seconds': 10,
+            'logger_level': None}
+    success, error_string = validate_args(args_dict)
+    assert not success
+    assert 'must be greater than periodic-seconds' in error_string
+
+    args_dict['lease_seconds'] = 30
+    success, error_string = validate_args(args_dict)
+    assert success
+    assert error_string == ''
+
+@pytest.mark.unit
+def test_validate_args_lease_missing_owner():
+    """Ensure lease_owner is provided when lease_seconds is set.
+    """
+    args_dict = {'worker_interface': 'argo-workflows',
+            'queue_implementation': 's3-json',
+            'event_store_implementation': 'none',
+            'with_queue_events': False,
+            'worker_interface_id': 'dummy-id',
+            'endpoint': 'dummy-endpoint',
+            'namespace': 'dummy-namespace',
+            'connection_string': None,
+            'queue_name': None,
+            's3_base_path': 'dummypath',
+            'add_to_queue_event_name': None,
+            'move_queue_event_name': None,
+            'lease_seconds': 30,
+            'lease_owner': None,
+            'periodic_seconds': 10,
+            'logger_level': None}
+    success, error_string = validate_args(args_dict)
+    assert not success
+    assert 'lease-owner is required with lease-seconds' in error_string
@@ -0,0 +1,46 @@
+"""Pytests for the wakeup trigger.
+"""
+import threading
+import time
+
+import pytest
+
+from task_queue.wakeup import WakeupTrigger
+
+
+@pytest.mark.unit
+def test_wakeup_trigger_timeout():
+    """Tests that wait returns False when nothing notifies the trigger.
+    """
+    trigger = WakeupTrigger()
+
+    start = time.monotonic()
+    assert not trigger.wait(0.1)
+    assert time.monotonic() - start >= 0.1
+
+@pytest.mark.unit
+def test_wakeup_trigger_notify():
+    """Tests that a notification from another thread ends the wait early,
+    and that a burst of notifications wakes the waiter once.
+    """
+    trigger = WakeupTrigger(debounce_sec=0.05)
+
+    def notify_burst():
+        for _ in range(5):
+            trigger.notify("test")
+
+    threading.Timer(0.05, notify_burst).start()
+    start = time.monotonic()
+    assert trigger.wait(10)
+    assert time.monotonic() - start < 5
+    assert not trigger.wait(0.1)
+
+@pytest.mark.unit
+def test_wakeup_trigger_keeps_early_notification():
+    """Tests that a notification sent while nobody waits is not lost.
+    """
+    trigger = WakeupTrigger(debounce_sec=0)
+    trigger.notify()
+
+    assert trigger.wait(0)
+    assert not trigger.wait(0)
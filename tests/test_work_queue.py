@@ -1,8 +1,19 @@
 """Pytests for the work_queue functionality.
 """
+import asyncio
+import threading
+import time
+
 import pytest
 
-from task_queue.queues import QueueItemStage
+from task_queue.queues import QueueItemStage, RetryPolicy, memory_queue
+from task_queue.workers.work_queue import WorkQueue
+from task_queue.workers.async_work_queue import AsyncWorkQueue
+from task_queue.workers.async_queue_worker_interface import (
+    AsyncQueueWorkerInterface
+)
+from task_queue.workers.queue_worker_interface import DummyWorkerInterface
+from tests.common_queue import FakeClock, default_items
 
 @pytest.mark.unit
 def test_push_job(default_work_queue):
@@ -134,3 +145,483 @@ def test_deleted_job(default_work_queue):
 
     new_status = default_work_queue._queue.lookup_status(pushed_job_id)
     assert new_status == QueueItemStage.FAIL
+
+@pytest.mark.unit
+def test_job_callbacks(default_work_queue):
+    """Test that the started and finished callbacks get the jobs the work
+    queue sends and moves out of PROCESSING.
+    """
+    started = []
+    finished = []
+    default_work_queue.add_jobs_started_callback(started.extend)
+    default_work_queue.add_jobs_finished_callback(finished.extend)
+
+    pushed_jobs = default_work_queue.push_next_jobs(3)
+    assert started == pushed_jobs
+
+    success_id, _ = pushed_jobs[0]
+    deleted_id, _ = pushed_jobs[1]
+    default_work_queue._interface.mock_success(success_id)
+    default_work_queue._interface.delete_job(deleted_id)
+    default_work_queue.update_job_status()
+
+    assert sorted(finished) == sorted([success_id, deleted_id])
+
+@pytest.mark.unit
+def test_push_jobs(default_work_queue):
+    """Test that push_jobs sends the requested WAITING jobs and skips the
+    others.
+    """
+    first_id, _ = default_work_queue.push_next_jobs(1)[0]
+    waiting_ids = default_work_queue._queue.lookup_state(
+        QueueItemStage.WAITING
+    )
+
+    pushed_jobs = default_work_queue.push_jobs([waiting_ids[3], first_id])
+
+    assert [item_id for item_id, _ in pushed_jobs] == [waiting_ids[3]]
+    statuses = default_work_queue._interface.poll_all_status()
+    assert statuses[waiting_ids[3]] == QueueItemStage.PROCESSING
+
+
+class SlowDummyWorkerInterface(DummyWorkerInterface):
+    """Dummy worker interface whose submissions take time, recording how
+    many run at once, and which refuses items whose id ends in "1".
+    """
+
+    thread_safe = True
+
+    def __init__(self, send_sec=0.05):
+        super().__init__()
+        self.send_sec = send_sec
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def send_job(self, item_id, queue_item_body):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.send_sec)
+            if item_id.endswith("1"):
+                raise RuntimeError("Submission refused")
+            super().send_job(item_id, queue_item_body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class AsyncDummyWorkerInterface(AsyncQueueWorkerInterface):
+    """Native async dummy worker interface.
+    """
+
+    def __init__(self):
+        self.dummy = DummyWorkerInterface()
+
+    async def send_job(self, item_id, queue_item_body):
+        await asyncio.sleep(0)
+        self.dummy.send_job(item_id, queue_item_body)
+
+    async def delete_job(self, queue_item_id):
+        self.dummy.delete_job(queue_item_id)
+
+    async def poll_all_status(self):
+        return self.dummy.poll_all_status()
+
+
+def assert_refused_items_failed(queue, pushed_jobs):
+    """Checks that the jobs refused by SlowDummyWorkerInterface are in FAIL
+    and the others in PROCESSING.
+    """
+    for item_id, _ in pushed_jobs:
+        expected = QueueItemStage.FAIL if item_id.endswith("1") \
+            else QueueItemStage.PROCESSING
+        assert queue.lookup_status(item_id) == expected
+
+@pytest.mark.unit
+def test_push_jobs_concurrently():
+    """Test that a work queue with send_concurrency sends jobs at once,
+    failing the ones that could not be submitted.
+    """
+    queue = memory_queue()
+    queue.put(default_items)
+    interface = SlowDummyWorkerInterface()
+    work_queue = WorkQueue(queue, interface, send_concurrency=4)
+    started = []
+    work_queue.add_jobs_started_callback(started.extend)
+
+    pushed_jobs = work_queue.push_next_jobs(12)
+
+    assert len(pushed_jobs) == 12
+    assert 1 < interface.max_in_flight <= 4
+    assert_refused_items_failed(queue, pushed_jobs)
+    assert started == [
+        (item_id, body) for item_id, body in pushed_jobs
+        if not item_id.endswith("1")
+    ]
+
+@pytest.mark.unit
+def test_bad_send_concurrency():
+    """Test that the send concurrency must be positive, and 1 for interfaces
+    that are not thread-safe.
+    """
+    with pytest.raises(ValueError):
+        WorkQueue(memory_queue(), DummyWorkerInterface(), send_concurrency=0)
+    with pytest.raises(ValueError, match="not thread-safe"):
+        WorkQueue(memory_queue(), DummyWorkerInterface(), send_concurrency=2)
+
+@pytest.mark.unit
+def test_work_queue_calls_in_calling_thread():
+    """Test that a work queue sending one job at a time calls the interface
+    in the calling thread, even from a running event loop.
+    """
+    class ThreadRecordingInterface(DummyWorkerInterface):
+        """Dummy worker interface recording the threads it is called from.
+        """
+        def __init__(self):
+            super().__init__()
+            self.threads = set()
+
+        def send_job(self, item_id, queue_item_body):
+            self.threads.add(threading.get_ident())
+            super().send_job(item_id, queue_item_body)
+
+        def poll_all_status(self):
+            self.threads.add(threading.get_ident())
+            return super().poll_all_status()
+
+    queue = memory_queue()
+    queue.put(default_items)
+    interface = ThreadRecordingInterface()
+    work_queue = WorkQueue(queue, interface)
+
+    async def run_from_loop():
+        work_queue.push_next_jobs(2)
+        work_queue.update_job_status()
+
+    asyncio.run(run_from_loop())
+    assert interface.threads == {threading.get_ident()}
+    assert queue.size(QueueItemStage.PROCESSING) == 2
+
+@pytest.mark.unit
+def test_work_queue_loop_thread():
+    """Test that a concurrent work queue reuses one event loop thread, can
+    be called from a running event loop and stops the thread on close.
+    """
+    queue = memory_queue()
+    queue.put(default_items)
+    work_queue = WorkQueue(
+        queue, SlowDummyWorkerInterface(send_sec=0), send_concurrency=2
+    )
+
+    async def run_from_loop():
+        work_queue.push_next_jobs(2)
+        work_queue.push_next_jobs(2)
+
+    threads_before = set(threading.enumerate())
+    asyncio.run(run_from_loop())
+    loop_threads = [
+        t for t in set(threading.enumerate()) - threads_before
+        if t.name == "work-queue-loop"
+    ]
+    assert len(loop_threads) == 1
+    assert queue.size(QueueItemStage.WAITING) == len(default_items) - 4
+
+    work_queue.close()
+    assert not loop_threads[0].is_alive()
+
+@pytest.mark.unit
+def test_async_work_queue_serializes_unsafe_interface():
+    """Test that the async work queue calls an interface that is not
+    thread-safe one call at a time.
+    """
+    class UnsafeSlowInterface(SlowDummyWorkerInterface):
+        """Slow dummy worker interface that is not thread-safe.
+        """
+        thread_safe = False
+
+    queue = memory_queue()
+    queue.put(default_items)
+    interface = UnsafeSlowInterface(send_sec=0.01)
+    work_queue = AsyncWorkQueue(queue, interface, max_concurrency=4)
+
+    asyncio.run(work_queue.push_next_jobs(8))
+    assert interface.max_in_flight == 1
+
+@pytest.mark.unit
+def test_async_work_queue_threaded_interface():
+    """Test that the async work queue runs a synchronous interface in
+    threads with bounded concurrency, and updates statuses.
+    """
+    queue = memory_queue()
+    queue.put(default_items)
+    interface = SlowDummyWorkerInterface()
+    work_queue = AsyncWorkQueue(queue, interface, max_concurrency=3)
+    finished = []
+    work_queue.add_jobs_finished_callback(finished.extend)
+
+    pushed_jobs = asyncio.run(work_queue.push_next_jobs(9))
+
+    assert 1 < interface.max_in_flight <= 3
+    assert_refused_items_failed(queue, pushed_jobs)
+
+    sent_ids = list(interface.poll_all_status())
+    interface.mock_success(sent_ids[0])
+    interface.mock_fail(sent_ids[1])
+    asyncio.run(work_queue.update_job_status())
+
+    assert queue.lookup_status(sent_ids[0]) == QueueItemStage.SUCCESS
+    assert queue.lookup_status(sent_ids[1]) == QueueItemStage.FAIL
+    assert sorted(finished) == sorted(sent_ids[:2])
+    assert sent_ids[0] not in interface.poll_all_status()
+
+@pytest.mark.unit
+def test_async_work_queue_async_interface():
+    """Test that the async work queue uses an async interface directly.
+    """
+    queue = memory_queue()
+    queue.put(default_items)
+    interface = AsyncDummyWorkerInterface()
+    work_queue = AsyncWorkQueue(queue, interface)
+
+    async def run():
+        pushed_jobs = await work_queue.push_next_jobs(2)
+        interface.dummy.mock_success(pushed_jobs[0][0])
+        await work_queue.update_job_status()
+        return pushed_jobs
+
+    pushed_jobs = asyncio.run(run())
+
+    assert asyncio.run(
+        work_queue.get_queue_size(QueueItemStage.SUCCESS)
+    ) == 1
+    assert queue.lookup_status(pushed_jobs[1][0]) == \
+        QueueItemStage.PROCESSING
+    # The finished job was deleted through the default delete_jobs.
+    assert pushed_jobs[0][0] not in interface.dummy.poll_all_status()
+
+@pytest.mark.unit
+def test_work_queue_async_interface():
+    """Test that the synchronous work queue also drives an async interface,
+    including job timeouts.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({"item": {"data": 1, "timeout_sec": 0.1}})
+    interface = AsyncDummyWorkerInterface()
+    work_queue = WorkQueue(queue, interface, clock=clock)
+
+    work_queue.push_next_jobs(1)
+    assert list(interface.dummy.poll_all_status()) == ["item"]
+    clock.advance(0.15)
+    work_queue.update_job_status()
+    assert queue.lookup_status("item") == QueueItemStage.FAIL
+    assert interface.dummy.poll_all_status() == {}
+
+@pytest.mark.unit
+def test_update_delete_error():
+    """Test that a failing delete_jobs still renews leases and runs the
+    finished callbacks.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({"running": {"data": 1}, "done": {"data": 2}})
+    interface = DummyWorkerInterface()
+    work_queue = WorkQueue(
+        queue, interface, lease_owner="service", lease_sec=0.3,
+        clock=clock
+    )
+    finished = []
+    work_queue.add_jobs_finished_callback(finished.extend)
+
+    def fail_delete(_):
+        raise RuntimeError("worker unavailable")
+    interface.delete_jobs = fail_delete
+
+    work_queue.push_next_jobs(2)
+    interface.mock_success("done")
+    clock.advance(0.2)
+    work_queue.update_job_status()
+    clock.advance(0.2)
+
+    assert finished == ["done"]
+    assert queue.lookup_status("done") == QueueItemStage.SUCCESS
+    assert queue.expire_leases() == []
+
+@pytest.mark.unit
+def test_update_deletes_jobs_once(default_work_queue):
+    """Test that the finished jobs of an update are deleted with a single
+    delete_jobs call.
+    """
+    pushed_jobs = default_work_queue.push_next_jobs(3)
+    interface = default_work_queue._interface
+    interface.mock_success(pushed_jobs[0][0])
+    interface.mock_fail(pushed_jobs[1][0])
+
+    calls = []
+    delete_jobs = interface.delete_jobs
+    interface.delete_jobs = lambda ids: calls.append(ids) or delete_jobs(ids)
+    default_work_queue.update_job_status()
+
+    assert calls == [[pushed_jobs[0][0], pushed_jobs[1][0]]]
+    assert list(interface.poll_all_status()) == [pushed_jobs[2][0]]
+
+@pytest.mark.unit
+def test_job_timeout():
+    """Test that jobs still processing past their timeout are deleted and
+    failed, using the item's own timeout over the default.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({
+        "default": {"data": 1},
+        "short": {"data": 2, "timeout_sec": 0.1},
+        "long": {"data": 3, "timeout_sec": 60},
+        "done": {"data": 4},
+    })
+    interface = DummyWorkerInterface()
+    work_queue = WorkQueue(queue, interface, default_timeout_sec=0.2,
+                           clock=clock)
+    finished = []
+    work_queue.add_jobs_finished_callback(finished.extend)
+
+    work_queue.push_next_jobs(4)
+    interface.mock_success("done")
+    work_queue.update_job_status()
+    assert queue.size(QueueItemStage.PROCESSING) == 3
+
+    clock.advance(0.15)
+    work_queue.update_job_status()
+    assert queue.lookup_status("short") == QueueItemStage.FAIL
+    assert queue.lookup_status("default") == QueueItemStage.PROCESSING
+
+    clock.advance(0.1)
+    work_queue.update_job_status()
+    assert queue.lookup_status("default") == QueueItemStage.FAIL
+    assert queue.lookup_status("long") == QueueItemStage.PROCESSING
+    assert queue.lookup_status("done") == QueueItemStage.SUCCESS
+    assert list(interface.poll_all_status()) == ["long"]
+    assert finished == ["done", "short", "default"]
+
+@pytest.mark.unit
+def test_job_timeout_after_restart():
+    """Test that jobs already running when the work queue starts get their
+    deadline on the first update, counted from then.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({"running": {"data": 1, "timeout_sec": 0.2}})
+    interface = DummyWorkerInterface()
+    WorkQueue(queue, interface, clock=clock).push_next_jobs()
+
+    work_queue = WorkQueue(queue, interface, clock=clock)
+    work_queue.update_job_status()
+    assert queue.lookup_status("running") == QueueItemStage.PROCESSING
+
+    clock.advance(0.25)
+    work_queue.update_job_status()
+    assert queue.lookup_status("running") == QueueItemStage.FAIL
+    assert not interface.poll_all_status()
+
+@pytest.mark.unit
+def test_job_leases():
+    """Test that the work queue leases the jobs it sends and renews the
+    leases of running jobs, so only jobs it stops renewing expire.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({"running": {"data": 1}, "done": {"data": 2}})
+    interface = DummyWorkerInterface()
+    work_queue = WorkQueue(
+        queue, interface, lease_owner="service", lease_sec=0.3,
+        clock=clock
+    )
+
+    work_queue.push_next_jobs(2)
+    interface.mock_success("done")
+    clock.advance(0.2)
+    work_queue.update_job_status()
+    clock.advance(0.2)
+    assert queue.expire_leases() == []
+    assert queue.lookup_status("done") == QueueItemStage.SUCCESS
+
+    # The work queue stopped renewing, as if it had died.
+    clock.advance(0.2)
+    assert queue.expire_leases() == ["running"]
+    assert queue.lookup_status("running") == QueueItemStage.WAITING
+
+@pytest.mark.unit
+def test_push_jobs_leases():
+    """Test that the jobs sent by push_jobs are leased like the ones sent by
+    push_next_jobs.
+    """
+    queue = memory_queue()
+    queue.put({"item": {"data": 1}})
+    work_queue = WorkQueue(
+        queue, DummyWorkerInterface(), lease_owner="service", lease_sec=60
+    )
+
+    assert [item_id for item_id, _ in work_queue.push_jobs(["item"])] == \
+        ["item"]
+    assert queue.extend_lease(["item"], "service", 60) == ["item"]
+
+@pytest.mark.unit
+def test_job_leases_need_owner():
+    """Test that a lease without an owner is refused.
+    """
+    with pytest.raises(ValueError):
+        WorkQueue(memory_queue(), DummyWorkerInterface(), lease_sec=10)
+
+@pytest.mark.unit
+def test_job_timeout_rerun():
+    """Test that a requeued job gets a new deadline, and the deadline of
+    its earlier run is ignored.
+    """
+    clock = FakeClock()
+    queue = memory_queue(clock=clock)
+    queue.put({"item": {"data": 1}})
+    interface = DummyWorkerInterface()
+    work_queue = WorkQueue(queue, interface, default_timeout_sec=0.5,
+                           clock=clock)
+
+    work_queue.push_next_jobs()
+    interface.mock_fail("item")
+    work_queue.update_job_status()
+    queue.requeue(["item"])
+
+    clock.advance(0.2)
+    work_queue.push_next_jobs()
+    clock.advance(0.4)
+    work_queue.update_job_status()
+    assert queue.lookup_status("item") == QueueItemStage.PROCESSING
+
+    clock.advance(0.2)
+    work_queue.update_job_status()
+    assert queue.lookup_status("item") == QueueItemStage.FAIL
+
+@pytest.mark.unit
+def test_submission_failure_retried():
+    """Test that a job that fails on submission goes back to WAITING when
+    the queue has a retry policy, and is sent again once due.
+    """
+    clock = FakeClock()
+    queue = memory_queue(retry_policy=RetryPolicy(
+        max_attempts=2, backoff_sec=0.2, jitter=0
+    ), clock=clock)
+    queue.put({"item": {"data": 1}})
+    interface = DummyWorkerInterface()
+    send_job = interface.send_job
+    interface.send_job = lambda *args: (_ for _ in ()).throw(
+        RuntimeError("Submission refused")
+    )
+    work_queue = WorkQueue(queue, interface)
+
+    work_queue.push_next_jobs()
+    assert queue.lookup_status("item") == QueueItemStage.WAITING
+    assert work_queue.push_next_jobs() == []
+
+    interface.send_job = send_job
+    clock.advance(0.3)
+    assert work_queue.push_next_jobs() == [("item", {"data": 1})]
+    assert queue.lookup_status("item") == QueueItemStage.PROCESSING
@@ -45,6 +45,10 @@ def mocked_requests(*args, **kwargs):
                                 200)
     if '/requeue' in route:
         return MockResponse(None,200)
+    if '/success/' in route:
+        return MockResponse(None,200)
+    if '/fail/' in route:
+        return MockResponse(False,200)
 
     if '/get/' in route:
         split = route.split('/')
@@ -171,6 +175,23 @@ def test_client_lookup_state_fail(mock_get):
     with pytest.raises(RequestException):
         test_client.lookup_state(QueueItemStage.WAITING)
 
+@pytest.mark.unit
+@mock.patch('requests.get')
+def test_client_iter_state(mock_get):
+    """Tests that Client iter_state follows the page cursors."""
+    mock_get.side_effect = [
+        MockResponse({"item_ids": ["a", "b"], "next_after": "b"}, 200),
+        MockResponse({"item_ids": ["c"], "next_after": None}, 200),
+    ]
+
+    assert list(test_client.iter_state(QueueItemStage.WAITING, 2)) == \
+        ["a", "b", "c"]
+    route = mock_get.call_args[0][0]
+    assert route == f"{test_client.api_base_url}lookup_state/WAITING/page"
+    assert mock_get.call_args_list[0][1]["params"] == {"page_size": 2}
+    assert mock_get.call_args_list[1][1]["params"] == \
+        {"page_size": 2, "after": "b"}
+
 @pytest.mark.unit
 def test_client_lookup_state_invalid_parameter():
     """Tests that Client throws pydantic error for lookup_state."""
@@ -220,6 +241,77 @@ def test_client_get_invalid_parameter():
     with pytest.raises(ValidationError):
         test_client.get(-1)
 
+@pytest.mark.unit
+@mock.patch('requests.get', side_effect=mocked_requests)
+def test_client_get_with_lease(mock_get):
+    """Tests that Client get passes the lease as query parameters."""
+    test_client.get(2, lease_owner="consumer", lease_sec=60)
+    assert mock_get.call_args[0][0] == f"{test_client.api_base_url}get/2"
+    assert mock_get.call_args[1]["params"] == \
+        {"lease_owner": "consumer", "lease_sec": 60}
+
+@pytest.mark.unit
+@mock.patch('requests.post', side_effect=mocked_requests)
+def test_client_leases(mock_post):
+    """Tests that the Client lease methods hit the correct endpoints."""
+    test_client.extend_lease(["item"], "consumer", 60)
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}lease/extend"
+    assert mock_post.call_args[1]["json"] == \
+        {"item_ids": ["item"], "lease_owner": "consumer", "lease_sec": 60}
+
+    test_client.ack_lease(["item"], "consumer")
+    assert mock_post.call_args[0][0] == f"{test_client.api_base_url}lease/ack"
+    assert mock_post.call_args[1]["json"] == \
+        {"item_ids": ["item"], "lease_owner": "consumer"}
+
+    test_client.release_lease(["item"], "consumer")
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}lease/release"
+
+    test_client.expire_leases()
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}lease/expire"
+
+@pytest.mark.unit
+@mock.patch('requests.post', side_effect=mocked_requests)
+def test_client_get_items(mock_post):
+    """Tests that Client get_items posts the IDs to the correct endpoint."""
+    test_client.get_items(["item"])
+    assert mock_post.call_args[0][0] == f"{test_client.api_base_url}get_items"
+    assert mock_post.call_args[1]["json"] == ["item"]
+    assert mock_post.call_args[1]["params"] == {}
+
+    test_client.get_items(["item"], lease_owner="consumer", lease_sec=60)
+    assert mock_post.call_args[1]["params"] == \
+        {"lease_owner": "consumer", "lease_sec": 60}
+
+@pytest.mark.unit
+def test_client_leases_invalid_parameter():
+    """Tests that Client throws pydantic error for a non-positive lease."""
+    with pytest.raises(ValidationError):
+        test_client.extend_lease(["item"], "consumer", 0)
+
+@pytest.mark.unit
+@mock.patch('requests.post', side_effect=mocked_requests)
+def test_client_success_fail(mock_post):
+    """Tests that Client success and fail hit the correct endpoints."""
+    test_client.success('good-item-id')
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}success/good-item-id"
+    assert test_client.fail('good-item-id') is False
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}fail/good-item-id"
+
+@pytest.mark.unit
+@mock.patch('requests.post', side_effect=mocked_requests_fail)
+def test_client_success_fail_not_processing(mock_post):
+    """Tests that Client success and fail raise on an error response."""
+    with pytest.raises(RequestException):
+        test_client.success('bad-item-id')
+    with pytest.raises(RequestException):
+        test_client.fail('bad-item-id')
+
 @pytest.mark.unit
 @mock.patch('requests.post', side_effect=mocked_requests)
 def test_client_put(mock_post):
@@ -228,6 +320,16 @@ def test_client_put(mock_post):
     route = mock_post.call_args[0][0]
     assert route == f"{test_client.api_base_url}put"
 
+@pytest.mark.unit
+@mock.patch('requests.post', side_effect=mocked_requests)
+def test_client_put_priorities(mock_post):
+    """Tests that Client put sends priorities to the priorities endpoint."""
+    test_client.put({"item": 1}, priorities={"item": 5})
+    assert mock_post.call_args[0][0] == \
+        f"{test_client.api_base_url}put/priorities"
+    assert mock_post.call_args[1]["json"] == \
+        {"items": {"item": 1}, "priorities": {"item": 5}}
+
 @pytest.mark.unit
 def test_client_put_fail():
     """Tests that Client handles error if put has a bad response."""